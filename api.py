@@ -0,0 +1,373 @@
+"""HTTP API for headless ingestion of inspections.
+
+Data collectors and the DCS historian push inspections as JSON records
+({"info": {...}, "data": {...}}, as in the JSON lines files) instead of
+filling in the form.  Each record goes through the same checks as the form
+(checklist.validate_inspection, against the checklist of the record's
+"equipment_type", see equipment/) and is stored in the central inspection
+store with an idempotency key, so a collector can safely resend a batch.
+
+Run it as its own process next to the Streamlit app:
+
+    uvicorn api:app --host 127.0.0.1 --port 8600
+
+Endpoints:
+
+    GET  /health                  status and ingest queue depth
+    POST /inspections             one record, a JSON array or NDJSON lines
+    POST /inspections/validate    the same checks, without storing anything
+    GET  /inspections             stored records as NDJSON (?tag=&type=&since=&until=&limit=)
+    GET  /work-orders/{wo_number} latest revision of a work order
+    GET  /metrics                 Prometheus metrics (with VIBROSENS_METRICS=1)
+
+Writes are funnelled through one ingest queue drained by a single writer
+task in short transactions, so a collector dumping a whole route never
+holds the store's write lock for long and the app's own submissions
+interleave with it.  When the queue is full, JSON requests are refused with
+429 and Retry-After; NDJSON uploads are read chunk by chunk and simply stop
+being read until there is room, which slows the sender down through TCP.
+"""
+import asyncio
+import contextlib
+import hashlib
+import os
+from datetime import date
+
+import orjson
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import metrics
+from checklist import ChecklistError
+from equipment import checklist_for
+from records import inspection_to_record, record_to_inspection
+
+NDJSON_TYPE = "application/x-ndjson"
+
+# Largest JSON body accepted in one request (NDJSON is streamed and unbounded)
+MAX_BODY_BYTES = int(os.environ.get('VIBROSENS_API_MAX_BODY', 16 * 1024 * 1024))
+# Inspections waiting for the writer before new requests are pushed back
+MAX_PENDING = int(os.environ.get('VIBROSENS_API_MAX_PENDING', 2000))
+# Inspections stored per transaction
+WRITE_BATCH = 50
+RETRY_AFTER_SECONDS = 2
+
+
+class ORJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class Backpressure(Exception):
+    """The ingest queue has no room for a request"""
+
+
+def record_key(record):
+    """Idempotency key of a record: its own "key", or a hash of its content"""
+    if record.get('key'):
+        return str(record['key'])
+    body = orjson.dumps({'info': record.get('info'), 'data': record.get('data')},
+                        option=orjson.OPT_SORT_KEYS)
+    return f"api:{hashlib.sha256(body).hexdigest()[:32]}"
+
+
+def check_record(record, checklist=None):
+    """Validate one submitted record.  Returns (result, item): the per-record
+    result for the response and, when the record is valid, the
+    (key, inspection_info, inspection_data, expected_version) to store.
+    Records are checked against the checklist of their equipment type."""
+    if not isinstance(record, dict) or not isinstance(record.get('info'), dict):
+        return {'status': 'invalid', 'errors': ["expected an object with 'info' and 'data'"]}, None
+    key = record_key(record)
+    try:
+        inspection_info, inspection_data = record_to_inspection(record)
+    except ValueError as error:
+        return {'key': key, 'status': 'invalid', 'errors': [f"inspection_date: {error}"]}, None
+    if not isinstance(inspection_data, dict):
+        return {'key': key, 'status': 'invalid', 'errors': ["'data' must be an object"]}, None
+
+    equipment_type = inspection_info.get('equipment_type')
+    if equipment_type is not None and not isinstance(equipment_type, str):
+        return {'key': key, 'status': 'invalid', 'errors': ["equipment_type must be text."]}, None
+    try:
+        checklist = checklist or checklist_for(inspection_info)
+    except ChecklistError as error:
+        return {'key': key, 'status': 'invalid', 'errors': [str(error)]}, None
+    errors, warnings = checklist.validate_inspection(inspection_info, inspection_data)
+    expected_version = record.get('expected_version')
+    if expected_version is not None and (not isinstance(expected_version, int)
+                                         or isinstance(expected_version, bool)
+                                         or expected_version < 0):
+        errors.append("expected_version must be a non-negative integer.")
+    result = {'key': key, 'status': 'invalid' if errors else 'valid',
+              'errors': errors, 'warnings': warnings}
+    if errors:
+        return result, None
+    return result, (key, inspection_info, inspection_data, expected_version)
+
+
+class IngestWriter:
+    """Single writer task storing queued inspections in short transactions"""
+
+    def __init__(self, store, max_pending=MAX_PENDING, batch_size=WRITE_BATCH):
+        self.store = store
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(max_pending)
+        self._task = None
+
+    @property
+    def pending(self):
+        return self.queue.qsize()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+    async def submit(self, items, wait=False):
+        """Queue (key, info, data, expected_version) items and wait until they
+        are stored.  Returns {key: (status, conflict or error message)}.  Without wait,
+        raises Backpressure if the queue cannot take all items right away."""
+        if not wait and self.queue.maxsize - self.queue.qsize() < len(items):
+            raise Backpressure()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            future = loop.create_future()
+            await self.queue.put((item, future))
+            futures.append(future)
+        outcomes = await asyncio.gather(*futures)
+        return {item[0]: outcome for item, outcome in zip(items, outcomes)}
+
+    def _store(self, items):
+        """{key: outcome} of storing items in one transaction; if that fails,
+        each item is stored on its own so one bad record fails only itself"""
+        try:
+            stored, conflicts = self.store.submit(items)
+        except Exception as error:
+            if len(items) == 1:
+                metrics.count('api_store_errors')
+                return {items[0][0]: ('error', f"could not be stored: {error}")}
+            outcomes = {}
+            for item in items:
+                outcomes.update(self._store([item]))
+            return outcomes
+        stored = set(stored)
+        return {key: ('conflict', str(conflicts[key])) if key in conflicts
+                else ('stored', None) if key in stored else ('duplicate', None)
+                for key, *_ in items}
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            outcomes = await run_in_threadpool(self._store, [item for item, _ in batch])
+            for (key, *_), future in batch:
+                if not future.done():
+                    future.set_result(outcomes[key])
+
+
+def _apply_outcomes(results, outcomes):
+    for result in results:
+        outcome = outcomes.get(result.get('key'))
+        if result['status'] != 'valid' or outcome is None:
+            continue
+        result['status'], message = outcome
+        if message:
+            result['errors'] = [message]
+
+
+def _summary(results):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {'counts': counts, 'results': results}
+
+
+async def _read_json_records(request):
+    size = int(request.headers.get('content-length') or 0)
+    if size > MAX_BODY_BYTES:
+        return None, ORJSONResponse(
+            {'error': f"body larger than {MAX_BODY_BYTES} bytes; send NDJSON instead"}, 413)
+    try:
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as error:
+        return None, ORJSONResponse({'error': f"invalid JSON: {error}"}, 400)
+    return (body if isinstance(body, list) else [body]), None
+
+
+async def _ndjson_chunks(request, size):
+    """Records of an NDJSON body, size at a time, read as they arrive"""
+    buffer = b''
+    chunk = []
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                chunk.append(line)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if buffer.strip():
+        chunk.append(buffer)
+    if chunk:
+        yield chunk
+
+
+def _parse_line(line):
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError as error:
+        return {'__error__': f"invalid JSON: {error}"}
+
+
+def _check_records(records, checklist=None):
+    results, items = [], []
+    for record in records:
+        if isinstance(record, dict) and '__error__' in record:
+            results.append({'status': 'invalid', 'errors': [record['__error__']]})
+            continue
+        result, item = check_record(record, checklist)
+        results.append(result)
+        if item is not None:
+            items.append(item)
+    return results, items
+
+
+def _is_ndjson(request):
+    return request.headers.get('content-type', '').split(';')[0].strip() == NDJSON_TYPE
+
+
+def _count_ingested(summary):
+    for status, number in summary['counts'].items():
+        metrics.count('api_inspections', number, status=status)
+    return summary
+
+
+@metrics.timed('api.post_inspections')
+async def post_inspections(request):
+    writer = request.app.state.writer
+    if _is_ndjson(request):
+        results = []
+        async for lines in _ndjson_chunks(request, writer.batch_size):
+            chunk_results, items = _check_records([_parse_line(line) for line in lines])
+            if items:
+                # Waiting here stops reading the upload until the writer catches up
+                _apply_outcomes(chunk_results, await writer.submit(items, wait=True))
+            results.extend(chunk_results)
+        return ORJSONResponse(_count_ingested(_summary(results)))
+
+    records, error = await _read_json_records(request)
+    if error is not None:
+        return error
+    results, items = _check_records(records)
+    if len(items) > writer.queue.maxsize:
+        return ORJSONResponse({'error': f"more than {writer.queue.maxsize} inspections in one "
+                                        "request; split the batch or send NDJSON"}, 413)
+    if items:
+        try:
+            _apply_outcomes(results, await writer.submit(items))
+        except Backpressure:
+            metrics.count('api_backpressure')
+            return ORJSONResponse({'error': "ingest queue is full, retry later",
+                                   'pending': writer.pending}, 429,
+                                  headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+    return ORJSONResponse(_count_ingested(_summary(results)))
+
+
+async def validate_inspections(request):
+    if _is_ndjson(request):
+        results = []
+        async for lines in _ndjson_chunks(request, WRITE_BATCH):
+            results.extend(_check_records([_parse_line(line) for line in lines])[0])
+        return ORJSONResponse(_summary(results))
+    records, error = await _read_json_records(request)
+    if error is not None:
+        return error
+    return ORJSONResponse(_summary(_check_records(records)[0]))
+
+
+async def get_inspections(request):
+    store = request.app.state.store
+    params = request.query_params
+    try:
+        limit = int(params['limit']) if 'limit' in params else None
+    except ValueError:
+        limit = -1
+    if limit is not None and limit < 0:
+        return ORJSONResponse({'error': "limit must be a non-negative integer"}, 400)
+    for name in ('since', 'until'):
+        try:
+            if name in params:
+                date.fromisoformat(params[name])
+        except ValueError:
+            return ORJSONResponse({'error': f"{name} must be a date (YYYY-MM-DD)"}, 400)
+    inspections = store.query(equipment_tag=params.get('tag'),
+                              inspection_type=params.get('type'),
+                              wo_number=params.get('wo'),
+                              start_date=params.get('since'),
+                              end_date=params.get('until'),
+                              limit=limit)
+
+    def lines():
+        for inspection_info, inspection_data in inspections:
+            yield orjson.dumps(inspection_to_record(inspection_info, inspection_data)) + b'\n'
+
+    return StreamingResponse(lines(), media_type=NDJSON_TYPE)
+
+
+async def get_work_order(request):
+    work_order = await run_in_threadpool(request.app.state.store.work_order,
+                                         request.path_params['wo_number'])
+    if work_order is None:
+        return ORJSONResponse({'error': "unknown work order"}, 404)
+    return ORJSONResponse(work_order.__dict__)
+
+
+async def metrics_text(request):
+    if not metrics.ENABLED:
+        return PlainTextResponse("metrics are disabled (set VIBROSENS_METRICS=1)\n", 404)
+    return PlainTextResponse(metrics.REGISTRY.render(),
+                             media_type="text/plain; version=0.0.4")
+
+
+async def health(request):
+    return ORJSONResponse({'status': 'ok', 'pending': request.app.state.writer.pending})
+
+
+def create_app(store=None):
+    """ASGI application writing to store (default: the central inspection store)"""
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        if store is None:
+            from storage import InspectionStore, DEFAULT_DB_PATH
+            app.state.store = InspectionStore(os.environ.get('VIBROSENS_CENTRAL_DB') or DEFAULT_DB_PATH)
+        else:
+            app.state.store = store
+        app.state.writer = IngestWriter(app.state.store)
+        app.state.writer.start()
+        yield
+        await app.state.writer.stop()
+
+    return Starlette(routes=[
+        Route('/health', health),
+        Route('/metrics', metrics_text),
+        Route('/inspections', post_inspections, methods=['POST']),
+        Route('/inspections', get_inspections, methods=['GET']),
+        Route('/inspections/validate', validate_inspections, methods=['POST']),
+        Route('/work-orders/{wo_number}', get_work_order),
+    ], lifespan=lifespan)
+
+
+app = create_app()
@@ -0,0 +1,209 @@
+"""Archive tier: compaction of old inspections into immutable Parquet files.
+
+Recent inspections stay in the transactional store (storage.py).  The
+compaction job moves the full records of inspections older than HOT_DAYS
+into zstd-compressed Parquet files partitioned by month:
+
+    archive/month=2023-04/part-<run>.parquet
+
+Each file is written once, made read-only and never changed; a later run
+over the same month adds a new part.  Only the payload leaves the store:
+the indexed columns (tag, date, type, work order, ...) and the idempotency
+key of every archived inspection stay in place, with archive_part pointing
+at its file, so work order revisions, duplicate detection, queries,
+history exports and the trend views keep working unchanged and read the
+archived payloads from their part (the decoded payloads of the most
+recently used parts are cached).
+
+A part is written to a temporary file, flushed to disk and renamed before
+the store records it and drops the payloads in one transaction, so an
+interrupted run leaves at most an unreferenced file behind, which the next
+run removes.  After compaction, --vacuum returns the freed space to the
+file system.
+
+Rendered reports and exports are kept deduplicated and zstd-compressed by
+the artifact cache's disk tier (artifact_cache.py); the job also removes
+the shared report parts no cached artifact refers to any more.  Run it
+nightly, e.g.:
+
+    python archive.py --db inspections.db --archive archive/ --older-than 730 --vacuum
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import metrics
+
+DEFAULT_DIR = os.environ.get('VIBROSENS_ARCHIVE_DIR', 'archive')
+# Inspections younger than this stay in the store
+HOT_DAYS = int(os.environ.get('VIBROSENS_HOT_DAYS', 730))
+
+COMPRESSION = 'zstd'
+COMPRESSION_LEVEL = 9
+# Parts whose decoded payloads are kept in memory
+CACHED_PARTS = 8
+# Unreferenced part files older than this are removed (younger ones may be
+# a compaction running in another process)
+ORPHAN_SECONDS = 24 * 3600
+
+
+def _schema():
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int16(), pa.string())
+    return pa.schema([
+        ('id', pa.int64()),
+        ('inspection_date', pa.date32()),
+        ('equipment_tag', category),
+        ('inspection_type', category),
+        ('wo_number', pa.string()),
+        ('technician_name', category),
+        ('group_name', category),
+        ('created_at', pa.string()),
+        ('idempotency_key', pa.string()),
+        ('payload', pa.string()),
+    ])
+
+
+def _table(rows):
+    import pyarrow as pa
+
+    from storage import ARCHIVE_COLUMNS
+
+    schema = _schema()
+    columns = list(zip(*rows))
+    arrays = []
+    for name, values in zip(ARCHIVE_COLUMNS, columns):
+        field = schema.field(name)
+        if name == 'inspection_date':
+            values = [date.fromisoformat(value) for value in values]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode().cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_part(root, month, rows):
+    """Write ARCHIVE_COLUMNS rows of one month to a new immutable part file.
+    Returns (path, size in bytes)."""
+    import pyarrow.parquet as pq
+
+    directory = os.path.join(root, f"month={month}")
+    os.makedirs(directory, exist_ok=True)
+    run = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(directory, f"part-{run}.parquet")
+    temporary = path + '.tmp'
+    try:
+        pq.write_table(_table(rows), temporary, compression=COMPRESSION,
+                       compression_level=COMPRESSION_LEVEL, row_group_size=len(rows))
+        with open(temporary, 'rb') as stream:
+            os.fsync(stream.fileno())
+        os.chmod(temporary, 0o444)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return path, os.path.getsize(path)
+
+
+@lru_cache(maxsize=CACHED_PARTS)
+def _part_payloads(path):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=['id', 'payload'])
+    return dict(zip(table.column('id').to_pylist(), table.column('payload').to_pylist()))
+
+
+@metrics.timed('archive.read_payloads')
+def read_payloads(path, ids):
+    """{id: payload} of archived inspections from their part file"""
+    payloads = _part_payloads(path)
+    return {row_id: payloads[row_id] for row_id in ids}
+
+
+def _store_dir(store):
+    return os.path.dirname(os.path.abspath(store.path))
+
+
+@metrics.timed('archive.compact')
+def compact(store, root=DEFAULT_DIR, older_than_days=HOT_DAYS, today=None, log=None):
+    """Move the payloads of inspections dated more than older_than_days ago
+    from the store to new archive parts, one per month.  Returns
+    (inspections archived, parts written)."""
+    before = (today or date.today()) - timedelta(days=older_than_days)
+    archived = parts = 0
+    for month in store.archivable_months(before):
+        rows = store.archive_rows(month, before)
+        if not rows:
+            continue
+        path, size = write_part(root, month, rows)
+        store.mark_archived(os.path.relpath(os.path.abspath(path), _store_dir(store)), month,
+                            [row[0] for row in rows], size)
+        archived += len(rows)
+        parts += 1
+        metrics.count('archived_inspections', len(rows))
+        if log:
+            log(f"{month}: {len(rows)} inspections -> {path} ({size / 1024:.0f} KiB)")
+    return archived, parts
+
+
+def remove_orphans(store, root=DEFAULT_DIR, min_age=ORPHAN_SECONDS):
+    """Delete part files (and leftover temporary files) that no part in the
+    store refers to, e.g. from an interrupted run.  Returns their paths."""
+    referenced = {os.path.normpath(os.path.join(_store_dir(store), path))
+                  for _, path, *_ in store.archive_parts()}
+    removed = []
+    now = time.time()
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith(('.parquet', '.parquet.tmp')):
+                continue
+            path = os.path.normpath(os.path.abspath(os.path.join(directory, name)))
+            if path in referenced or now - os.path.getmtime(path) < min_age:
+                continue
+            os.chmod(path, 0o644)
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old inspections to the archive tier")
+    parser.add_argument('--db', default=None, help="inspection store to compact")
+    parser.add_argument('--archive', default=DEFAULT_DIR, help="root of the archive files")
+    parser.add_argument('--older-than', type=int, default=HOT_DAYS,
+                        help="archive inspections older than this many days")
+    parser.add_argument('--artifacts', default=os.environ.get('VIBROSENS_ARTIFACT_DIR'),
+                        help="artifact cache directory to collect unused report parts from")
+    parser.add_argument('--vacuum', action='store_true',
+                        help="return the freed space to the file system afterwards")
+    args = parser.parse_args(argv)
+
+    from storage import InspectionStore, DEFAULT_DB_PATH
+
+    path = args.db or os.environ.get('VIBROSENS_CENTRAL_DB') or DEFAULT_DB_PATH
+    store = InspectionStore(path)
+    started = time.perf_counter()
+    size = os.path.getsize(path)
+    for orphan in remove_orphans(store, args.archive):
+        print(f"Removed unreferenced {orphan}")
+    archived, parts = compact(store, args.archive, args.older_than, log=print)
+    if args.vacuum and archived:
+        store.vacuum()
+    if args.artifacts:
+        from artifact_cache import ArtifactCache
+        freed = ArtifactCache(max_bytes=0, directory=args.artifacts).collect_garbage()
+        print(f"Removed {freed / 1024:.0f} KiB of unused report parts")
+    hot, cold = store.tier_counts()
+    print(f"Archived {archived} inspections in {parts} parts "
+          f"({time.perf_counter() - started:.1f} s); store: {hot} recent + {cold} archived, "
+          f"{size / 2**20:.1f} -> {os.path.getsize(path) / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""Content-addressed cache of rendered inspection artifacts.
+
+Reports and exports are pure functions of the inspection and of the layout
+that renders them, so each artifact is stored under a SHA-256 of the
+canonical inspection record, the artifact kind and its template version.
+Repeated downloads of an unchanged inspection, and supervisor re-reviews of
+stored ones, are served from memory (LRU, bounded by total size) or from an
+optional on-disk tier that survives restarts.  Editing any value, or
+bumping a template version, changes the key, so nothing is ever invalidated
+by hand.
+
+On disk, artifacts are zstd-compressed.  Zip-based artifacts (DOCX, XLSX)
+are first split into their members, each stored once under its SHA-256 in
+blobs/, so the styles, theme and images every report of a template shares
+are kept once for all reports and each report only adds its own document
+part.  Blobs count towards the disk budget when first written; evicting
+an artifact also removes the blobs no other artifact of this process
+refers to, and collect_garbage() (run by the nightly archive job) removes
+the ones left unreferenced by any artifact on disk.
+"""
+import hashlib
+import io
+import json
+import os
+import struct
+import threading
+import time
+import zipfile
+from collections import Counter, OrderedDict
+
+from records import inspection_to_record
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 1024 * 1024 * 1024
+
+# Markers of the disk tier formats (files without one are stored as is)
+PACKED_MAGIC = b'VSZP'
+COMPRESSED_MAGIC = b'VSZ1'
+BLOB_DIR = 'blobs'
+# Blobs younger than this are never collected (their artifact may still be
+# being written)
+BLOB_GRACE_SECONDS = 3600
+
+
+def content_key(kind, template_version, inspection_info, inspection_data):
+    """Hex SHA-256 of an artifact kind, its template version and the canonical
+    JSON form of the inspection (key order and whitespace do not matter)"""
+    record = inspection_to_record(inspection_info, inspection_data)
+    canonical = json.dumps([kind, str(template_version), record], sort_keys=True,
+                           separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _zstd(data):
+    import pyarrow as pa
+    return struct.pack('<Q', len(data)) + pa.compress(data, codec='zstd', asbytes=True)
+
+
+def _unzstd(data):
+    import pyarrow as pa
+    size, = struct.unpack_from('<Q', data)
+    return pa.decompress(data[8:], decompressed_size=size, codec='zstd', asbytes=True)
+
+
+def _write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as stream:
+        stream.write(data)
+    os.replace(temp_path, path)
+
+
+class ArtifactCache:
+    """LRU cache of artifact bytes bounded by total size, optionally backed by
+    a directory of files named after their content key.
+
+    The disk tier, blobs included, is bounded separately and evicts the
+    least recently used artifacts (by modification time, refreshed on every
+    hit) together with the blobs only they refer to."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """Bytes held in memory"""
+        return self._size
+
+    def get(self, key):
+        """Cached bytes for a key, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        self._write_disk(key, value)
+
+    def get_or_render(self, kind, template_version, inspection_info, inspection_data, render):
+        """Bytes of an artifact, calling render(inspection_info, inspection_data)
+        only when no artifact with the same content key is cached"""
+        key = content_key(kind, template_version, inspection_info, inspection_data)
+        value = self.get(key)
+        if value is None:
+            value = render(inspection_info, inspection_data)
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """Drop the in-memory tier (files on disk are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remember(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = value
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    # On-disk tier
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, BLOB_DIR, digest[:2], digest)
+
+    def _pack(self, value):
+        """Disk form of an artifact and the blobs it refers to, writing the
+        members of zip-based ones as blobs (with the disk lock held)"""
+        buffer = io.BytesIO(value)
+        if not zipfile.is_zipfile(buffer):
+            return COMPRESSED_MAGIC + _zstd(value), []
+        members = []
+        with zipfile.ZipFile(buffer) as archive:
+            for info in archive.infolist():
+                data = archive.read(info)
+                digest = hashlib.sha256(data).hexdigest()
+                if digest not in self._blobs:
+                    stored = _zstd(data)
+                    _write_file(self._blob_path(digest), stored)
+                    self._blobs[digest] = len(stored)
+                    self._disk_size += len(stored)
+                members.append([info.filename, digest, info.compress_type,
+                                list(info.date_time), info.external_attr])
+        return (PACKED_MAGIC + _zstd(json.dumps(members).encode('utf-8')),
+                [member[1] for member in members])
+
+    def _unpack(self, stored):
+        """Artifact bytes of its disk form, or None if a blob is missing"""
+        magic, body = stored[:4], stored[4:]
+        if magic == COMPRESSED_MAGIC:
+            return _unzstd(body)
+        if magic != PACKED_MAGIC:
+            return stored
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, digest, compress_type, date_time, external_attr in json.loads(_unzstd(body)):
+                try:
+                    with open(self._blob_path(digest), 'rb') as stream:
+                        data = _unzstd(stream.read())
+                except FileNotFoundError:
+                    return None
+                info = zipfile.ZipInfo(name, tuple(date_time))
+                info.compress_type = compress_type
+                info.external_attr = external_attr
+                archive.writestr(info, data)
+        return buffer.getvalue()
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as stream:
+                value = self._unpack(stream.read())
+        except OSError:
+            return None
+        if value is None:
+            # A blob was removed by another process: drop the artifact so
+            # that it is rendered and written again
+            with self._disk_lock:
+                self._disk_index()
+                self._remove_artifact(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def _write_disk(self, key, value):
+        if not self.directory:
+            return
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        with self._disk_lock:
+            disk = self._disk_index()
+            stored, digests = self._pack(value)
+            _write_file(path, stored)
+            disk[path] = len(stored)
+            self._disk_size += len(stored)
+            self._members[path] = digests
+            self._blob_refs.update(digests)
+            if self._disk_size > self.max_disk_bytes:
+                self._evict_disk()
+
+    def collect_garbage(self, grace_seconds=BLOB_GRACE_SECONDS):
+        """Remove the blobs no artifact on disk refers to.  Returns the
+        number of bytes freed."""
+        if not self.directory:
+            return 0
+        with self._disk_lock:
+            paths = list(self._disk_index())
+        referenced = set()
+        for path in paths:
+            try:
+                with open(path, 'rb') as stream:
+                    stored = stream.read()
+            except OSError:
+                continue
+            if stored[:4] == PACKED_MAGIC:
+                referenced.update(member[1] for member in json.loads(_unzstd(stored[4:])))
+        freed = 0
+        now = time.time()
+        for root, _, files in os.walk(os.path.join(self.directory, BLOB_DIR)):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if name in referenced or now - os.path.getmtime(path) < grace_seconds:
+                        continue
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    continue
+        if freed:
+            with self._disk_lock:
+                self._disk = None  # rescanned on next use
+        return freed
+
+    def _disk_index(self):
+        """Sizes of the artifact files and blobs of the disk tier and the
+        blobs each artifact refers to, scanned once per process (with the
+        disk lock held)"""
+        if self._disk is None:
+            self._disk, self._members, self._blobs = {}, {}, {}
+            self._blob_refs = Counter()
+            self._disk_size = 0
+            blob_root = os.path.join(self.directory, BLOB_DIR)
+            for root, _, files in os.walk(self.directory):
+                in_blobs = root.startswith(blob_root)
+                for name in files:
+                    if name.endswith('.tmp'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        size = os.path.getsize(path)
+                        if in_blobs:
+                            self._blobs[name] = size
+                        else:
+                            self._disk[path] = size
+                            self._index_members(path)
+                    except (OSError, ValueError):
+                        continue
+                    self._disk_size += size
+        return self._disk
+
+    def _index_members(self, path):
+        with open(path, 'rb') as stream:
+            stored = stream.read()
+        if stored[:4] == PACKED_MAGIC:
+            digests = [member[1] for member in json.loads(_unzstd(stored[4:]))]
+            self._members[path] = digests
+            self._blob_refs.update(digests)
+
+    def _remove_artifact(self, path):
+        """Delete an artifact file and the blobs only it referred to"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self._disk_size -= self._disk.pop(path, 0)
+        for digest in self._members.pop(path, ()):
+            self._blob_refs[digest] -= 1
+            if self._blob_refs[digest] > 0:
+                continue
+            del self._blob_refs[digest]
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+            self._disk_size -= self._blobs.pop(digest, 0)
+
+    def _evict_disk(self):
+        def last_used(path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                return 0
+
+        for path in sorted(self._disk, key=last_used):
+            if self._disk_size <= self.max_disk_bytes:
+                break
+            self._remove_artifact(path)
@@ -0,0 +1,164 @@
+"""Photo attachments of inspection findings.
+
+Photos are stored once per content: the SHA-256 of the uploaded file is the
+photo id, so the same photo attached to several items or inspections (or
+uploaded again after a dropped connection) is kept and processed once.
+Each photo is kept in three variants under the attachment directory
+(VIBROSENS_ATTACHMENT_DIR, default attachments/):
+
+    <id[:2]>/<id>.orig        the uploaded file as received
+    <id[:2]>/<id>.report.jpg  at most REPORT_SIZE px, embedded in reports
+    <id[:2]>/<id>.thumb.jpg   at most THUMB_SIZE px, shown in the form
+
+Phone photos are 5-10 MB, so decoding and resizing run on a small thread
+pool instead of the Streamlit script thread (Pillow releases the GIL while
+it decodes, resizes and encodes).  JPEGs are decoded at a reduced scale
+(draft mode) straight to the report size.  The derived JPEGs are rotated
+upright and carry no EXIF data (no GPS position).
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+DEFAULT_DIR = os.environ.get('VIBROSENS_ATTACHMENT_DIR', 'attachments')
+
+PHOTO_TYPES = ("jpg", "jpeg", "png", "webp")
+MAX_PHOTO_MB = 20
+MAX_PHOTOS_PER_ITEM = 5
+
+REPORT_SIZE = 1280
+REPORT_QUALITY = 75
+THUMB_SIZE = 320
+THUMB_QUALITY = 70
+
+VARIANTS = ('orig', 'report', 'thumb')
+
+
+class AttachmentError(ValueError):
+    """Raised when an upload is too large or not a readable image"""
+
+
+@dataclass(frozen=True)
+class Photo:
+    """A stored photo, as referenced from inspection_data['attachments']"""
+    id: str
+    name: str
+    width: int
+    height: int
+
+    def to_record(self):
+        return {'id': self.id, 'name': self.name, 'width': self.width, 'height': self.height}
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record['id'], record.get('name', ''), record.get('width', 0),
+                   record.get('height', 0))
+
+
+def photo_id(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def check_upload(size, name=''):
+    """Raise AttachmentError if an upload of size bytes is too large"""
+    if size > MAX_PHOTO_MB * 1024 * 1024:
+        raise AttachmentError(f"{name or 'Photo'} is larger than {MAX_PHOTO_MB} MB")
+
+
+def _jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def derive(data):
+    """(report JPEG, thumbnail JPEG, width, height) of an uploaded image"""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # JPEGs are decoded at the smallest scale still above the report size
+            image.draft('RGB', (REPORT_SIZE, REPORT_SIZE))
+            image = ImageOps.exif_transpose(image)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.thumbnail((REPORT_SIZE, REPORT_SIZE), Image.LANCZOS)
+            report = _jpeg(image, REPORT_QUALITY)
+            width, height = image.size
+            image.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.LANCZOS)
+            thumb = _jpeg(image, THUMB_QUALITY)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as error:
+        raise AttachmentError(f"not a readable image ({error})") from None
+    return report, thumb, width, height
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as stream:
+            stream.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class AttachmentStore:
+    """Content-addressed photo store with background processing"""
+
+    def __init__(self, directory=DEFAULT_DIR, workers=2):
+        self.directory = directory
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def path(self, photo_id, variant='report'):
+        suffix = {'orig': '.orig', 'report': '.report.jpg', 'thumb': '.thumb.jpg'}[variant]
+        return os.path.join(self.directory, photo_id[:2], photo_id + suffix)
+
+    def exists(self, photo_id):
+        return os.path.exists(self.path(photo_id, 'thumb'))
+
+    def read(self, photo_id, variant='report'):
+        """Bytes of one variant of a photo, or None if it is not stored"""
+        try:
+            with open(self.path(photo_id, variant), 'rb') as stream:
+                return stream.read()
+        except FileNotFoundError:
+            return None
+
+    def add(self, data, name=''):
+        """Store an uploaded photo (once per content) and return its Photo"""
+        check_upload(len(data), name)
+        identifier = photo_id(data)
+        if self.exists(identifier):
+            from PIL import Image
+            with Image.open(self.path(identifier, 'report')) as image:
+                width, height = image.size
+            return Photo(identifier, name, width, height)
+
+        report, thumb, width, height = derive(data)
+        _write_atomic(self.path(identifier, 'orig'), data)
+        _write_atomic(self.path(identifier, 'report'), report)
+        # The thumbnail is written last: its presence marks a complete photo
+        _write_atomic(self.path(identifier, 'thumb'), thumb)
+        return Photo(identifier, name, width, height)
+
+    def submit(self, data, name=''):
+        """Process an upload on the background pool; returns a Future of its Photo"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="vibrosens-photos")
+        return self._executor.submit(self.add, data, name)
+
+
+def photos_of(inspection_data):
+    """{column: [Photo]} attached to an inspection"""
+    return {column: [Photo.from_record(record) for record in records]
+            for column, records in inspection_data.get('attachments', {}).items()}
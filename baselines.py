@@ -0,0 +1,221 @@
+"""Per-asset baselines and anomaly scores of trend readings.
+
+Every temperature, pressure and filter delta pressure reading is scored
+against the history of its own equipment tag rather than a fleet-wide
+threshold.  Each (tag, reading) keeps running statistics that are updated
+in O(1) per stored inspection:
+
+* mean and standard deviation over the last WINDOW readings (running sums),
+* an exponentially weighted mean and variance (EWMA, smoothing EWMA_ALPHA),
+* the median and median absolute deviation of the same window, kept in a
+  sorted window of fixed size, giving a robust z-score that a few past
+  outliers do not distort.
+
+The robust z-score is the headline score; the others are reported with it.
+Baselines are loaded per tag from the inspection store once and then topped
+up with only the inspections stored since, like the trend series.
+"""
+import bisect
+import math
+import threading
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+
+from checklist import get_checklist
+
+# Readings scored against their asset baseline (the trend dashboard readings)
+SCORED_COLUMNS = (
+    'reservoir_prv1_temp', 'reservoir_prv2_temp', 'reservoir_prv3_temp',
+    'hydraulic_drive_nde_temp', 'hydraulic_drive_motor_body_temp', 'hydraulic_pump_pump_temp',
+    'operating_drive_oil_pressure', 'operating_rake_torque_pressure',
+    'operating_rake_lift_pressure', 'operating_rake_lift_pressure_lifting',
+    'operating_rake_lift_pressure_lowering', 'reservoir_delta_pressure',
+)
+
+WINDOW = 30
+EWMA_ALPHA = 0.1
+MIN_HISTORY = 5
+
+# |robust z| thresholds of the score levels
+UNUSUAL_Z = 2.0
+ANOMALY_Z = 3.5
+
+# Largest |z| recorded with an inspection (a reading off a perfectly steady
+# baseline has an infinite z)
+MAX_RECORDED_Z = 99.0
+
+# Scale making the MAD a consistent estimator of the standard deviation
+MAD_SCALE = 1.4826
+
+
+@dataclass(frozen=True)
+class Score:
+    """A reading compared with its asset baseline"""
+    value: float
+    z: float
+    z_window: float
+    z_ewma: float
+    median: float
+    mean: float
+    std: float
+    n: int
+
+    @property
+    def level(self):
+        if abs(self.z) >= ANOMALY_Z:
+            return 'anomaly'
+        if abs(self.z) >= UNUSUAL_Z:
+            return 'unusual'
+        return 'normal'
+
+    def describe(self):
+        return (f"z {self.z:+.1f} vs this asset (median {self.median:.4g}, "
+                f"mean {self.mean:.4g} ± {self.std:.2g}, EWMA z {self.z_ewma:+.1f}, "
+                f"{self.n} readings)")
+
+
+def _z(deviation, scale):
+    if scale > 0:
+        return deviation / scale
+    return 0.0 if deviation == 0 else math.copysign(math.inf, deviation)
+
+
+class RunningBaseline:
+    """Running statistics of one reading of one asset"""
+
+    __slots__ = ('n', 'ewma', 'ewmv', 'window', 'ordered', 'total', 'total_sq')
+
+    def __init__(self):
+        self.n = 0
+        self.ewma = 0.0
+        self.ewmv = 0.0
+        self.window = deque()
+        self.ordered = []
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def update(self, value):
+        """Add a reading: O(1) (the window has a fixed size)"""
+        if self.n == 0:
+            self.ewma = value
+        else:
+            deviation = value - self.ewma
+            self.ewma += EWMA_ALPHA * deviation
+            self.ewmv = (1 - EWMA_ALPHA) * (self.ewmv + EWMA_ALPHA * deviation * deviation)
+        self.n += 1
+
+        self.window.append(value)
+        bisect.insort(self.ordered, value)
+        self.total += value
+        self.total_sq += value * value
+        if len(self.window) > WINDOW:
+            oldest = self.window.popleft()
+            del self.ordered[bisect.bisect_left(self.ordered, oldest)]
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+
+    def score(self, value):
+        """Score of a new reading, or None while the baseline is still too short"""
+        size = len(self.window)
+        if size < MIN_HISTORY:
+            return None
+        mean = self.total / size
+        std = math.sqrt(max(self.total_sq / size - mean * mean, 0.0) * size / (size - 1))
+        ordered = self.ordered
+        median = _median(ordered)
+        mad = _median(sorted(abs(reading - median) for reading in ordered)) * MAD_SCALE
+        # Readings steadier than their MAD can show (e.g. mostly identical
+        # values) fall back to the standard deviation
+        robust_scale = mad if mad > 0 else std
+        return Score(value=value,
+                     z=_z(value - median, robust_scale),
+                     z_window=_z(value - mean, std),
+                     z_ewma=_z(value - self.ewma, math.sqrt(self.ewmv)),
+                     median=median, mean=mean, std=std, n=self.n)
+
+
+def _median(ordered):
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+class AssetBaselines:
+    """Baselines of every scored reading of one equipment tag"""
+
+    def __init__(self, equipment_tag):
+        self.equipment_tag = equipment_tag
+        self.last_id = 0
+        self.readings = {column: RunningBaseline() for column in SCORED_COLUMNS}
+
+    def append(self, row_id, inspection_info, inspection_data):
+        for column, section_key, field_key in _scored_fields():
+            value = _to_float(inspection_data.get(section_key, {}).get(field_key))
+            if value is not None:
+                self.readings[column].update(value)
+        self.last_id = max(self.last_id, row_id)
+
+    def score(self, column, value):
+        baseline = self.readings.get(column)
+        value = _to_float(value)
+        if baseline is None or value is None:
+            return None
+        return baseline.score(value)
+
+    def score_inspection(self, inspection_data):
+        """{column: Score} of the scored readings of an inspection"""
+        scores = {}
+        for column, section_key, field_key in _scored_fields():
+            score = self.score(column, inspection_data.get(section_key, {}).get(field_key))
+            if score is not None:
+                scores[column] = score
+        return scores
+
+
+class BaselineCache:
+    """Per-tag baselines shared by every session"""
+
+    def __init__(self, batch_size=5000):
+        self.batch_size = batch_size
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def baselines(self, store, equipment_tag):
+        """Baselines of a tag, topped up with inspections stored since the last call"""
+        with self._lock:
+            assets = self._assets.get(equipment_tag)
+            if assets is None:
+                assets = self._assets[equipment_tag] = AssetBaselines(equipment_tag)
+            if store.last_id() > assets.last_id:
+                while True:
+                    rows = store.rows_after(assets.last_id, self.batch_size, equipment_tag)
+                    if not rows:
+                        break
+                    for row in rows:
+                        assets.append(*row)
+                    assets.last_id = rows[-1][0]
+            return assets
+
+
+def anomaly_scores(scores):
+    """Compact form of scores kept with a submitted inspection: {column: z}"""
+    return {column: round(max(-MAX_RECORDED_Z, min(MAX_RECORDED_Z, score.z)), 2)
+            for column, score in scores.items()}
+
+
+@lru_cache(maxsize=None)
+def _scored_fields():
+    columns = {name: (section.key, field.key) for name, section, field in get_checklist().columns()}
+    return tuple((column, *columns[column]) for column in SCORED_COLUMNS)
+
+
+def _to_float(value):
+    if value is None or value == '' or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
@@ -0,0 +1,383 @@
+"""Benchmarks of form reruns, report and export generation and analytics.
+
+Drives the app headlessly with Streamlit's AppTest and times:
+
+* app:       a full rerun of main.py and the rerun of each part of the page
+             on its own (header, inspection form, every checklist section,
+             vibration uploads, export buttons),
+* export:    Word and PDF reports, CSV and Excel exports of 1, 100 and
+             10 000 stored inspections,
+* analytics: loading the trend series and asset baselines of one tag.
+
+The app and analytics groups and every export run in a fresh process, so
+peak memory (peak RSS) is recorded per export and per group without one
+benchmark inflating the next.  Results are written as JSON, and a previous
+results file can be compared against to spot regressions:
+
+    python benchmark.py -o bench.json
+    python benchmark.py -o bench.json --compare bench_previous.json --tolerance 0.2
+    python benchmark.py --groups export --sizes 1 100
+
+Word reports take about 50 ms each, so at most --docx-max reports are
+rendered per size and the total time is extrapolated (marked
+"extrapolated"); bytes are then those of the reports rendered, and the
+estimate for the whole store is given as estimated_bytes.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_VERSION = 1
+
+GROUPS = ('app', 'export', 'analytics')
+DEFAULT_SIZES = (1, 100, 10000)
+EXPORT_CASES = ('docx', 'pdf', 'csv', 'xlsx')
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _timings(samples):
+    """Summary (ms) of a list of durations in seconds"""
+    samples_ms = [sample * 1000 for sample in samples]
+    return {'runs': len(samples_ms),
+            'median_ms': round(statistics.median(samples_ms), 3),
+            'min_ms': round(min(samples_ms), 3),
+            'max_ms': round(max(samples_ms), 3)}
+
+
+def _app_target(repo_dir, target):
+    """AppTest script rendering one part of the page (see app_targets)"""
+    import sys
+    if repo_dir not in sys.path:
+        sys.path.insert(0, repo_dir)
+    import streamlit as st
+    import main
+
+    main.initialize_session_state()
+    if target == 'header':
+        main.render_page_header()
+    elif target == 'form':
+        main.create_inspection_form()
+    elif target == 'vibration':
+        main.vibration_section()
+    elif target == 'exports':
+        if 'inspection_info' not in st.session_state:
+            import random
+            from loadtest import sample_inspection
+            info, data = sample_inspection(0, random.Random(0), main.get_checklist())
+            st.session_state.inspection_info = info
+            st.session_state.inspection_data = data
+        main.export_options()
+    elif target.startswith('section:'):
+        section = main.get_checklist().section(target.split(':', 1)[1])
+        main.render_section(section)
+
+
+def app_targets():
+    from checklist import get_checklist
+    return (['header', 'form']
+            + [f"section:{section.key}" for section in get_checklist().form_sections]
+            + ['vibration', 'exports'])
+
+
+def _time_app(app, repeat):
+    started = time.perf_counter()
+    app.run()
+    cold = time.perf_counter() - started
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    warm = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        app.run()
+        warm.append(time.perf_counter() - started)
+    return cold, warm
+
+
+def bench_app(scratch, repeat=5):
+    """Rerun times of the whole page and of each part of it"""
+    os.environ['VIBROSENS_DB'] = os.path.join(scratch, 'app.db')
+    os.environ['VIBROSENS_QUEUE_DB'] = os.path.join(scratch, 'app_queue.db')
+    from streamlit.testing.v1 import AppTest
+
+    results = []
+    app = AppTest.from_file(os.path.join(REPO_DIR, 'main.py'), default_timeout=120)
+    cold, warm = _time_app(app, repeat)
+    results.append({'group': 'app', 'name': 'page', 'cold_ms': round(cold * 1000, 3),
+                    **_timings(warm)})
+    for target in app_targets():
+        app = AppTest.from_function(_app_target, args=(REPO_DIR, target), default_timeout=120)
+        cold, warm = _time_app(app, repeat)
+        results.append({'group': 'app', 'name': target, 'cold_ms': round(cold * 1000, 3),
+                        **_timings(warm)})
+    return results
+
+
+def build_store(path, size, equipment_tags=20):
+    """Inspection store filled with size sample inspections"""
+    from checklist import get_checklist
+    from loadtest import sample_inspection
+    from storage import InspectionStore
+
+    checklist = get_checklist()
+    store = InspectionStore(path)
+    store.bulk_insert(sample_inspection(index, random.Random(index), checklist,
+                                        equipment_tags=equipment_tags)
+                      for index in range(size))
+    return store
+
+
+def _export(case, inspections, output_dir):
+    """Render case for a stream of inspections.  Returns (bytes, inspections rendered)"""
+    if case == 'csv' or case == 'xlsx':
+        from data_export import export_file
+        path = os.path.join(output_dir, f"export.{case}")
+        rendered = export_file(inspections, path)
+        return os.path.getsize(path), rendered
+    if case == 'pdf':
+        from pdf_report import render_archive
+        path = os.path.join(output_dir, "archive.pdf")
+        with open(path, 'wb') as target:
+            rendered, _ = render_archive(inspections, target)
+        return os.path.getsize(path), rendered
+    if case == 'docx':
+        from report import create_docx_report
+        size = rendered = 0
+        for inspection_info, inspection_data in inspections:
+            buffer = io.BytesIO()
+            create_docx_report(inspection_info, inspection_data).save(buffer)
+            size += buffer.tell()
+            rendered += 1
+        return size, rendered
+    raise ValueError(f"unknown export {case!r}")
+
+
+def _export_case(case, db_path, size, docx_max, output_dir, results):
+    """Child process timing one export of every inspection of a store"""
+    sys.path.insert(0, REPO_DIR)
+    from storage import InspectionStore
+
+    store = InspectionStore(db_path)
+    # Untimed warm-up, so imports and templates built once per process are
+    # not counted (they show in the app group's cold times)
+    _export(case, store.query(limit=1), output_dir)
+    started = time.perf_counter()
+    output_bytes, rendered = _export(case, store.query(limit=docx_max if case == 'docx' else None),
+                                     output_dir)
+    elapsed = time.perf_counter() - started
+    result = {'group': 'export', 'name': case, 'inspections': size,
+              'seconds': round(elapsed, 4),
+              'per_inspection_ms': round(elapsed * 1000 / max(rendered, 1), 3),
+              'bytes': output_bytes, 'peak_rss_mb': peak_rss_mb()}
+    if rendered < size:
+        result['rendered'] = rendered
+        result['seconds'] = round(elapsed * size / rendered, 4)
+        result['estimated_bytes'] = output_bytes * size // rendered
+        result['extrapolated'] = True
+    store.close()
+    results.put(result)
+
+
+def bench_export(scratch, sizes, docx_max=100):
+    """Time every export at each store size, each in a fresh process"""
+    results = []
+    for size in sizes:
+        db_path = os.path.join(scratch, f"export_{size}.db")
+        build_store(db_path, size).close()
+        for case in EXPORT_CASES:
+            results.append(_in_process(_export_case, case, db_path, size, docx_max,
+                                       tempfile.mkdtemp(dir=scratch)))
+    return results
+
+
+def bench_analytics(scratch, sizes):
+    """Cold load of one tag's trend series and baselines at each store size"""
+    from baselines import BaselineCache
+    from trends import TrendCache
+
+    results = []
+    for size in sizes:
+        store = build_store(os.path.join(scratch, f"analytics_{size}.db"), size)
+        equipment_tag = next(iter(store.query(limit=1)))[0]['equipment_tag']
+        for name, load in (('trend_series', lambda: TrendCache().series(store, equipment_tag)
+                                                        .downsample('reservoir_delta_pressure')),
+                           ('baselines', lambda: BaselineCache().baselines(store, equipment_tag))):
+            started = time.perf_counter()
+            load()
+            results.append({'group': 'analytics', 'name': name, 'inspections': size,
+                            'seconds': round(time.perf_counter() - started, 4)})
+        store.close()
+    return results
+
+
+def _run_group(group, options, scratch, results):
+    """Child process running the app or analytics group"""
+    sys.path.insert(0, REPO_DIR)
+    if group == 'app':
+        found = bench_app(scratch, options['repeat'])
+    else:
+        found = bench_analytics(scratch, options['sizes'])
+    results.put((found, peak_rss_mb()))
+
+
+def _in_process(target, *args):
+    """Run target(*args, queue) in a fresh process and return what it puts.
+    Raises RuntimeError if the process exits without putting a result."""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    try:
+        while True:
+            # Checked before waiting, so a result put just before exiting is still read
+            alive = process.is_alive()
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                if not alive:
+                    raise RuntimeError(f"{target.__name__}({args[0]!r}) exited with code {process.exitcode} "
+                                       f"without a result (see its traceback above)") from None
+    finally:
+        process.join()
+
+
+def run_benchmarks(groups=GROUPS, sizes=DEFAULT_SIZES, repeat=5, docx_max=100):
+    """Run the benchmark groups in fresh processes and return the results"""
+    options = {'sizes': list(sizes), 'repeat': repeat, 'docx_max': docx_max}
+    results = []
+    peaks = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        for group in groups:
+            if group == 'export':
+                found = bench_export(scratch, sizes, docx_max)
+                peak = max((result['peak_rss_mb'] or 0 for result in found), default=None)
+            else:
+                found, peak = _in_process(_run_group, group, options, scratch)
+            results.extend(found)
+            peaks[group] = peak
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'peak_rss_mb': peaks,
+        'results': results,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _result_key(result):
+    return result['group'], result['name'], result.get('inspections')
+
+
+def _result_time(result):
+    return result['median_ms'] / 1000 if 'median_ms' in result else result['seconds']
+
+
+def compare(current, previous, tolerance=0.2):
+    """(group, name, inspections, previous s, current s, ratio) of the results
+    found in both runs, and the ones more than tolerance slower"""
+    before = {_result_key(result): result for result in previous['results']}
+    rows, regressions = [], []
+    for result in current['results']:
+        old = before.get(_result_key(result))
+        if old is None:
+            continue
+        old_time, new_time = _result_time(old), _result_time(result)
+        ratio = new_time / old_time if old_time > 0 else float('inf')
+        row = (*_result_key(result), old_time, new_time, ratio)
+        rows.append(row)
+        if ratio > 1 + tolerance:
+            regressions.append(row)
+    return rows, regressions
+
+
+def _describe(result):
+    label = f"{result['group']:9s} {result['name']:24s}"
+    if 'median_ms' in result:
+        return (f"{label} median {result['median_ms']:9.1f} ms  "
+                f"(cold {result['cold_ms']:.0f} ms, {result['runs']} reruns)")
+    line = f"{label} {result['inspections']:>6d} inspections {result['seconds']:9.3f} s"
+    if 'per_inspection_ms' in result:
+        line += f"  {result['per_inspection_ms']:8.2f} ms each"
+    if result.get('peak_rss_mb') is not None:
+        line += f"  peak {result['peak_rss_mb']:.0f} MB"
+    if result.get('extrapolated'):
+        line += f"  (extrapolated from {result['rendered']})"
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark form reruns, exports and analytics")
+    parser.add_argument('-o', '--output', default=None, help="write the results to this JSON file")
+    parser.add_argument('--groups', nargs='+', choices=GROUPS, default=list(GROUPS),
+                        help="benchmark groups to run (default: all)")
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES),
+                        help="numbers of stored inspections to export and analyse")
+    parser.add_argument('--repeat', type=int, default=5, help="reruns timed per page part")
+    parser.add_argument('--docx-max', type=int, default=100,
+                        help="Word reports rendered per size before extrapolating")
+    parser.add_argument('--compare', default=None,
+                        help="previous results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="slowdown ratio above which a result counts as a regression")
+    args = parser.parse_args(argv)
+
+    summary = run_benchmarks(args.groups, args.sizes, args.repeat, args.docx_max)
+    for result in summary['results']:
+        print(_describe(result))
+    print("peak RSS (MB): " + ", ".join(f"{group} {peak}" for group, peak in
+                                        summary['peak_rss_mb'].items()))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as stream:
+            json.dump(summary, stream, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as stream:
+            previous = json.load(stream)
+        rows, regressions = compare(summary, previous, args.tolerance)
+        print(f"\nCompared with {previous.get('commit') or args.compare}:")
+        for group, name, inspections, old_time, new_time, ratio in rows:
+            flag = "  REGRESSION" if ratio > 1 + args.tolerance else ""
+            size = f" @{inspections}" if inspections is not None else ""
+            print(f"  {group:9s} {name + size:30s} {old_time * 1000:10.1f} ms -> "
+                  f"{new_time * 1000:10.1f} ms  x{ratio:.2f}{flag}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""Declarative inspection checklists.
+
+Each equipment type is described by one JSON schema in checklists/ listing
+its sections and fields.  The schema is parsed, validated and compiled once
+per process; the form, range validators, Word report layout and export
+columns are all generated from the compiled checklist.  Optional "aliases"
+record how a section or field is labelled on the legacy Word check sheets,
+so filled copies of those can be imported (see sheet_import.py).  An
+optional "report" object sets the page header and the inspection details
+rows of the report.  Which checklist an inspection uses follows from its
+equipment type (see equipment/).
+"""
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+CHECKLIST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checklists')
+DEFAULT_CHECKLIST = 'thickener_power_pack'
+
+FIELD_TYPES = ('status', 'number', 'choice', 'text')
+STATUS_OPTIONS = ("OK", "Not OK")
+
+# Inspection details every submission needs, with their form labels
+REQUIRED_INFO = (
+    ('technician_name', "Technician name"),
+    ('group', "Group"),
+    ('equipment_tag', "Equipment tag"),
+)
+
+# Inspection details that must be text or yes/no when given
+TEXT_INFO = ('technician_name', 'group', 'equipment_tag', 'wo_number', 'inspection_type',
+             'equipment_type')
+FLAG_INFO = ('visual_check', 'vibration_check')
+
+# Report page header and inspection details rows (label, inspection_info
+# key or None for a blank value) unless a checklist sets its own
+REPORT_HEADER = "AMBATOVY - Condition Monitoring Rotating Equipment"
+REPORT_DETAILS = (
+    ("Review by:", None),
+    ("Equipment Tag #:", 'equipment_tag'),
+    ("Work Order #:", 'wo_number'),
+    ("Inspection Type:", 'inspection_type'),
+    ("Visual Check:", 'visual_check'),
+    ("Vibration Check:", 'vibration_check'),
+)
+
+# Keys of inspection_data derived by the app rather than entered per section
+DERIVED_DATA_KEYS = ('vibration', 'anomaly_scores', 'attachments')
+
+
+class ChecklistError(ValueError):
+    """Raised when a checklist schema is invalid"""
+
+
+@dataclass(frozen=True)
+class Limits:
+    low: float = None
+    high: float = None
+    high_exclusive: bool = False
+    message: str = None
+
+    def check(self, value):
+        """Return the warning message if value is outside the limits"""
+        if value is None or value == '':
+            return None
+        value = float(value)
+        if self.low is not None and value < self.low:
+            return self.message
+        if self.high is not None and (value >= self.high if self.high_exclusive else value > self.high):
+            return self.message
+        return None
+
+
+@dataclass(frozen=True)
+class Field:
+    key: str
+    type: str
+    label: str
+    report_label: str
+    heading: str = None
+    options: tuple = ()
+    min: float = None
+    max: float = None
+    step: float = None
+    limits: Limits = None
+    group: str = None
+    form: bool = True
+    report: bool = True
+    aliases: tuple = ()
+
+
+@dataclass(frozen=True)
+class Section:
+    key: str
+    title: str
+    icon: str
+    expander: str
+    intro: str
+    report_columns: int
+    groups: tuple
+    fields: tuple
+    form: bool = True
+    report: bool = True
+    aliases: tuple = ()
+
+    @property
+    def form_fields(self):
+        return tuple(field for field in self.fields if field.form)
+
+    @property
+    def report_fields(self):
+        return tuple(field for field in self.fields if field.report)
+
+    def form_layout(self):
+        """Group form fields into rows of (columns, fields); consecutive fields
+        sharing a group are laid out side by side"""
+        columns = dict(self.groups)
+        rows = []
+        for field in self.form_fields:
+            if field.group and rows and rows[-1][0] == field.group:
+                rows[-1][2].append(field)
+            else:
+                rows.append((field.group, columns.get(field.group, 1), [field]))
+        return [(n_columns, fields) for _, n_columns, fields in rows]
+
+    def check_values(self, values):
+        """Return the error messages for values a form could not have produced
+        (unknown fields, wrong types, values outside the input bounds or options)"""
+        fields = {field.key: field for field in self.fields}
+        errors = []
+        for key, value in values.items():
+            field = fields.get(key)
+            where = f"{self.key}.{key}"
+            if field is None:
+                errors.append(f"{where}: unknown field")
+            elif value is None or value == '':
+                continue
+            elif field.type == 'number':
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    errors.append(f"{where}: expected a number")
+                elif field.min is not None and value < field.min:
+                    errors.append(f"{where}: {value} is below the minimum {field.min}")
+                elif field.max is not None and value > field.max:
+                    errors.append(f"{where}: {value} is above the maximum {field.max}")
+            elif field.options:
+                if value not in field.options:
+                    errors.append(f"{where}: expected one of {list(field.options)}")
+            elif not isinstance(value, str):
+                errors.append(f"{where}: expected text")
+        return errors
+
+    def validate(self, values):
+        """Return the warning messages for out-of-range values"""
+        warnings = []
+        for field in self.fields:
+            if field.limits is not None:
+                message = field.limits.check(values.get(field.key))
+                if message:
+                    warnings.append(message)
+        return warnings
+
+
+@dataclass(frozen=True)
+class Checklist:
+    name: str
+    version: int
+    title: str
+    inspection_types: tuple
+    sections: tuple
+    unmapped_sections: tuple = ()
+    report_header: str = REPORT_HEADER
+    report_details: tuple = REPORT_DETAILS
+
+    @property
+    def form_sections(self):
+        return tuple(section for section in self.sections if section.form)
+
+    @property
+    def report_sections(self):
+        return tuple(section for section in self.sections if section.report)
+
+    def section(self, key):
+        for section in self.sections:
+            if section.key == key:
+                return section
+        raise KeyError(key)
+
+    def validate_inspection(self, inspection_info, inspection_data):
+        """Check a submitted inspection the way the form does.
+        Returns (errors, warnings); an inspection with errors must not be stored."""
+        errors = [f"{key} must be text." for key in TEXT_INFO
+                  if inspection_info.get(key) is not None and not isinstance(inspection_info[key], str)]
+        errors += [f"{key} must be true or false." for key in FLAG_INFO
+                   if inspection_info.get(key) is not None and not isinstance(inspection_info[key], bool)]
+        errors += [f"{label} is required." for key, label in REQUIRED_INFO
+                   if not str(inspection_info.get(key) or '').strip()]
+        inspection_date = inspection_info.get('inspection_date')
+        if not hasattr(inspection_date, 'toordinal'):
+            errors.append("Inspection date is required (YYYY-MM-DD).")
+        if inspection_info.get('inspection_type') not in self.inspection_types:
+            errors.append(f"Inspection type must be one of {list(self.inspection_types)}.")
+
+        warnings = []
+        sections = {section.key: section for section in self.sections}
+        for key, values in inspection_data.items():
+            if key in DERIVED_DATA_KEYS:
+                continue
+            section = sections.get(key)
+            if section is None:
+                errors.append(f"{key}: unknown section")
+            elif not isinstance(values, dict):
+                errors.append(f"{key}: expected an object of field values")
+            else:
+                section_errors = section.check_values(values)
+                errors.extend(section_errors)
+                if not section_errors:
+                    warnings.extend(section.validate(values))
+        return errors, warnings
+
+    def columns(self):
+        """(column name, section, field) for every field, in schema order"""
+        return [(f"{section.key}_{field.key}", section, field)
+                for section in self.sections for field in section.fields]
+
+
+def _require(mapping, key, where):
+    if key not in mapping:
+        raise ChecklistError(f"{where}: missing '{key}'")
+    return mapping[key]
+
+
+def _compile_limits(spec, where):
+    if spec is None:
+        return None
+    unknown = set(spec) - {'low', 'high', 'high_exclusive', 'message'}
+    if unknown:
+        raise ChecklistError(f"{where}: unknown limit settings {sorted(unknown)}")
+    if spec.get('low') is None and spec.get('high') is None:
+        raise ChecklistError(f"{where}: limits need 'low' and/or 'high'")
+    return Limits(low=spec.get('low'), high=spec.get('high'),
+                  high_exclusive=spec.get('high_exclusive', False),
+                  message=_require(spec, 'message', where))
+
+
+def _compile_field(spec, where):
+    key = _require(spec, 'key', where)
+    where = f"{where}.{key}"
+    field_type = _require(spec, 'type', where)
+    if field_type not in FIELD_TYPES:
+        raise ChecklistError(f"{where}: unknown field type '{field_type}'")
+
+    options = tuple(spec.get('options', STATUS_OPTIONS if field_type == 'status' else ()))
+    if field_type == 'choice' and not options:
+        raise ChecklistError(f"{where}: choice fields need options")
+    if spec.get('limits') and field_type != 'number':
+        raise ChecklistError(f"{where}: only number fields can have limits")
+
+    label = _require(spec, 'label', where)
+    return Field(
+        key=key,
+        type=field_type,
+        label=label,
+        report_label=spec.get('report_label', label),
+        heading=spec.get('heading'),
+        options=options,
+        min=spec.get('min'),
+        max=spec.get('max'),
+        step=spec.get('step'),
+        limits=_compile_limits(spec.get('limits'), where),
+        group=spec.get('group'),
+        form=spec.get('form', True),
+        report=spec.get('report', True),
+        aliases=tuple(spec.get('aliases', ())),
+    )
+
+
+def _compile_section(spec, where):
+    key = _require(spec, 'key', where)
+    where = f"{where}.{key}"
+    fields = tuple(_compile_field(field, where) for field in _require(spec, 'fields', where))
+
+    keys = [field.key for field in fields]
+    duplicates = sorted({k for k in keys if keys.count(k) > 1})
+    if duplicates:
+        raise ChecklistError(f"{where}: duplicate fields {duplicates}")
+
+    report_columns = spec.get('report_columns', 2)
+    if report_columns not in (2, 3):
+        raise ChecklistError(f"{where}: report_columns must be 2 or 3")
+
+    groups = spec.get('groups', {})
+    undefined = {field.group for field in fields if field.group} - set(groups)
+    if undefined:
+        raise ChecklistError(f"{where}: undefined groups {sorted(undefined)}")
+
+    title = _require(spec, 'title', where)
+    return Section(
+        key=key,
+        title=title,
+        icon=spec.get('icon', ''),
+        expander=spec.get('expander', title),
+        intro=spec.get('intro'),
+        report_columns=report_columns,
+        groups=tuple(groups.items()),
+        fields=fields,
+        form=spec.get('form', True),
+        report=spec.get('report', True),
+        aliases=tuple(spec.get('aliases', ())),
+    )
+
+
+def _compile_report(spec, where):
+    where = f"{where}.report"
+    unknown = set(spec) - {'header', 'details'}
+    if unknown:
+        raise ChecklistError(f"{where}: unknown report settings {sorted(unknown)}")
+    details = []
+    for row in spec.get('details', REPORT_DETAILS):
+        if not (isinstance(row, (list, tuple)) and len(row) == 2 and isinstance(row[0], str)):
+            raise ChecklistError(f"{where}: details rows are [label, info key or null]")
+        details.append(tuple(row))
+    return spec.get('header', REPORT_HEADER), tuple(details)
+
+
+def compile_checklist(spec, name):
+    """Validate a parsed checklist schema and compile it"""
+    where = name
+    sections = tuple(_compile_section(section, where)
+                     for section in _require(spec, 'sections', where))
+
+    keys = [section.key for section in sections]
+    duplicates = sorted({k for k in keys if keys.count(k) > 1})
+    if duplicates:
+        raise ChecklistError(f"{where}: duplicate sections {duplicates}")
+
+    report_header, report_details = _compile_report(spec.get('report', {}), where)
+    return Checklist(
+        name=name,
+        version=spec.get('version', 1),
+        title=_require(spec, 'title', where),
+        inspection_types=tuple(_require(spec, 'inspection_types', where)),
+        sections=sections,
+        unmapped_sections=tuple(spec.get('unmapped_sections', ())),
+        report_header=report_header,
+        report_details=report_details,
+    )
+
+
+def load_checklist(name=DEFAULT_CHECKLIST):
+    """Parse, validate and compile the checklist schema checklists/<name>.json"""
+    path = os.path.join(CHECKLIST_DIR, f"{name}.json")
+    with open(path, encoding='utf-8') as stream:
+        try:
+            spec = json.load(stream)
+        except json.JSONDecodeError as error:
+            raise ChecklistError(f"{path}: {error}") from error
+    return compile_checklist(spec, name)
+
+
+@lru_cache(maxsize=None)
+def get_checklist(name=DEFAULT_CHECKLIST):
+    """Compiled checklist, loaded once per process"""
+    return load_checklist(name)
@@ -0,0 +1,159 @@
+"""Streaming CSV and Excel export of inspections.
+
+One row per inspection with columns fixed by the checklist: the inspection
+details followed by one column per checklist field (section_field).  Rows
+are written one at a time straight from the inspection store, to CSV with
+the csv module or to Excel with openpyxl in write-only mode, so memory use
+does not grow with the number of inspections exported.  The columns of
+each equipment type differ, so a file holds the inspections of one type:
+
+    python data_export.py --db inspections.db -o fleet.xlsx --since 2024-01-01
+    python data_export.py --db inspections.db -o fans.csv --equipment-type fan
+"""
+import argparse
+import csv
+import io
+from datetime import date
+
+import metrics
+from checklist import get_checklist
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Bump whenever the exported columns or formatting change
+EXPORT_VERSION = 1
+
+INFO_COLUMNS = [
+    ('Date', 'inspection_date'),
+    ('Technician', 'technician_name'),
+    ('Group', 'group'),
+    ('Equipment_Tag', 'equipment_tag'),
+    ('WO_Number', 'wo_number'),
+    ('Inspection_Type', 'inspection_type'),
+    ('Visual_Check', 'visual_check'),
+    ('Vibration_Check', 'vibration_check'),
+]
+
+
+def export_header(checklist=None):
+    checklist = checklist or get_checklist()
+    return [name for name, _ in INFO_COLUMNS] + [name for name, _, _ in checklist.columns()]
+
+
+def export_version(checklist=None):
+    """Version of the export layout: export format plus checklist schema"""
+    checklist = checklist or get_checklist()
+    return f"export{EXPORT_VERSION}/{checklist.name}/{checklist.version}"
+
+
+def export_row(inspection_info, inspection_data, checklist=None):
+    """Values of one inspection in export_header() order; empty readings are None"""
+    checklist = checklist or get_checklist()
+    row = [inspection_info.get(key) for _, key in INFO_COLUMNS]
+    for _, section, field in checklist.columns():
+        value = inspection_data.get(section.key, {}).get(field.key)
+        if value == '':
+            value = None
+        elif value is not None and field.type == 'number':
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                pass
+        row.append(value)
+    return row
+
+
+@metrics.timed('export.csv')
+def write_csv(inspections, stream, checklist=None):
+    """Write (inspection_info, inspection_data) pairs to a text stream as CSV.
+    Returns the number of inspections written."""
+    checklist = checklist or get_checklist()
+    writer = csv.writer(stream)
+    writer.writerow(export_header(checklist))
+    count = 0
+    for inspection_info, inspection_data in inspections:
+        row = export_row(inspection_info, inspection_data, checklist)
+        row[0] = row[0].isoformat() if isinstance(row[0], date) else row[0]
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+@metrics.timed('export.xlsx')
+def write_xlsx(inspections, target, checklist=None, sheet_title="Inspections"):
+    """Write (inspection_info, inspection_data) pairs to an Excel workbook
+    (path or binary stream) using openpyxl's write-only mode.
+    Returns the number of inspections written."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    checklist = checklist or get_checklist()
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_title)
+    sheet.freeze_panes = 'A2'
+
+    header = []
+    for name in export_header(checklist):
+        cell = WriteOnlyCell(sheet, value=name)
+        cell.font = Font(bold=True)
+        header.append(cell)
+    sheet.append(header)
+
+    count = 0
+    for inspection_info, inspection_data in inspections:
+        sheet.append(export_row(inspection_info, inspection_data, checklist))
+        count += 1
+    workbook.save(target)
+    return count
+
+
+def csv_bytes(inspections, checklist=None):
+    """CSV export as bytes, e.g. for a download button"""
+    stream = io.StringIO()
+    write_csv(inspections, stream, checklist)
+    return stream.getvalue().encode('utf-8')
+
+
+def xlsx_bytes(inspections, checklist=None):
+    """Excel export as bytes, e.g. for a download button"""
+    stream = io.BytesIO()
+    write_xlsx(inspections, stream, checklist)
+    return stream.getvalue()
+
+
+def export_file(inspections, path, checklist=None):
+    """Stream inspections to a .csv or .xlsx file, chosen by extension"""
+    if path.lower().endswith('.xlsx'):
+        return write_xlsx(inspections, path, checklist)
+    with open(path, 'w', newline='', encoding='utf-8') as stream:
+        return write_csv(inspections, stream, checklist)
+
+
+def main(argv=None):
+    from equipment import DEFAULT_EQUIPMENT, REGISTRY, equipment_key, get_equipment
+
+    parser = argparse.ArgumentParser(description="Export stored inspections to CSV or Excel")
+    parser.add_argument('--db', default=None, help="inspection store to export from")
+    parser.add_argument('-o', '--output', required=True, help="output .csv or .xlsx file")
+    parser.add_argument('--tag', help="only this equipment tag")
+    parser.add_argument('--type', dest='inspection_type', help="only this inspection type")
+    parser.add_argument('--equipment-type', choices=list(REGISTRY), default=DEFAULT_EQUIPMENT,
+                        help="equipment type to export, with its checklist's columns")
+    parser.add_argument('--since', help="first inspection date (YYYY-MM-DD)")
+    parser.add_argument('--until', help="last inspection date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    from storage import InspectionStore, DEFAULT_DB_PATH
+    store = InspectionStore(args.db or DEFAULT_DB_PATH)
+    inspections = store.query(equipment_tag=args.tag, inspection_type=args.inspection_type,
+                              start_date=args.since, end_date=args.until)
+    inspections = ((info, data) for info, data in inspections
+                   if equipment_key(info) == args.equipment_type)
+    count = export_file(inspections, args.output,
+                        get_equipment(args.equipment_type).get_checklist())
+    print(f"Exported {count} inspections to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
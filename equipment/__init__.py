@@ -0,0 +1,95 @@
+"""Registry of the equipment types the app can inspect.
+
+Each equipment type is a module of this package (or any importable module
+registered with register()) defining EQUIPMENT, an EquipmentType naming
+the checklist that brings its sections and report layout
+(checklists/<name>.json) and its limits (checklists/<name>.limits.json):
+
+    # equipment/fan.py
+    from equipment import EquipmentType
+
+    EQUIPMENT = EquipmentType(key='fan', title="Fans and Blowers",
+                              checklist='fan', tag_prefix="31 - FN -")
+
+The registry itself only lists keys, titles and module names, so the app
+can offer every type without importing any of them.  A type's module is
+imported, and its checklist and limits compiled, the first time it is
+selected, once per process; other types are never loaded.  Inspections
+record the key of their type in inspection_info['equipment_type'];
+inspections without one are of DEFAULT_EQUIPMENT.
+"""
+import importlib
+from dataclasses import dataclass
+from functools import lru_cache
+
+from checklist import ChecklistError, get_checklist
+
+DEFAULT_EQUIPMENT = 'thickener_power_pack'
+
+# key -> (title shown in the app, module defining EQUIPMENT)
+REGISTRY = {
+    'thickener_power_pack': ("Thickener Hydraulic Power Packs", 'equipment.thickener_power_pack'),
+    'centrifugal_pump': ("Centrifugal Pumps", 'equipment.centrifugal_pump'),
+    'fan': ("Fans and Blowers", 'equipment.fan'),
+    'gearbox': ("Gearboxes", 'equipment.gearbox'),
+    'compressor': ("Compressors", 'equipment.compressor'),
+}
+
+
+@dataclass(frozen=True)
+class EquipmentType:
+    key: str
+    title: str
+    checklist: str
+    tag_prefix: str = ''
+
+    def get_checklist(self):
+        """Compiled checklist: sections, validation and report layout"""
+        return get_checklist(self.checklist)
+
+    def get_rules(self):
+        """Compiled limit rules of the checklist"""
+        from rules import get_rules
+        return get_rules(self.checklist)
+
+
+def register(key, title, module):
+    """Add an equipment type defined in another module (e.g. a site plugin)"""
+    if key in REGISTRY:
+        raise ValueError(f"equipment type '{key}' is already registered")
+    REGISTRY[key] = (title, module)
+
+
+def equipment_types():
+    """[(key, title)] of every registered type, without loading any of them"""
+    return [(key, title) for key, (title, _) in REGISTRY.items()]
+
+
+@lru_cache(maxsize=None)
+def get_equipment(key=DEFAULT_EQUIPMENT):
+    """Equipment type of a key: its module is imported and its checklist and
+    limits compiled on first use, once per process"""
+    if key not in REGISTRY:
+        raise ChecklistError(f"Unknown equipment type '{key}'; expected one of {list(REGISTRY)}")
+    _, module = REGISTRY[key]
+    equipment = importlib.import_module(module).EQUIPMENT
+    if equipment.key != key:
+        raise ChecklistError(f"{module} defines equipment type '{equipment.key}', not '{key}'")
+    equipment.get_checklist()
+    equipment.get_rules()
+    return equipment
+
+
+def equipment_key(inspection_info):
+    """Key of the equipment type of an inspection, without loading the type"""
+    return inspection_info.get('equipment_type') or DEFAULT_EQUIPMENT
+
+
+def equipment_of(inspection_info):
+    """Equipment type of an inspection"""
+    return get_equipment(equipment_key(inspection_info))
+
+
+def checklist_for(inspection_info):
+    """Checklist of an inspection's equipment type"""
+    return equipment_of(inspection_info).get_checklist()
@@ -0,0 +1,9 @@
+"""Centrifugal slurry, process water and dosing pumps"""
+from equipment import EquipmentType
+
+EQUIPMENT = EquipmentType(
+    key='centrifugal_pump',
+    title="Centrifugal Pumps",
+    checklist='centrifugal_pump',
+    tag_prefix="31 - PP -",
+)
@@ -0,0 +1,9 @@
+"""Air and process gas compressors"""
+from equipment import EquipmentType
+
+EQUIPMENT = EquipmentType(
+    key='compressor',
+    title="Compressors",
+    checklist='compressor',
+    tag_prefix="31 - CP -",
+)
@@ -0,0 +1,9 @@
+"""Process and ventilation fans and blowers"""
+from equipment import EquipmentType
+
+EQUIPMENT = EquipmentType(
+    key='fan',
+    title="Fans and Blowers",
+    checklist='fan',
+    tag_prefix="31 - FN -",
+)
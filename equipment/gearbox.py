@@ -0,0 +1,9 @@
+"""Conveyor, agitator and mill gearboxes"""
+from equipment import EquipmentType
+
+EQUIPMENT = EquipmentType(
+    key='gearbox',
+    title="Gearboxes",
+    checklist='gearbox',
+    tag_prefix="31 - GB -",
+)
@@ -0,0 +1,9 @@
+"""Hydraulic power packs of the thickener rake drives"""
+from equipment import EquipmentType
+
+EQUIPMENT = EquipmentType(
+    key='thickener_power_pack',
+    title="Thickener Hydraulic Power Packs",
+    checklist='thickener_power_pack',
+    tag_prefix="31 - TM -",
+)
@@ -0,0 +1,363 @@
+"""Forecasts of filter clogging and temperature drift for maintenance planning.
+
+Filter delta pressure, the PRV temperatures and the hydraulic pump
+temperature of every asset are fitted against time, and each fit is
+projected forward to the date it reaches the asset's alert and alarm
+levels (from rules.py, so per-asset overrides apply).  The result is one
+fleet-wide list ranked by the number of days left, so filters can be
+changed and coolers cleaned before a reading turns yellow or red.
+
+Fits are robust: the Theil-Sen estimator (median of the slopes between
+every pair of readings) ignores a few bad readings or a one-off hot day.
+Each series is fitted both as a straight line and as an exponential (a
+straight line through the logarithm of the readings, as a clogging filter
+typically behaves), and the model with the smaller median absolute
+residual is used.  Only the last MAX_POINTS readings within WINDOW_DAYS of
+an asset's latest reading are used, so a changed filter restarts its trend
+quickly enough.
+
+Each inspection is forecast with the readings and limits of its equipment
+type: the filter and temperatures above for thickener power packs, and
+for other types every reading with a high alert or alarm limit.
+
+Every (asset, reading) series of a type is fitted at once: the readings
+are laid out as one padded matrix per reading column and the pairwise
+slopes and medians are computed with NumPy over the whole fleet, which
+keeps the nightly run to seconds:
+
+    python forecast.py --history history/ -o due_soon.csv
+    python forecast.py --db inspections.db --days 60
+"""
+import argparse
+import math
+import warnings
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+from checklist import DEFAULT_CHECKLIST
+from equipment import DEFAULT_EQUIPMENT, REGISTRY, equipment_key, get_equipment
+
+# (column, label) of the forecast readings of thickener power packs
+FORECAST_COLUMNS = (
+    ('reservoir_delta_pressure', "Filter ΔP (kPa)"),
+    ('reservoir_prv1_temp', "PRV 1 temperature (°C)"),
+    ('reservoir_prv2_temp', "PRV 2 temperature (°C)"),
+    ('reservoir_prv3_temp', "PRV 3 temperature (°C)"),
+    ('hydraulic_pump_pump_temp', "Hydraulic pump temperature (°C)"),
+)
+
+# Checklists with hand-picked forecast readings
+CHECKLIST_FORECAST_COLUMNS = {
+    DEFAULT_CHECKLIST: FORECAST_COLUMNS,
+}
+
+# Readings fitted per series: the last MAX_POINTS within WINDOW_DAYS of the
+# asset's latest reading
+MAX_POINTS = 24
+WINDOW_DAYS = 365
+MIN_POINTS = 5
+MIN_SPAN_DAYS = 14
+
+# Crossings further away than this are not reported
+HORIZON_DAYS = 365
+# Default cut-off of the due soon list
+DUE_SOON_DAYS = 90
+
+LIMIT_KINDS = ('alert', 'alarm')
+
+FORECAST_FIELDS = ['equipment_tag', 'column', 'reading', 'limit_kind', 'limit', 'model',
+                   'slope_per_day', 'last_date', 'last_value', 'fitted_value', 'points',
+                   'crossing_date', 'days_left']
+
+
+def theil_sen(x, y):
+    """Row-wise Theil-Sen fits of padded (series, points) matrices (NaN where
+    a series has fewer points).  Returns (intercept at x = 0, slope) arrays."""
+    dx = x[:, None, :] - x[:, :, None]
+    dy = y[:, None, :] - y[:, :, None]
+    # Each pair once (j > i), readings of the same day give no slope
+    upper = np.triu(np.ones(dx.shape[1:], dtype=bool), 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = np.where(upper & (dx != 0), dy / dx, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        slope = np.nanmedian(slopes.reshape(len(x), -1), axis=1)
+        intercept = np.nanmedian(y - slope[:, None] * x, axis=1)
+    return intercept, slope
+
+
+def _median_residual(y, fitted):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(np.abs(y - fitted), axis=1)
+
+
+def series_matrix(codes, days, values, max_points=MAX_POINTS, window_days=WINDOW_DAYS):
+    """Lay out the finite readings of one column as padded matrices.
+
+    codes, days and values are per-inspection arrays (asset code, day
+    number, reading).  Returns (group codes, last day of each group,
+    x = days before the last reading, y), with one row per asset."""
+    finite = np.isfinite(values)
+    codes, days, values = codes[finite], days[finite], values[finite]
+    order = np.lexsort((days, codes))
+    codes, days, values = codes[order], days[order], values[order]
+
+    groups, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+    ends = starts + counts - 1
+    group_of = np.repeat(np.arange(len(groups)), counts)
+    last_day = days[ends]
+    from_end = ends[group_of] - np.arange(len(codes))
+    keep = (from_end < max_points) & (days >= last_day[group_of] - window_days)
+
+    x = np.full((len(groups), max_points), np.nan)
+    y = np.full((len(groups), max_points), np.nan)
+    rows, slots = group_of[keep], max_points - 1 - from_end[keep]
+    x[rows, slots] = days[keep] - last_day[rows]
+    y[rows, slots] = values[keep]
+    return groups, last_day, x, y
+
+
+def fit_series(x, y):
+    """Robust linear and exponential fits of padded series, keeping the one
+    with the smaller median residual.  Returns a dict of per-series arrays:
+    model ('linear' / 'exponential'), intercept and slope in the model's
+    space (log space for exponential), fitted value at x = 0 and the
+    growth per day in reading units at x = 0."""
+    intercept, slope = theil_sen(x, y)
+    fitted = intercept[:, None] + slope[:, None] * x
+    residual = _median_residual(y, fitted)
+
+    positive = np.all(np.isnan(y) | (y > 0), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_y = np.where(y > 0, np.log(y), np.nan)
+    log_intercept, log_slope = theil_sen(x, log_y)
+    with np.errstate(over='ignore'):
+        log_fitted = np.exp(log_intercept[:, None] + log_slope[:, None] * x)
+    log_residual = _median_residual(y, log_fitted)
+
+    exponential = positive & np.isfinite(log_slope) & (log_residual < residual)
+    with np.errstate(over='ignore'):
+        now = np.where(exponential, np.exp(log_intercept), intercept)
+    return {
+        'exponential': exponential,
+        'intercept': np.where(exponential, log_intercept, intercept),
+        'slope': np.where(exponential, log_slope, slope),
+        'fitted': now,
+        'rate': np.where(exponential, now * log_slope, slope),
+    }
+
+
+def days_to_reach(fit, limit):
+    """Days after the last reading until each fit reaches a (per-series) high
+    limit: 0 if it is already there, inf if it never will"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        target = np.where(fit['exponential'], np.log(np.maximum(limit, 1e-12)), limit)
+        days = (target - fit['intercept']) / fit['slope']
+    days = np.where(fit['slope'] > 0, days, np.inf)
+    return np.where(fit['fitted'] >= limit, 0.0, days)
+
+
+@lru_cache(maxsize=None)
+def forecast_columns(equipment_type=DEFAULT_EQUIPMENT):
+    """(column, label) of the readings forecast for an equipment type: the
+    hand-picked ones of its checklist, else every number field with a high
+    alert or alarm limit"""
+    equipment = get_equipment(equipment_type)
+    if equipment.checklist in CHECKLIST_FORECAST_COLUMNS:
+        return CHECKLIST_FORECAST_COLUMNS[equipment.checklist]
+    rules = equipment.get_rules()
+
+    def has_high_limit(column):
+        return any(getattr(rules.rule(column, kind), 'high', None) is not None
+                   for kind in LIMIT_KINDS)
+
+    return tuple((column, f"{section.title} {field.label}")
+                 for column, section, field in equipment.get_checklist().columns()
+                 if field.type == 'number' and has_high_limit(column))
+
+
+def all_forecast_columns():
+    """Columns forecast for any registered equipment type"""
+    return list(dict.fromkeys(column for key in REGISTRY for column, _ in forecast_columns(key)))
+
+
+def forecast(frame, rules=None, as_of=None, horizon_days=HORIZON_DAYS):
+    """Projected limit crossings of every asset in a frame of readings
+    (equipment_tag and inspection_date columns, the forecast columns present
+    and, for mixed equipment types, equipment_type; rows without a type are
+    of DEFAULT_EQUIPMENT).  Each type is forecast with its own readings and
+    rules, unless rules are given.  Returns a DataFrame with
+    FORECAST_FIELDS, one row per asset, reading and limit reached within
+    horizon_days of as_of, soonest first."""
+    import pandas as pd
+
+    as_of = as_of or date.today()
+    if 'equipment_type' in frame:
+        types = frame['equipment_type'].astype(object).fillna(DEFAULT_EQUIPMENT)
+    else:
+        types = pd.Series(DEFAULT_EQUIPMENT, index=frame.index)
+    keys = sorted(types.unique())
+    parts = []
+    for key in keys:
+        readings = frame if len(keys) == 1 else frame[types == key]
+        parts += _forecast_parts(readings, rules or get_equipment(key).get_rules(),
+                                 forecast_columns(key), as_of, horizon_days)
+
+    if not parts:
+        return pd.DataFrame(columns=FORECAST_FIELDS)
+    result = pd.concat(parts, ignore_index=True)
+    # Alarms before alerts on the same day
+    result['_severity'] = result['limit_kind'].map({'alarm': 0, 'alert': 1})
+    return (result.sort_values(['days_left', '_severity', 'equipment_tag', 'column'])
+                  .drop(columns='_severity').reset_index(drop=True))
+
+
+def _forecast_parts(frame, rules, columns, as_of, horizon_days):
+    """Forecast frames of the readings of one equipment type"""
+    import pandas as pd
+
+    as_of_day = (as_of - date(1970, 1, 1)).days
+    codes, tags = pd.factorize(frame['equipment_tag'], sort=True)
+    days = frame['inspection_date'].to_numpy('datetime64[D]').astype(np.int64)
+
+    parts = []
+    for column, label in columns:
+        if column not in frame:
+            continue
+        values = frame[column].to_numpy(np.float64, na_value=np.nan)
+        groups, last_day, x, y = series_matrix(codes, days, values)
+        points = np.sum(~np.isnan(y), axis=1)
+        span = -np.nanmin(x, axis=1) if len(x) else np.zeros(0)
+        usable = (points >= MIN_POINTS) & (span >= MIN_SPAN_DAYS)
+        if not usable.any():
+            continue
+        groups, last_day, x, y, points = (groups[usable], last_day[usable], x[usable],
+                                          y[usable], points[usable])
+        fit = fit_series(x, y)
+        last_value = y[:, -1]
+
+        for kind in LIMIT_KINDS:
+            rules_of = [rules.rule(column, kind, tags[code]) for code in groups]
+            limit = np.array([np.nan if rule is None or rule.high is None else rule.high
+                              for rule in rules_of], dtype=np.float64)
+            has_limit = np.isfinite(limit)
+            if not has_limit.any():
+                continue
+            days_left = last_day + days_to_reach(fit, np.where(has_limit, limit, np.inf)) - as_of_day
+            due = has_limit & (days_left <= horizon_days)
+            if not due.any():
+                continue
+            days_left = np.maximum(days_left[due], 0.0)
+            parts.append(pd.DataFrame({
+                'equipment_tag': tags[groups[due]],
+                'column': column,
+                'reading': label,
+                'limit_kind': kind,
+                'limit': limit[due],
+                'model': np.where(fit['exponential'][due], 'exponential', 'linear'),
+                'slope_per_day': fit['rate'][due],
+                'last_date': (last_day[due]).astype('datetime64[D]'),
+                'last_value': last_value[due],
+                'fitted_value': fit['fitted'][due],
+                'points': points[due],
+                'crossing_date': (as_of_day + np.ceil(days_left)).astype('datetime64[D]'),
+                'days_left': days_left,
+            }))
+    return parts
+
+
+def due_soon(forecasts, days=DUE_SOON_DAYS):
+    """First crossing per asset and reading within days, soonest first"""
+    soon = forecasts[forecasts['days_left'] <= days]
+    return soon.drop_duplicates(['equipment_tag', 'column']).reset_index(drop=True)
+
+
+def store_frame(store, start_date=None):
+    """Forecast readings of every inspection in an inspection store since
+    start_date, each read with its equipment type's checklist, as a frame
+    like history_export.read_history returns"""
+    import pandas as pd
+
+    columns = {}
+    tags, dates, types = [], [], []
+    for row, (inspection_info, inspection_data) in enumerate(store.query(start_date=start_date)):
+        key = equipment_key(inspection_info)
+        tags.append(inspection_info['equipment_tag'])
+        dates.append(inspection_info['inspection_date'])
+        types.append(key)
+        for column, section_key, field_key in _forecast_fields(key):
+            value = inspection_data.get(section_key, {}).get(field_key)
+            values = columns.get(column)
+            if values is None:
+                values = columns[column] = [math.nan] * row
+            values.append(_to_float(value))
+        # Readings of other equipment types stay empty
+        for values in columns.values():
+            if len(values) == row:
+                values.append(math.nan)
+    return pd.DataFrame({'equipment_tag': tags,
+                         'inspection_date': pd.to_datetime(pd.Series(dates, dtype=object)),
+                         'equipment_type': types,
+                         **{column: np.array(values, dtype=np.float64)
+                            for column, values in columns.items()}})
+
+
+@lru_cache(maxsize=None)
+def _forecast_fields(equipment_type):
+    fields = {name: (section.key, field.key)
+              for name, section, field in get_equipment(equipment_type).get_checklist().columns()}
+    return tuple((column, *fields[column]) for column, _ in forecast_columns(equipment_type))
+
+
+def _to_float(value):
+    if value is None or value == '' or isinstance(value, bool):
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Forecast filter clogging and temperature drift")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--history', default='history', help="root of the Parquet history")
+    source.add_argument('--db', help="read the inspection store instead of the history")
+    parser.add_argument('--as-of', help="forecast date (YYYY-MM-DD, default today)")
+    parser.add_argument('--days', type=int, default=DUE_SOON_DAYS,
+                        help="list crossings within this many days")
+    parser.add_argument('-o', '--output', help="write the due soon list to this CSV file")
+    args = parser.parse_args(argv)
+
+    import time
+    import pandas as pd
+
+    started = time.perf_counter()
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    # Readings older than the fit window of an asset inspected today are not needed
+    since = as_of - timedelta(days=WINDOW_DAYS)
+    if args.db:
+        from storage import InspectionStore
+        frame = store_frame(InspectionStore(args.db), start_date=since)
+    else:
+        from history_export import read_history
+        frame = read_history(args.history, start_date=since,
+                             columns=['equipment_tag', 'inspection_date', 'equipment_type']
+                             + all_forecast_columns())
+    soon = due_soon(forecast(frame, as_of=as_of), args.days)
+
+    if args.output:
+        soon.to_csv(args.output, index=False)
+    else:
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(soon.to_string(index=False, float_format=lambda value: f"{value:.3g}"))
+    print(f"{len(soon)} limits due within {args.days} days across "
+          f"{frame['equipment_tag'].nunique()} assets "
+          f"({len(frame)} inspections, {time.perf_counter() - started:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""Typed columnar (Parquet) history of inspections for trend analytics.
+
+Readings are written with an explicit Arrow schema (float32 pressures and
+temperatures, categorical statuses and filter colour) into files
+partitioned by equipment tag and month.  The schema has the reading
+columns of every equipment type; each row fills those of its own type's
+checklist and records the type in equipment_type (null in files written
+before equipment types, which hold thickener power packs only):
+
+    history/equipment_tag=31%20-%20TM%20-%2005/month=2025-06/part-<run>.parquet
+
+Each export run appends one row group per batch to its own part file, so
+new inspections are added without rewriting existing files.  Part files
+are written under hidden temporary names, which readers skip, and only
+renamed into place together with the checkpoint of the last exported
+inspection, so an interrupted run never leaves rows the next run would
+export again.  Run as a script to export everything stored since the
+previous run:
+
+    python history_export.py --db inspections.db -o history/
+"""
+import argparse
+import json
+import os
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from checklist import get_checklist
+from equipment import DEFAULT_EQUIPMENT, REGISTRY, equipment_key, get_equipment
+
+CHECKPOINT_FILE = '_checkpoint.json'
+
+CATEGORY = pa.dictionary(pa.int8(), pa.string())
+
+# Columns stored in every file; equipment_tag and month are partition keys
+INFO_COLUMNS = [
+    ('inspection_date', 'inspection_date', pa.date32()),
+    ('technician_name', 'technician_name', pa.string()),
+    ('group', 'group', CATEGORY),
+    ('wo_number', 'wo_number', pa.string()),
+    ('inspection_type', 'inspection_type', CATEGORY),
+    ('equipment_type', 'equipment_type', CATEGORY),
+    ('visual_check', 'visual_check', pa.bool_()),
+    ('vibration_check', 'vibration_check', pa.bool_()),
+]
+
+ARROW_TYPES = {
+    'number': pa.float32(),
+    'status': CATEGORY,
+    'choice': CATEGORY,
+    'text': pa.string(),
+}
+
+
+@lru_cache(maxsize=None)
+def reading_columns(checklist_name):
+    """(section key, field key, column, Arrow type) of a checklist's readings"""
+    return tuple((section.key, field.key, name, ARROW_TYPES[field.type])
+                 for name, section, field in get_checklist(checklist_name).columns())
+
+
+@lru_cache(maxsize=None)
+def history_schema():
+    """Schema of the history: the info columns, then the reading columns of
+    every registered equipment type (loading each type once)"""
+    fields = {name: pa.field(name, arrow_type) for name, _, arrow_type in INFO_COLUMNS}
+    for key in REGISTRY:
+        for _, _, name, arrow_type in reading_columns(get_equipment(key).checklist):
+            fields.setdefault(name, pa.field(name, arrow_type))
+    return pa.schema(list(fields.values()))
+
+PARTITION_SCHEMA = pa.schema([('equipment_tag', pa.string()), ('month', pa.string())])
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_text(value):
+    if value is None or value == '':
+        return None
+    return str(value)
+
+
+def inspections_to_table(inspections):
+    """Convert (inspection_info, inspection_data) pairs into a typed Arrow
+    table, reading each inspection with its equipment type's checklist"""
+    schema = history_schema()
+    columns = {field.name: [] for field in schema}
+    for inspection_info, inspection_data in inspections:
+        row = {name: inspection_info.get(key) for name, key, _ in INFO_COLUMNS}
+        row['equipment_type'] = equipment_key(inspection_info)
+        for section_key, key, name, arrow_type in reading_columns(
+                get_equipment(row['equipment_type']).checklist):
+            value = inspection_data.get(section_key, {}).get(key)
+            row[name] = _to_float(value) if arrow_type == pa.float32() else _to_text(value)
+        # Readings of other equipment types stay empty
+        for name, values in columns.items():
+            values.append(row.get(name))
+
+    arrays = []
+    for field in schema:
+        if field.type == CATEGORY:
+            arrays.append(pa.array(columns[field.name], pa.string()).dictionary_encode()
+                          .cast(CATEGORY))
+        else:
+            arrays.append(pa.array(columns[field.name], field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def partition_path(equipment_tag, inspection_date):
+    """Directory of the partition holding an inspection"""
+    return os.path.join(f"equipment_tag={quote(equipment_tag, safe='')}",
+                        f"month={inspection_date.strftime('%Y-%m')}")
+
+
+class HistoryWriter:
+    """Append inspections to the partitioned Parquet history.
+
+    Rows are buffered per partition and written as one row group whenever a
+    partition reaches row_group_size rows (or too many rows are buffered in
+    total).  One part file is opened per partition touched during the run,
+    under a hidden temporary name; close() finalises them and returns the
+    (temporary, final) paths to rename them to, abort() deletes them.
+    """
+
+    def __init__(self, root, compression='zstd', row_group_size=50000, max_buffered_rows=200000):
+        self.root = root
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self.run_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self._writers = {}
+        self._paths = []
+        self._buffers = {}
+        self._buffered_rows = 0
+        self.rows_written = 0
+
+    def _writer(self, partition):
+        writer = self._writers.get(partition)
+        if writer is None:
+            directory = os.path.join(self.root, partition)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f".part-{self.run_id}.parquet.tmp")
+            writer = pq.ParquetWriter(path, history_schema(), compression=self.compression)
+            self._writers[partition] = writer
+            self._paths.append(path)
+        return writer
+
+    def _flush(self, partition):
+        batch = self._buffers.pop(partition, None)
+        if batch:
+            self._writer(partition).write_table(inspections_to_table(batch),
+                                                row_group_size=self.row_group_size)
+            self._buffered_rows -= len(batch)
+            self.rows_written += len(batch)
+
+    def write(self, inspections):
+        """Write a batch of (inspection_info, inspection_data) pairs"""
+        for inspection_info, inspection_data in inspections:
+            partition = partition_path(inspection_info['equipment_tag'],
+                                       inspection_info['inspection_date'])
+            batch = self._buffers.setdefault(partition, [])
+            batch.append((inspection_info, inspection_data))
+            self._buffered_rows += 1
+            if len(batch) >= self.row_group_size:
+                self._flush(partition)
+
+        if self._buffered_rows >= self.max_buffered_rows:
+            self.flush()
+
+    def flush(self):
+        """Write out every buffered partition"""
+        for partition in list(self._buffers):
+            self._flush(partition)
+
+    def close(self):
+        """Finalise the part files.  Returns [(temporary path, final path)]."""
+        self.flush()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+        paths, self._paths = self._paths, []
+        return [(path, _final_path(path)) for path in paths]
+
+    def abort(self):
+        """Drop the buffered rows and delete the part files of this run"""
+        self._buffers.clear()
+        self._buffered_rows = 0
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+        for path in self._paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self._paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.abort()
+
+
+def _final_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, name[1:-len('.tmp')])
+
+
+def _read_checkpoint(root):
+    path = os.path.join(root, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return {'last_id': 0}
+    with open(path, encoding='utf-8') as stream:
+        return json.load(stream)
+
+
+def _write_checkpoint(root, last_id, renames=()):
+    path = os.path.join(root, CHECKPOINT_FILE)
+    checkpoint = {'last_id': last_id}
+    if renames:
+        checkpoint['renames'] = [[os.path.relpath(source, root), os.path.relpath(target, root)]
+                                 for source, target in renames]
+    with open(path + '.tmp', 'w', encoding='utf-8') as stream:
+        json.dump(checkpoint, stream)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def _commit(root, last_id, renames):
+    """Move the part files of a run into place with the checkpoint: the
+    renames are recorded with the new checkpoint first, so a run
+    interrupted half way is completed by the next one"""
+    _write_checkpoint(root, last_id, renames)
+    for source, target in renames:
+        if os.path.exists(source):
+            os.replace(source, target)
+    _write_checkpoint(root, last_id)
+
+
+def _recover(root):
+    """Last exported inspection id, after completing the renames of an
+    interrupted commit and deleting the part files of interrupted runs"""
+    checkpoint = _read_checkpoint(root)
+    renames = [(os.path.join(root, source), os.path.join(root, target))
+               for source, target in checkpoint.get('renames', ())]
+    if renames:
+        _commit(root, checkpoint['last_id'], renames)
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.startswith('.part-') and name.endswith('.tmp'):
+                os.remove(os.path.join(directory, name))
+    return checkpoint['last_id']
+
+
+def export_from_store(store, root, batch_size=5000):
+    """Append every inspection stored since the last export to the history.
+    Returns the number of inspections exported."""
+    os.makedirs(root, exist_ok=True)
+    last_id = _recover(root)
+    with HistoryWriter(root) as writer:
+        while True:
+            rows = store.rows_after(last_id, batch_size)
+            if not rows:
+                break
+            writer.write((info, data) for _, info, data in rows)
+            last_id = rows[-1][0]
+        renames = writer.close()
+    _commit(root, last_id, renames)
+    return writer.rows_written
+
+
+def read_history(root, equipment_tag=None, columns=None, start_date=None, end_date=None,
+                 equipment_type=None):
+    """Load the history (optionally one equipment tag or equipment type) into
+    a pandas DataFrame"""
+    import pyarrow.dataset as ds
+
+    # Files written before a column existed read it as null
+    dataset = ds.dataset(root, format='parquet',
+                         schema=pa.unify_schemas([history_schema(), PARTITION_SCHEMA]),
+                         partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'))
+    of_type = None
+    if equipment_type is not None:
+        of_type = ds.field('equipment_type') == equipment_type
+        if equipment_type == DEFAULT_EQUIPMENT:
+            of_type = of_type | ds.field('equipment_type').is_null()
+    condition = None
+    for expression in (
+            ds.field('equipment_tag') == equipment_tag if equipment_tag is not None else None,
+            of_type,
+            ds.field('inspection_date') >= pa.scalar(start_date, pa.date32())
+            if start_date is not None else None,
+            ds.field('inspection_date') <= pa.scalar(end_date, pa.date32())
+            if end_date is not None else None):
+        if expression is not None:
+            condition = expression if condition is None else condition & expression
+    table = dataset.to_table(columns=columns, filter=condition)
+    return table.to_pandas(date_as_object=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append stored inspections to the Parquet history")
+    parser.add_argument('--db', default=None, help="inspection store to export from")
+    parser.add_argument('-o', '--output-dir', default='history', help="root of the Parquet history")
+    args = parser.parse_args(argv)
+
+    from storage import InspectionStore, DEFAULT_DB_PATH
+    store = InspectionStore(args.db or DEFAULT_DB_PATH)
+    exported = export_from_store(store, args.output_dir)
+    print(f"Exported {exported} inspections to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
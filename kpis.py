@@ -0,0 +1,270 @@
+"""KPI aggregates maintained incrementally from the change log.
+
+Every inspection stored appends a change event to the store's append-only
+change_log table (storage.py) in the same transaction.  An event carries
+what the KPIs need of the inspection: its tag, date, week, group,
+equipment type and, per section of that type's checklist, how many status
+items were checked and how many of them were Not OK.
+
+The aggregate tables below live in the store's database and are brought up
+to date by applying the events logged since the last refresh (one UPSERT
+per equipment type and section, week, group and asset of each new event, together with the
+position in the log, in one transaction).  The KPI page reads only these
+tables, so it costs the same whether the store holds a month or a decade of
+inspections.  They hold nothing the log does not, and can be dropped and
+rebuilt from it at any time:
+
+    python kpis.py --rebuild
+"""
+import json
+from datetime import date, timedelta
+from functools import lru_cache
+
+import metrics
+from checklist import STATUS_OPTIONS
+from equipment import DEFAULT_EQUIPMENT, checklist_for, equipment_key, equipment_types, get_equipment
+from storage import ConnectionPool, DEFAULT_DB_PATH
+
+# Version of the change event layout (2: adds equipment_type)
+EVENT_VERSION = 2
+
+# Events applied per write transaction
+APPLY_BATCH = 5000
+
+# Assets not inspected for this many days are overdue
+OVERDUE_DAYS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kpi_section_week (
+    equipment_type TEXT NOT NULL,
+    section TEXT NOT NULL,
+    week TEXT NOT NULL,
+    not_ok INTEGER NOT NULL,
+    checked INTEGER NOT NULL,
+    PRIMARY KEY (equipment_type, section, week)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS kpi_group_week (
+    group_name TEXT NOT NULL,
+    week TEXT NOT NULL,
+    inspections INTEGER NOT NULL,
+    PRIMARY KEY (group_name, week)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS kpi_assets (
+    equipment_tag TEXT PRIMARY KEY,
+    last_inspection_date TEXT NOT NULL,
+    inspections INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_kpi_assets_last ON kpi_assets (last_inspection_date);
+CREATE TABLE IF NOT EXISTS kpi_state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    last_seq INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO kpi_state (id, last_seq) VALUES (0, 0);
+"""
+
+AGGREGATE_TABLES = ('kpi_section_week', 'kpi_group_week', 'kpi_assets')
+
+SECTION_SQL = """
+INSERT INTO kpi_section_week (equipment_type, section, week, not_ok, checked)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (equipment_type, section, week) DO UPDATE SET
+    not_ok = not_ok + excluded.not_ok,
+    checked = checked + excluded.checked
+"""
+
+GROUP_SQL = """
+INSERT INTO kpi_group_week (group_name, week, inspections) VALUES (?, ?, 1)
+ON CONFLICT (group_name, week) DO UPDATE SET inspections = inspections + 1
+"""
+
+ASSET_SQL = """
+INSERT INTO kpi_assets (equipment_tag, last_inspection_date, inspections) VALUES (?, ?, 1)
+ON CONFLICT (equipment_tag) DO UPDATE SET
+    last_inspection_date = MAX(last_inspection_date, excluded.last_inspection_date),
+    inspections = inspections + 1
+"""
+
+
+def week_of(inspection_date):
+    """ISO date of the Monday of the week of an ISO date string"""
+    day = date.fromisoformat(str(inspection_date)[:10])
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def change_event(inspection_id, record, checklist=None):
+    """Change event of a stored inspection record, as logged by the store"""
+    info, data = record['info'], record.get('data', {})
+    checklist = checklist or checklist_for(info)
+    sections = {}
+    for section in checklist.sections:
+        values = data.get(section.key)
+        if not isinstance(values, dict):
+            continue
+        statuses = [values.get(field.key) for field in section.fields
+                    if field.options == STATUS_OPTIONS]
+        checked = sum(1 for value in statuses if value in STATUS_OPTIONS)
+        if checked:
+            sections[section.key] = [statuses.count(STATUS_OPTIONS[1]), checked]
+    inspection_date = str(info.get('inspection_date', ''))[:10]
+    return {
+        'v': EVENT_VERSION,
+        'id': inspection_id,
+        'tag': info.get('equipment_tag', ''),
+        'date': inspection_date,
+        'week': week_of(inspection_date) if inspection_date else '',
+        'group': info.get('group', ''),
+        'inspection_type': info.get('inspection_type', ''),
+        'equipment_type': equipment_key(info),
+        'sections': sections,
+    }
+
+
+@lru_cache(maxsize=None)
+def _equipment_of_inspection_type(inspection_type):
+    """Key of the equipment type whose checklist lists an inspection type"""
+    for key, _ in equipment_types():
+        if inspection_type in get_equipment(key).get_checklist().inspection_types:
+            return key
+    return DEFAULT_EQUIPMENT
+
+
+def event_equipment(event):
+    """Equipment type key of a change event.  Version 1 events did not carry
+    it; theirs is told by the inspection type."""
+    return event.get('equipment_type') or _equipment_of_inspection_type(event['inspection_type'])
+
+
+class KpiAggregates:
+    """Aggregate tables of one store, maintained from its change log"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, pool_size=2, timeout=30.0):
+        self.path = path
+        self._pool = ConnectionPool(path, pool_size, timeout)
+        self._pool.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Aggregates kept by section alone (before equipment types) are
+        dropped and rebuilt from the log on the next refresh"""
+        with self._pool.writing() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(kpi_section_week)")}
+            if 'equipment_type' in columns:
+                return
+            for table in AGGREGATE_TABLES:
+                conn.execute(f"DROP TABLE {table}")
+            conn.execute("UPDATE kpi_state SET last_seq = 0")
+        self._pool.executescript(SCHEMA)
+
+    def close(self):
+        self._pool.close()
+
+    def pending(self):
+        """Number of change events not applied yet"""
+        with self._pool.reading() as conn:
+            last_seq = conn.execute("SELECT last_seq FROM kpi_state").fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM change_log WHERE seq > ?",
+                                (last_seq,)).fetchone()[0]
+
+    @metrics.timed('kpis.refresh')
+    def refresh(self, batch_size=APPLY_BATCH):
+        """Apply the change events logged since the last refresh.  Returns the
+        number of events applied."""
+        total = 0
+        while True:
+            # The events and the position they were read up to are committed
+            # together, so each event counts exactly once
+            with self._pool.writing() as conn:
+                last_seq = conn.execute("SELECT last_seq FROM kpi_state").fetchone()[0]
+                rows = conn.execute(
+                    "SELECT seq, event FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (last_seq, batch_size)).fetchall()
+                if not rows:
+                    return total
+                sections, groups, assets = [], [], []
+                for _, event in rows:
+                    event = json.loads(event)
+                    if not event['date']:
+                        continue
+                    equipment = event_equipment(event)
+                    for key, (not_ok, checked) in event['sections'].items():
+                        sections.append((equipment, key, event['week'], not_ok, checked))
+                    groups.append((event['group'], event['week']))
+                    assets.append((event['tag'], event['date']))
+                conn.executemany(SECTION_SQL, sections)
+                conn.executemany(GROUP_SQL, groups)
+                conn.executemany(ASSET_SQL, assets)
+                conn.execute("UPDATE kpi_state SET last_seq = ?", (rows[-1][0],))
+            total += len(rows)
+
+    def rebuild(self):
+        """Clear the aggregates and apply the whole change log again"""
+        with self._pool.writing() as conn:
+            for table in AGGREGATE_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("UPDATE kpi_state SET last_seq = 0")
+        return self.refresh()
+
+    def _since(self, weeks, as_of=None):
+        return week_of((as_of or date.today()) - timedelta(weeks=weeks - 1))
+
+    def section_not_ok(self, weeks=12, as_of=None):
+        """[(equipment type key, section key, not OK, checked)] over the last weeks"""
+        with self._pool.reading() as conn:
+            return conn.execute(
+                "SELECT equipment_type, section, SUM(not_ok), SUM(checked) FROM kpi_section_week "
+                "WHERE week >= ? GROUP BY equipment_type, section",
+                (self._since(weeks, as_of),)).fetchall()
+
+    def section_weeks(self, weeks=12, as_of=None):
+        """[(equipment type key, section key, week, not OK, checked)] over the last weeks"""
+        with self._pool.reading() as conn:
+            return conn.execute(
+                "SELECT equipment_type, section, week, not_ok, checked FROM kpi_section_week "
+                "WHERE week >= ? ORDER BY week", (self._since(weeks, as_of),)).fetchall()
+
+    def group_weeks(self, weeks=12, as_of=None):
+        """[(group, week, inspections)] over the last weeks"""
+        with self._pool.reading() as conn:
+            return conn.execute(
+                "SELECT group_name, week, inspections FROM kpi_group_week "
+                "WHERE week >= ? ORDER BY week, group_name",
+                (self._since(weeks, as_of),)).fetchall()
+
+    def overdue_assets(self, overdue_days=OVERDUE_DAYS, as_of=None):
+        """[(equipment tag, last inspection date, days since)] of the assets
+        not inspected for more than overdue_days, longest overdue first"""
+        as_of = as_of or date.today()
+        cutoff = (as_of - timedelta(days=overdue_days)).isoformat()
+        with self._pool.reading() as conn:
+            rows = conn.execute(
+                "SELECT equipment_tag, last_inspection_date FROM kpi_assets "
+                "WHERE last_inspection_date < ? ORDER BY last_inspection_date",
+                (cutoff,)).fetchall()
+        return [(tag, last, (as_of - date.fromisoformat(last)).days) for tag, last in rows]
+
+    def asset_count(self):
+        with self._pool.reading() as conn:
+            return conn.execute("SELECT COUNT(*) FROM kpi_assets").fetchone()[0]
+
+
+def main():
+    import argparse
+    import os
+    import time
+
+    parser = argparse.ArgumentParser(description="Update the KPI aggregates from the change log")
+    parser.add_argument('--db', default=os.environ.get('VIBROSENS_CENTRAL_DB') or DEFAULT_DB_PATH)
+    parser.add_argument('--rebuild', action='store_true',
+                        help="recompute the aggregates from the whole change log")
+    args = parser.parse_args()
+
+    from storage import InspectionStore
+    InspectionStore(args.db).close()  # logs the existing inspections on first use
+    aggregates = KpiAggregates(args.db)
+    started = time.perf_counter()
+    applied = aggregates.rebuild() if args.rebuild else aggregates.refresh()
+    print(f"Applied {applied} change events in {time.perf_counter() - started:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Load test of concurrent inspection submissions.
+
+Simulates a shift group submitting at the end of a shift: every submitter
+(a thread; --replicas spreads them over several processes standing in for
+app replicas behind a load balancer) pushes one inspection through the same
+path as the form.  The inspection is queued in the replica's local
+FieldQueue, then the replica's SyncWorker stores it in the shared central
+store.  For each submission the script records the time the technician
+waits (queueing) and the time until the inspection is committed centrally:
+
+    python loadtest.py --db /tmp/central.db -n 100
+    python loadtest.py --db /tmp/central.db -n 100 --replicas 4 --work-orders 10
+
+With --work-orders, submissions share that many work order numbers, so
+concurrent submissions for the same work order exercise the optimistic
+concurrency check (all but one per work order are rejected).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from checklist import get_checklist
+
+
+def sample_inspection(index, rng=random, checklist=None, start=date(2024, 1, 1),
+                      equipment_tags=20, wo_number=None):
+    """A plausible filled-in inspection for tests and benchmarks"""
+    checklist = checklist or get_checklist()
+    inspection_info = {
+        'technician_name': f"Technician {index % 7}",
+        'group': f"Group {'ABCD'[index % 4]}",
+        'inspection_date': start + timedelta(days=index // equipment_tags),
+        'equipment_tag': f"31 - TM - {index % equipment_tags:02d}",
+        'wo_number': wo_number or f"WO{100000 + index}",
+        'inspection_type': checklist.inspection_types[index % len(checklist.inspection_types)],
+        'visual_check': True,
+        'vibration_check': index % 3 == 0,
+    }
+    inspection_data = {}
+    for _, section, field in checklist.columns():
+        if field.type == 'number':
+            low = field.min if field.min is not None else 0.0
+            high = field.max if field.max is not None else 100.0
+            high = min(high, low + 100.0)
+            value = round(rng.uniform(low, high), 1)
+        elif field.options:
+            value = field.options[0] if rng.random() < 0.9 else rng.choice(field.options)
+        else:
+            value = ''
+        inspection_data.setdefault(section.key, {})[field.key] = value
+    return inspection_info, inspection_data
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    rank = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+class _TimedSink:
+    """StoreSink recording when each idempotency key was committed"""
+
+    def __init__(self, store):
+        from sync import StoreSink
+        self.sink = StoreSink(store)
+        self.done = {}
+
+    def __call__(self, body):
+        from sync import decode_batch
+        rejected = self.sink(body)
+        finished = time.perf_counter()
+        for key, *_ in decode_batch(body):
+            self.done[key] = finished
+        return rejected
+
+
+def _run_replica(replica, db_path, indices, barrier, work_orders, queue_dir, results):
+    """One app replica: its own queue and sync worker, one thread per submitter"""
+    from storage import InspectionStore
+    from sync import FieldQueue, SyncWorker
+
+    store = InspectionStore(db_path)
+    field_queue = FieldQueue(os.path.join(queue_dir, f"queue_{replica}.db"))
+    sink = _TimedSink(store)
+    worker = SyncWorker(field_queue, sink, interval=0.5)
+    worker.start()
+    checklist = get_checklist()
+    timings = {}
+
+    def submit(index):
+        wo_number = f"WO-LOAD-{index % work_orders}" if work_orders else None
+        inspection = sample_inspection(index, random.Random(index), checklist, wo_number=wo_number)
+        current = store.work_order(inspection[0]['wo_number'])
+        expected_version = current.version if current else 0
+        barrier.wait()
+        started = time.perf_counter()
+        key = field_queue.enqueue(*inspection, expected_version=expected_version)
+        queued = time.perf_counter()
+        worker.wake()
+        timings[key] = (started, queued)
+
+    threads = [threading.Thread(target=submit, args=(index,)) for index in indices]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    while field_queue.pending_count():
+        worker.wake()
+        time.sleep(0.01)
+    worker.stop()
+    rejected = {key for key, *_ in field_queue.rejected()}
+    results.put([(queued - started, sink.done[key] - started, key in rejected)
+                 for key, (started, queued) in timings.items()])
+
+
+def run_load_test(db_path, submissions=100, replicas=1, work_orders=0):
+    """Submit concurrently and return a summary of the latencies (ms)"""
+    from storage import InspectionStore
+    InspectionStore(db_path).close()  # create the schema before the replicas start
+
+    with tempfile.TemporaryDirectory() as queue_dir:
+        shards = [list(range(replica, submissions, replicas)) for replica in range(replicas)]
+        if replicas == 1:
+            results = queue.Queue()
+            _run_replica(0, db_path, shards[0], threading.Barrier(submissions), work_orders,
+                         queue_dir, results)
+            samples = results.get()
+        else:
+            context = multiprocessing.get_context('spawn')
+            barrier = context.Barrier(submissions)
+            results = context.Queue()
+            processes = [context.Process(target=_run_replica,
+                                         args=(replica, db_path, shard, barrier, work_orders,
+                                               queue_dir, results))
+                         for replica, shard in enumerate(shards)]
+            for process in processes:
+                process.start()
+            samples = [sample for _ in processes for sample in results.get()]
+            for process in processes:
+                process.join()
+
+    queued = [sample[0] * 1000 for sample in samples]
+    stored = [sample[1] * 1000 for sample in samples]
+    return {
+        'submissions': len(samples),
+        'replicas': replicas,
+        'rejected': sum(1 for sample in samples if sample[2]),
+        'queue_ms': {'p50': percentile(queued, 0.5), 'p99': percentile(queued, 0.99),
+                     'max': max(queued)},
+        'submit_ms': {'p50': percentile(stored, 0.5), 'p95': percentile(stored, 0.95),
+                      'p99': percentile(stored, 0.99), 'max': max(stored)},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent inspection submissions")
+    parser.add_argument('--db', default=None,
+                        help="central store to submit to (default: a temporary file)")
+    parser.add_argument('-n', '--submissions', type=int, default=100,
+                        help="number of simultaneous submissions")
+    parser.add_argument('--replicas', type=int, default=1,
+                        help="number of app processes sharing the central store")
+    parser.add_argument('--work-orders', type=int, default=0,
+                        help="share this many work order numbers between submissions")
+    parser.add_argument('--json', action='store_true', help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = args.db or os.path.join(scratch, 'central.db')
+        summary = run_load_test(db_path, args.submissions, args.replicas, args.work_orders)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    queue_ms, submit_ms = summary['queue_ms'], summary['submit_ms']
+    print(f"{summary['submissions']} submissions over {summary['replicas']} replica(s), "
+          f"{summary['rejected']} rejected as work order conflicts")
+    print(f"  queued locally:   p50 {queue_ms['p50']:7.1f} ms   p99 {queue_ms['p99']:7.1f} ms")
+    print(f"  stored centrally: p50 {submit_ms['p50']:7.1f} ms   p99 {submit_ms['p99']:7.1f} ms   "
+          f"max {submit_ms['max']:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
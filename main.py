@@ -1,12 +1,14 @@
 import streamlit as st
-import pandas as pd
-from datetime import datetime
-import io
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_ALIGN_VERTICAL
-import base64
+import os
+from datetime import date, datetime
+import metrics
+from equipment import DEFAULT_EQUIPMENT, checklist_for, equipment_types, get_equipment
+from storage import shared_store
+from sync import FieldQueue, StoreSink, SyncWorker, new_draft_id
+
+# Heavy modules (openpyxl, python-docx, NumPy, plotly) are imported inside the
+# functions that need them, so they only load once an export or analysis
+# is actually requested.
 
 # Page configuration
 st.set_page_config(
@@ -16,7 +18,7 @@ st.set_page_config(
 )
 
 # Custom CSS for better styling
-st.markdown("""
+PAGE_CSS = """
 <style>
     .main-header {
         text-align: center;
@@ -43,18 +45,161 @@ st.markdown("""
         margin-bottom: 30px;
     }
 </style>
-""", unsafe_allow_html=True)
-
-def create_logo_placeholder():
-    """Create a placeholder for the Ambatovy logo"""
-    st.markdown("""
-    <div class="logo-container">
-        <div style="background-color: #E8F4FD; padding: 20px; border-radius: 10px; text-align: center; border: 2px solid #3498DB;">
-            <h2 style="color: #1B4F72; margin: 0;">VIBROSens</h2>
-            <p style="margin: 5px 0 0 0; color: #5D6D7E;">Condition Monitoring Rotating Equipment</p>
-        </div>
+"""
+
+# Placeholder for the Ambatovy logo
+LOGO_HTML = """
+<div class="logo-container">
+    <div style="background-color: #E8F4FD; padding: 20px; border-radius: 10px; text-align: center; border: 2px solid #3498DB;">
+        <h2 style="color: #1B4F72; margin: 0;">VIBROSens</h2>
+        <p style="margin: 5px 0 0 0; color: #5D6D7E;">Condition Monitoring Rotating Equipment</p>
     </div>
-    """, unsafe_allow_html=True)
+</div>
+"""
+
+TITLE_HTML = '<h1 class="main-header">Rotating Equipment Inspection System</h1>'
+
+# Static page header, assembled once per process and sent as a single element.
+# Fragment reruns do not resend it.
+PAGE_HEADER_HTML = PAGE_CSS + LOGO_HTML + TITLE_HTML
+
+def render_page_header():
+    """Render the CSS, logo placeholder and title"""
+    st.markdown(PAGE_HEADER_HTML, unsafe_allow_html=True)
+
+@st.cache_resource
+def get_equipment_type(key):
+    """Equipment type with its compiled checklist and limits, loaded the
+    first time any session selects it and shared by all sessions"""
+    return get_equipment(key)
+
+def selected_equipment():
+    """Equipment type chosen in the sidebar"""
+    return get_equipment_type(st.session_state.get(INFO_KEYS['equipment_type'], DEFAULT_EQUIPMENT))
+
+def get_checklist():
+    """Compiled inspection checklist of the selected equipment type"""
+    return selected_equipment().get_checklist()
+
+def get_central_store():
+    """Store submissions are synced to, shared by every replica of the app and,
+    within this process, by every session and page"""
+    return shared_store()
+
+@st.cache_resource
+def get_queue():
+    """Local durable queue of drafts and submitted inspections"""
+    return FieldQueue()
+
+@st.cache_resource
+def get_sync_worker():
+    """Background worker syncing queued inspections to the central store"""
+    worker = SyncWorker(get_queue(), StoreSink(get_central_store()))
+    worker.start()
+    return worker
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """Prometheus /metrics endpoint of this process, if enabled"""
+    return metrics.serve_from_environment()
+
+@st.cache_resource
+def get_baseline_cache():
+    """Per-asset reading baselines shared by all sessions"""
+    from baselines import BaselineCache
+    return BaselineCache()
+
+def asset_baselines(equipment_tag):
+    """Running baselines of an asset, topped up with newly stored inspections"""
+    return get_baseline_cache().baselines(get_central_store(), equipment_tag)
+
+@st.cache_resource
+def get_artifact_cache():
+    """Rendered reports and exports shared by all sessions, keyed by content hash"""
+    from artifact_cache import ArtifactCache
+    return ArtifactCache(directory=os.environ.get('VIBROSENS_ARTIFACT_DIR'))
+
+@st.cache_resource
+def get_attachment_store():
+    """Content-addressed photo store with its background processing pool"""
+    from attachments import AttachmentStore
+    return AttachmentStore()
+
+def get_rules():
+    """Compiled limit rules (alarm/alert bands, rate of change, baseline) of
+    the selected equipment type"""
+    return selected_equipment().get_rules()
+
+@st.cache_data(ttl=300)
+def asset_history(equipment_tag, inspection_date):
+    """(first, latest) inspections of an asset stored before a date, for trend rules"""
+    store = get_central_store()
+    first = next(store.query(equipment_tag=equipment_tag, limit=1), None)
+    return first, store.latest(equipment_tag, before=inspection_date)
+
+def previous_reading(section_key, field_key, equipment_tag):
+    """(previous value, days since it, baseline value) of one reading"""
+    if not equipment_tag:
+        return None, None, None
+    inspection_date = st.session_state.get(INFO_KEYS['inspection_date']) or date.today()
+    first, latest = asset_history(equipment_tag, inspection_date)
+    if latest is None:
+        return None, None, None
+    previous_info, previous_data = latest
+    days = (inspection_date - previous_info['inspection_date']).days
+    return (previous_data.get(section_key, {}).get(field_key), days,
+            first[1].get(section_key, {}).get(field_key))
+
+INFO_KEYS = {
+    'technician_name': "info_technician_name",
+    'group': "info_group",
+    'inspection_date': "info_inspection_date",
+    'equipment_tag': "info_equipment_tag",
+    'wo_number': "info_wo_number",
+    'inspection_type': "info_inspection_type",
+    'equipment_type': "info_equipment_type",
+    'visual_check': "info_visual_check",
+    'vibration_check': "info_vibration_check",
+}
+
+def info_default(name, value):
+    """Widget default, unless a restored draft already set the widget's value"""
+    return None if INFO_KEYS[name] in st.session_state else value
+
+def restore_draft(draft_id):
+    """Load an autosaved draft back into the widgets"""
+    parts = get_queue().load_draft(draft_id)
+    
+    for name, value in parts.get('info', {}).items():
+        if name == 'inspection_date':
+            value = date.fromisoformat(value)
+        if name in INFO_KEYS:
+            st.session_state[INFO_KEYS[name]] = value
+    
+    for section in get_checklist().form_sections:
+        values = parts.get(section.key, {})
+        for field in section.form_fields:
+            value = values.get(field.key)
+            if value is None or (field.options and value not in field.options):
+                continue
+            st.session_state[f"{section.key}_{field.key}"] = value
+    
+    st.session_state.autosaved = parts
+
+def autosave(part, values):
+    """Save one part of the current draft if it changed since the last save"""
+    autosaved = st.session_state.setdefault('autosaved', {})
+    if autosaved.get(part) != values:
+        get_queue().save_draft_part(st.session_state.draft_id, part, values)
+        autosaved[part] = dict(values)
+
+def start_new_draft():
+    """Begin a new draft and remember its id in the page URL"""
+    st.session_state.draft_id = new_draft_id()
+    st.session_state.autosaved = {}
+    st.session_state.wo_revisions = {}
+    st.session_state.pop('wo_conflict', None)
+    st.query_params['draft'] = st.session_state.draft_id
 
 def initialize_session_state():
     """Initialize session state variables"""
@@ -62,7 +207,17 @@ def initialize_session_state():
         st.session_state.inspection_data = {}
     if 'completed_sections' not in st.session_state:
         st.session_state.completed_sections = set()
+    if 'draft_id' not in st.session_state:
+        # A reconnecting tablet comes back with ?draft=<id> in its URL
+        draft_id = st.query_params.get('draft')
+        if draft_id:
+            st.session_state.draft_id = draft_id
+            restore_draft(draft_id)
+        else:
+            start_new_draft()
 
+@st.fragment
+@metrics.timed('form')
 def create_inspection_form():
     """Create the main inspection form"""
     
@@ -71,558 +226,737 @@ def create_inspection_form():
     
     with col1:
         st.subheader("Inspector Information")
-        technician_name = st.text_input("Technician Name", placeholder="e.g., Rodin")
-        group = st.text_input("Group", placeholder="e.g., Group A")
+        technician_name = st.text_input("Technician Name", placeholder="e.g., Rodin",
+                                        key=INFO_KEYS['technician_name'])
+        group = st.text_input("Group", placeholder="e.g., Group A", key=INFO_KEYS['group'])
         
     with col2:
         st.subheader("Inspection Details")
-        inspection_date = st.date_input("Inspection Date", datetime.now())
-        equipment_tag = st.text_input("Equipment Tag #", value="31 - TM -")
-        wo_number = st.text_input("Work Order #", placeholder="WO#")
+        inspection_date = st.date_input("Inspection Date", info_default('inspection_date', datetime.now()),
+                                        key=INFO_KEYS['inspection_date'])
+        equipment_tag = st.text_input("Equipment Tag #",
+                                      value=info_default('equipment_tag', selected_equipment().tag_prefix),
+                                      key=INFO_KEYS['equipment_tag'])
+        wo_number = st.text_input("Work Order #", placeholder="WO#", key=INFO_KEYS['wo_number'])
+        if wo_number:
+            base_revision = work_order_revision(wo_number)
+            if base_revision:
+                current = get_central_store().work_order(wo_number)
+                st.caption(f"ℹ️ {wo_number} was already submitted by "
+                           f"{current.technician_name or 'another user'} ({current.updated_at}); "
+                           f"this inspection will be revision {base_revision + 1}.")
     
     # Inspection type
     inspection_type = st.selectbox(
         "Select Inspection Type",
-        ["Thickener I Rake Drive Hydraulic Power Pack", 
-         "Thickener II Rake Drive Hydraulic Power Pack"]
+        list(get_checklist().inspection_types),
+        key=INFO_KEYS['inspection_type']
     )
     
     # Visual and Vibration checkboxes
     col1, col2 = st.columns(2)
     with col1:
-        visual_check = st.checkbox("Visual Inspection", value=True)
+        visual_check = st.checkbox("Visual Inspection", value=bool(info_default('visual_check', True)),
+                                   key=INFO_KEYS['visual_check'])
     with col2:
-        vibration_check = st.checkbox("Vibration Check", value=True)
+        vibration_check = st.checkbox("Vibration Check", value=bool(info_default('vibration_check', True)),
+                                      key=INFO_KEYS['vibration_check'])
     
-    return {
+    inspection_info = {
         'technician_name': technician_name,
         'group': group,
         'inspection_date': inspection_date,
         'equipment_tag': equipment_tag,
         'wo_number': wo_number,
         'inspection_type': inspection_type,
+        'equipment_type': selected_equipment().key,
         'visual_check': visual_check,
         'vibration_check': vibration_check
     }
+    autosave('info', {**inspection_info, 'inspection_date': inspection_date.isoformat()})
+    return inspection_info
 
-def safety_section():
-    """Safety inspection section"""
-    st.markdown('<div class="section-header">🔒 Safety</div>', unsafe_allow_html=True)
-    
-    with st.expander("Safety Inspection Items", expanded=True):
-        safety_data = {}
-        
+def work_order_revision(wo_number):
+    """Work order revision this inspection is based on: the latest one when
+    the work order number was first entered in this session"""
+    revisions = st.session_state.setdefault('wo_revisions', {})
+    if wo_number not in revisions:
+        current = get_central_store().work_order(wo_number)
+        revisions[wo_number] = current.version if current else 0
+    return revisions[wo_number]
+
+def work_order_conflict(inspection_info):
+    """Keep a conflict in session state if the work order was submitted by
+    someone else since this inspection was started (checked again when the
+    submission is synced); returns whether there is one"""
+    from storage import WorkOrderConflict
+    wo_number = inspection_info['wo_number']
+    if not wo_number:
+        return False
+    expected = work_order_revision(wo_number)
+    current = get_central_store().work_order(wo_number)
+    if (current.version if current else 0) == expected:
+        return False
+    st.session_state.wo_conflict = WorkOrderConflict(wo_number, expected, current)
+    return True
+
+def rejected_submissions(technician_name):
+    """Submissions of this technician rejected by the central store, with the
+    choice to resubmit them as a new revision or to drop them"""
+    queue = get_queue()
+    for key, info, _, reason in queue.rejected():
+        if info.get('technician_name') != technician_name:
+            continue
+        st.warning(f"Inspection of {info.get('equipment_tag')} for work order "
+                   f"{info.get('wo_number')} was not stored: {reason}")
         col1, col2 = st.columns(2)
-        with col1:
-            st.markdown("**Equipment Tags:**")
-            safety_data['equipment_tags'] = st.radio(
-                "Equipment Tags Status", 
-                ["OK", "Not OK"], 
-                key="safety_tags"
-            )
-            
-            st.markdown("**Hand Rail/Grating:**")
-            safety_data['handrail_grating'] = st.radio(
-                "Hand Rail/Grating Status", 
-                ["OK", "Not OK"], 
-                key="safety_handrail"
-            )
-            
-        with col2:
-            st.markdown("**Housekeeping - Cleaning:**")
-            safety_data['housekeeping'] = st.radio(
-                "Housekeeping Status", 
-                ["OK", "Not OK"], 
-                key="safety_housekeeping"
-            )
-            
-            st.markdown("**Terminal Box/Grounding Cables:**")
-            safety_data['terminal_grounding'] = st.radio(
-                "Terminal Box/Grounding Status", 
-                ["OK", "Not OK"], 
-                key="safety_terminal"
-            )
-        
-        safety_data['comments'] = st.text_area("Safety Comments", key="safety_comments")
-        
-    return safety_data
+        if col1.button("Resubmit as new revision", key=f"requeue_{key}"):
+            current = get_central_store().work_order(info.get('wo_number', ''))
+            queue.requeue(key, current.version if current else 0)
+            get_sync_worker().wake()
+            st.rerun()
+        if col2.button("Discard", key=f"discard_{key}"):
+            queue.discard(key)
+            st.rerun()
 
-def general_rake_condition_section():
-    """General rake operating condition section"""
-    st.markdown('<div class="section-header">⚙️ General Rake Operating Condition</div>', unsafe_allow_html=True)
+def render_field(section, field, key=None, equipment_tag=None, reading_history=None):
+    """Render one checklist field and return its value.  Route mode passes
+    the widget key, the asset and the prefetched reading history of a stop."""
+    key = key or f"{section.key}_{field.key}"
+    
+    if field.type in ('status', 'choice'):
+        if field.heading:
+            st.markdown(f"**{field.heading}:**")
+        value = st.radio(field.label, list(field.options), key=key)
+        # Anything but the first option (OK, Green) is a finding worth a photo
+        finding_photos(key, f"{section.key}_{field.key}", value != field.options[0])
+        return value
+    
+    if field.type == 'text':
+        return st.text_area(field.label, key=key)
+    
+    value = st.number_input(
+        field.label,
+        min_value=field.min, max_value=field.max, step=field.step,
+        key=key
+    )
+    column = f"{section.key}_{field.key}"
+    rules = get_rules()
+    if equipment_tag is None:
+        equipment_tag = st.session_state.get(INFO_KEYS['equipment_tag'])
+    if column in rules.columns:
+        history = reading_history or (lambda section_key, field_key:
+                                      previous_reading(section_key, field_key, equipment_tag))
+        previous, days, baseline = history(section.key, field.key)
+        for severity, message in rules.check(column, value, equipment_tag,
+                                             previous=previous, days=days, baseline=baseline):
+            if severity == 'alarm':
+                st.error(message)
+            else:
+                st.warning(message)
+    show_anomaly_score(column, value, equipment_tag)
+    return value
+
+def finding_photos(key, column, finding):
+    """Photo upload under an item reported as a finding.  Uploads are handed
+    to the attachment store's background pool at once, so resizing them
+    never holds up the form."""
+    from attachments import (AttachmentError, MAX_PHOTO_MB, MAX_PHOTOS_PER_ITEM, PHOTO_TYPES,
+                             check_upload)
+    
+    jobs = st.session_state.setdefault('photo_jobs', {})
+    uploads = None
+    if finding:
+        uploads = st.file_uploader(
+            f"📷 Photos (up to {MAX_PHOTOS_PER_ITEM}, {MAX_PHOTO_MB} MB each)",
+            type=list(PHOTO_TYPES), accept_multiple_files=True,
+            key=f"{key}_photos", max_upload_size=MAX_PHOTO_MB
+        )
+    if not uploads:
+        jobs.pop(key, None)
+        return
+    if len(uploads) > MAX_PHOTOS_PER_ITEM:
+        st.warning(f"Only the first {MAX_PHOTOS_PER_ITEM} photos will be attached.")
+        uploads = uploads[:MAX_PHOTOS_PER_ITEM]
+    
+    store = get_attachment_store()
+    previous = jobs.get(key, {}).get('files', {})
+    files = {}
+    for upload in uploads:
+        job = previous.get(upload.file_id)
+        if job is None:
+            try:
+                check_upload(upload.size, upload.name)
+            except AttachmentError as error:
+                st.warning(str(error))
+                continue
+            job = store.submit(upload.getvalue(), upload.name)
+        files[upload.file_id] = job
+    jobs[key] = {'column': column, 'files': files}
+    
+    done = [job.result() for job in files.values() if job.done() and job.exception() is None]
+    if done:
+        st.image([store.read(photo.id, 'thumb') for photo in done], width=96)
+    for job in files.values():
+        if job.done() and job.exception() is not None:
+            st.warning(f"Photo not attached: {job.exception()}")
+    if len(done) < len(files):
+        st.caption(f"⏳ Processing {len(files) - len(done)} photo(s)...")
+
+def collect_photos(prefix=''):
+    """{column: [photo records]} uploaded for the findings of one inspection
+    (route stops are told apart by their widget key prefix), waiting for
+    photos still being processed.  Returns (attachments, error messages)."""
+    from attachments import AttachmentError
+    
+    attachments, failed = {}, []
+    for key, job in st.session_state.get('photo_jobs', {}).items():
+        if key != prefix + job['column']:
+            continue
+        for future in job['files'].values():
+            try:
+                photo = future.result()
+            except AttachmentError as error:
+                failed.append(str(error))
+                continue
+            attachments.setdefault(job['column'], []).append(photo.to_record())
+    return attachments, failed
+
+def show_anomaly_score(column, value, equipment_tag):
+    """Score of a reading against the asset's own history, under its input"""
+    from baselines import SCORED_COLUMNS
+    if column not in SCORED_COLUMNS or not equipment_tag:
+        return
+    score = asset_baselines(equipment_tag).score(column, value)
+    if score is None:
+        return
+    icon = {'anomaly': "🔴", 'unusual': "🟠", 'normal': "🟢"}[score.level]
+    st.caption(f"{icon} {score.describe()}")
+
+@st.fragment
+def section_fragment(section):
+    """Render a section in its own fragment, so interacting with its widgets
+    reruns only that section"""
+    values = render_section(section)
+    autosave(section.key, values)
+    return values
+
+def render_section(section, render=render_field):
+    """Render a checklist section and return its values"""
+    with metrics.span('section', section=section.key):
+        return _render_section(section, render)
+
+def _render_section(section, render):
+    st.markdown(f'<div class="section-header">{section.icon} {section.title}</div>', unsafe_allow_html=True)
     
-    with st.expander("Operating Parameters", expanded=True):
-        operating_data = {}
+    with st.expander(section.expander, expanded=True):
+        values = {}
         
-        col1, col2 = st.columns(2)
-        with col1:
-            operating_data['drive_oil_pressure'] = st.number_input(
-                "Drive Hydraulic Supply Oil Pressure (MPa)", 
-                min_value=0.0, max_value=50.0, step=0.1,
-                key="drive_pressure"
-            )
-            
-            operating_data['rake_torque_pressure'] = st.number_input(
-                "Rake Torque Pressure (MPa)", 
-                min_value=0.0, max_value=50.0, step=0.1,
-                key="torque_pressure"
-            )
-            
-        with col2:
-            operating_data['rake_lift_pressure'] = st.number_input(
-                "Rake Lift Pressure (MPa) - Target: 9-10 MPa", 
-                min_value=0.0, max_value=15.0, step=0.1,
-                key="lift_pressure"
-            )
+        for n_columns, fields in section.form_layout():
+            if n_columns == 1:
+                for field in fields:
+                    values[field.key] = render(section, field)
+                continue
             
-            if operating_data['rake_lift_pressure'] < 9 or operating_data['rake_lift_pressure'] > 10:
-                st.warning("⚠️ Rake lift pressure is outside normal range (9-10 MPa)")
+            # Fill columns top to bottom, in schema order
+            columns = st.columns(n_columns)
+            for index, field in enumerate(fields):
+                with columns[index * n_columns // len(fields)]:
+                    values[field.key] = render(section, field)
         
-    return operating_data
+    return values
 
-def reservoir_section():
-    """Reservoir inspection section"""
-    st.markdown('<div class="section-header">🛢️ Reservoir</div>', unsafe_allow_html=True)
+@st.fragment
+@metrics.timed('vibration_section')
+def vibration_section():
+    """Vibration waveform upload section"""
+    from vibration import VIBRATION_POINTS
+    
+    st.markdown('<div class="section-header">📈 Vibration Waveforms</div>', unsafe_allow_html=True)
     
-    with st.expander("Reservoir Inspection Items", expanded=True):
-        reservoir_data = {}
+    with st.expander("Accelerometer Captures (CSV / WAV / raw binary)", expanded=False):
+        settings = {}
         
-        # Temperature readings
         col1, col2, col3 = st.columns(3)
         with col1:
-            reservoir_data['prv1_temp'] = st.number_input("PRV 1 Temperature (°C)", key="prv1_temp")
+            settings['sample_rate'] = st.number_input(
+                "Sample Rate (Hz) - CSV/binary captures",
+                min_value=1.0, value=25600.0, step=100.0,
+                key="vib_sample_rate"
+            )
         with col2:
-            reservoir_data['prv2_temp'] = st.number_input("PRV 2 Temperature (°C)", key="prv2_temp")
+            settings['units'] = st.radio(
+                "Acceleration Units",
+                ["g", "m/s2"],
+                key="vib_units",
+                horizontal=True
+            )
         with col3:
-            reservoir_data['prv3_temp'] = st.number_input("PRV 3 Temperature (°C)", key="prv3_temp")
-        
-        # Delta pressure
-        reservoir_data['delta_pressure'] = st.number_input(
-            "Delta Pressure Across Filter (kPa) - Target: < 300 kPa", 
-            min_value=0.0, step=1.0,
-            key="delta_pressure"
-        )
-        
-        if reservoir_data['delta_pressure'] >= 300:
-            st.warning("⚠️ Delta pressure is above recommended limit (300 kPa)")
-        
-        # Inspection items
-        inspection_items = [
-            ("oil_leaks", "Check hydraulic oil reservoir for oil leaks"),
-            ("condensate", "Check hydraulic oil reservoir for condensate built up"),
-            ("contamination", "Check hydraulic oil for contamination (dirty/milky)"),
-            ("panel_fittings", "Check instrument and fittings on panel for oil leaks"),
-            ("breather_condition", "Check reservoir breather condition")
-        ]
-        
-        for key, description in inspection_items:
-            st.markdown(f"**{description}:**")
-            reservoir_data[key] = st.radio(
-                description, 
-                ["OK", "Not OK"], 
-                key=f"reservoir_{key}"
+            settings['shaft_speed'] = st.number_input(
+                "Shaft Speed (RPM)",
+                min_value=0.0, value=1480.0, step=10.0,
+                key="vib_shaft_speed"
             )
         
-        # Filter color indicator
-        st.markdown("**Filter Color Indicator:**")
-        reservoir_data['filter_color'] = st.radio(
-            "Filter Color Status",
-            ["Green (OK)", "Yellow (Dirty)", "Red (Bypass)"],
-            key="filter_color"
-        )
-        
-        reservoir_data['comments'] = st.text_area("Reservoir Comments", key="reservoir_comments")
+        uploads = {}
+        for point, label, _, _ in VIBRATION_POINTS:
+            uploads[point] = st.file_uploader(
+                f"{label} Waveform",
+                type=["csv", "wav", "bin", "dat"],
+                key=f"vib_{point}"
+            )
         
-    return reservoir_data
+    return settings, uploads
 
-def hydraulic_drive_unit_section():
-    """Hydraulic drive unit section"""
-    st.markdown('<div class="section-header">🔧 Hydraulic Drive Unit</div>', unsafe_allow_html=True)
-    
-    with st.expander("Hydraulic Drive Unit Inspection", expanded=True):
-        drive_data = {}
-        
-        # Temperature readings
-        col1, col2 = st.columns(2)
-        with col1:
-            drive_data['nde_temp'] = st.number_input("NDE Temperature (°C)", key="drive_nde_temp")
-        with col2:
-            drive_data['motor_body_temp'] = st.number_input("Motor Body Temperature (°C)", key="drive_motor_temp")
-        
-        # Inspection items
-        inspection_items = [
-            ("general_condition", "General condition & Noise"),
-            ("hold_down_bolts", "Hold down bolts and Foundation base plate"),
-            ("cooling_lube", "Cooling system and Lube fitting integrity")
-        ]
-        
-        for key, description in inspection_items:
-            st.markdown(f"**{description}:**")
-            drive_data[key] = st.radio(
-                description, 
-                ["OK", "Not OK"], 
-                key=f"drive_{key}"
+def analyse_vibration_uploads(settings, uploads, inspection_data):
+    """Analyse uploaded waveforms and record overall values in inspection_data"""
+    from vibration import VIBRATION_POINTS, analyse_upload, summarise
+    
+    results = {}
+    summary = {}
+    
+    for point, label, section, field in VIBRATION_POINTS:
+        upload = uploads.get(point)
+        if upload is None:
+            continue
+        
+        file_format = 'bin' if upload.name.lower().endswith('.dat') else None
+        try:
+            result = analyse_upload(
+                upload,
+                file_format=file_format,
+                sample_rate=settings['sample_rate'],
+                units=settings['units'],
+                shaft_hz=settings['shaft_speed'] / 60.0 if settings['shaft_speed'] else None
             )
+        except ValueError as error:
+            st.error(f"Could not analyse {label} waveform: {error}")
+            continue
         
-        drive_data['comments'] = st.text_area("Hydraulic Drive Unit Comments", key="drive_comments")
-        
-    return drive_data
+        inspection_data[section][field] = round(result['velocity_rms'], 2)
+        summary.update(summarise(point, result))
+        results[point] = result
+    
+    if summary:
+        inspection_data['vibration'] = summary
+    
+    return results
 
-def hydraulic_pump_section():
-    """Hydraulic oil supply pump section"""
-    st.markdown('<div class="section-header">🔄 Hydraulic Oil Supply Pump</div>', unsafe_allow_html=True)
+def show_vibration_results(results):
+    """Display overall values and spectra of analysed waveforms"""
+    import plotly.graph_objects as go
+    from vibration import VIBRATION_POINTS
+    
+    labels = {point: label for point, label, _, _ in VIBRATION_POINTS}
+    for point, result in results.items():
+        st.markdown(f"**{labels[point]}**")
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Velocity RMS (mm/s)", f"{result['velocity_rms']:.2f}")
+        col2.metric("Acceleration RMS (m/s²)", f"{result['acceleration_rms']:.3f}")
+        col3.metric("Acceleration Peak (m/s²)", f"{result['acceleration_peak']:.3f}")
+        
+        frequencies = result['frequencies']
+        velocity_band = frequencies <= 1000
+        envelope_band = frequencies <= 500
+        
+        figure = go.Figure()
+        figure.add_trace(go.Scatter(x=frequencies[velocity_band],
+                                    y=result['velocity_spectrum'][velocity_band],
+                                    name="Velocity (mm/s RMS)"))
+        figure.add_trace(go.Scatter(x=frequencies[envelope_band],
+                                    y=result['envelope_spectrum'][envelope_band],
+                                    name="Envelope (m/s² RMS)", yaxis="y2"))
+        figure.update_layout(xaxis_title="Frequency (Hz)",
+                             yaxis_title="Velocity (mm/s)",
+                             yaxis2=dict(title="Envelope (m/s²)", overlaying="y", side="right"),
+                             height=350, margin=dict(t=20, b=40))
+        st.plotly_chart(figure, use_container_width=True)
+        
+        if result['fault_bands']:
+            st.caption("Envelope energy at bearing fault frequencies: " + ", ".join(
+                f"{name.upper()} {energy:.3g}" for name, energy in result['fault_bands'].items()))
+
+def cached_artifact(kind, template_version, render):
+    """Rendered artifact of the current inspection, re-rendered only when the
+    inspection or the template version has changed"""
+    artifact = get_artifact_cache().get_or_render(kind, template_version,
+                                                  st.session_state.inspection_info,
+                                                  st.session_state.inspection_data,
+                                                  render)
+    metrics.count('exports', kind=kind)
+    metrics.observe('export_bytes', len(artifact), metrics.BYTES_BUCKETS, kind=kind)
+    return artifact
+
+@st.fragment
+@metrics.timed('export_options')
+def export_options():
+    """Export buttons for the completed inspection"""
+    from report import render_docx_bytes, template_version, DOCX_MIME
+    from data_export import csv_bytes, xlsx_bytes, export_version, XLSX_MIME
+    import pdf_report
     
-    with st.expander("Pump Inspection Items", expanded=True):
-        pump_data = {}
-        
-        # Temperature reading
-        pump_data['pump_temp'] = st.number_input("Pump Temperature (°C)", key="pump_temp")
-        
-        # Inspection items
-        inspection_items = [
-            ("general_condition", "General condition & Noise"),
-            ("pedestal_bolts", "Pedestal hold down bolts and Foundation base plate"),
-            ("casing_fittings", "Pump casing & Suction/discharge line fittings"),
-            ("flexible_hoses", "Check Flexible hose supply lines for chafe and cracks")
-        ]
-        
-        for key, description in inspection_items:
-            st.markdown(f"**{description}:**")
-            pump_data[key] = st.radio(
-                description, 
-                ["OK", "Not OK"], 
-                key=f"pump_{key}"
+    st.markdown("---")
+    st.subheader("📥 Export Options")
+    
+    # Laid out by the checklist of the inspection's equipment type
+    checklist = checklist_for(st.session_state.inspection_info)
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        if st.button("📄 Download Word Report"):
+            doc_bytes = cached_artifact('docx', template_version(checklist), render_docx_bytes)
+            
+            st.download_button(
+                label="Download DOCX",
+                data=doc_bytes,
+                file_name=f"inspection_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx",
+                mime=DOCX_MIME
             )
-        
-        pump_data['comments'] = st.text_area("Pump Comments", key="pump_comments")
-        
-    return pump_data
-
-#-------------------------------------------Nouveau----------------------------------------------------------------------------------------------------
-
-
-def create_docx_report(inspection_info, inspection_data):
-    """Create a comprehensive Word document report aligned with provided templates"""
-    doc = Document()
-    
-    # Set default font
-    style = doc.styles['Normal']
-    font = style.font
-    font.name = 'Arial'
-    font.size = Pt(9)
-
-    # Header with logo placeholder
-    header = doc.sections[0].header
-    header_para = header.paragraphs[0]
-    header_run = header_para.add_run()
-    # Logo placeholder - in real app, use: header_run.add_picture("logo.png", width=Inches(1.0))
-    header_run.add_text("AMBATOVY - Condition Monitoring Rotating Equipment")
-    header_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    # Title
-    title = doc.add_heading('Thickener Hydraulic Power Pack CM Check Sheet', 0)
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    title.style.font.size = Pt(14)
-    title.style.font.bold = True
-
-    # Inspection Information - CORRECTION APPLIQUÉE ICI
-    doc.add_heading('Inspection Details', level=1)
-    info_table = doc.add_table(rows=1, cols=4)
-    info_table.style = 'Table Grid'
-    
-    # Set column widths
-    col_widths = [Inches(1.2), Inches(2.0), Inches(1.2), Inches(2.0)]
-    for i, width in enumerate(col_widths):
-        info_table.columns[i].width = width
-
-    # Add header row
-    hdr_row = info_table.rows[0].cells
-    hdr_row[0].text = "Check by:"
-    hdr_row[1].text = f"{inspection_info['technician_name']} / {inspection_info['group']}"
-    hdr_row[2].text = "Date:"
-    hdr_row[3].text = inspection_info['inspection_date'].strftime("%d/%m/%Y")
-
-    # Add data rows dynamically
-    rows_data = [
-        ("Review by:", ""),
-        ("Equipment Tag #:", inspection_info['equipment_tag']),
-        ("Work Order #:", inspection_info['wo_number']),
-        ("Visual Check:", "✓" if inspection_info['visual_check'] else "✗"),
-        ("Vibration Check:", "✓" if inspection_info['vibration_check'] else "✗")
-    ]
-    
-    for label, value in rows_data:
-        row_cells = info_table.add_row().cells
-        row_cells[0].text = label
-        row_cells[1].text = value
-        row_cells[2].text = ""
-        row_cells[3].text = ""
-
-    # Safety Section
-    safety = inspection_data.get('safety', {})
-    doc.add_heading('Safety', level=1)
-    safety_table = doc.add_table(rows=1, cols=2)
-    safety_table.style = 'Table Grid'
-    
-    safety_items = [
-        ("Equipment Tags:", safety.get('equipment_tags', '')),
-        ("Hand Rail/Grating:", safety.get('handrail_grating', '')),
-        ("Housekeeping:", safety.get('housekeeping', '')),
-        ("Terminal Box/Grounding:", safety.get('terminal_grounding', '')),
-        ("Coupling Guard:", safety.get('coupling_guard', '')),
-        ("Comments:", safety.get('comments', ''))
-    ]
-    
-    for item, status in safety_items:
-        row_cells = safety_table.add_row().cells
-        row_cells[0].text = item
-        row_cells[1].text = str(status)
-        row_cells[0].paragraphs[0].runs[0].font.bold = True
-
-    # General Rake Operating Condition
-    operating = inspection_data.get('operating', {})
-    doc.add_heading('General Rake Operating Condition', level=1)
-    doc.add_paragraph("Check rake drive system and record the following data.")
-    
-    operating_table = doc.add_table(rows=0, cols=2)
-    operating_table.style = 'Table Grid'
-    
-    operating_items = [
-        ("Drive Oil Pressure (MPa):", operating.get('drive_oil_pressure', '')),
-        ("Rake Torque Pressure (MPa):", operating.get('rake_torque_pressure', '')),
-        ("Rake Lift Pressure (MPa):", operating.get('rake_lift_pressure', '')),
-        ("Rake Lift Pressure While Lifting (MPa):", operating.get('rake_lift_pressure_lifting', '')),
-        ("Rake Lift Pressure While Lowering (MPa):", operating.get('rake_lift_pressure_lowering', '')),
-        ("Thickener Rake Position:", operating.get('rake_position', '')),
-        ("Thickener Rake Torque:", operating.get('rake_torque', '')),
-        ("Thickener Rake Speed:", operating.get('rake_speed', ''))
-    ]
-    
-    for item, value in operating_items:
-        row_cells = operating_table.add_row().cells
-        row_cells[0].text = item
-        row_cells[1].text = str(value)
-        row_cells[0].paragraphs[0].runs[0].font.bold = True
-
-    # Reservoir Section
-    reservoir = inspection_data.get('reservoir', {})
-    doc.add_heading('Reservoir', level=1)
-    doc.add_paragraph("Check hydraulic oil reservoir and record the following data.")
-    
-    reservoir_table = doc.add_table(rows=0, cols=2)
-    reservoir_table.style = 'Table Grid'
-    
-    # Reservoir items
-    reservoir_items = [
-        ("Check hydraulic oil reservoir for oil leaks", reservoir.get('oil_leaks', '')),
-        ("Check hydraulic oil reservoir for condensate built up", reservoir.get('condensate', '')),
-        ("Check hydraulic oil for contamination (dirty/milky)", reservoir.get('contamination', '')),
-        ("Check instrument and fittings on panel for oil leaks", reservoir.get('panel_fittings', '')),
-        ("Check reservoir breather condition", reservoir.get('breather_condition', '')),
-        ("Delta Pressure Across Filter (kPa)", reservoir.get('delta_pressure', '')),
-        ("Filter Color Indicator", reservoir.get('filter_color', '')),
-        ("PRV 1 Temperature (°C)", reservoir.get('prv1_temp', '')),
-        ("PRV 2 Temperature (°C)", reservoir.get('prv2_temp', '')),
-        ("PRV 3 Temperature (°C)", reservoir.get('prv3_temp', '')),
-        ("Comments:", reservoir.get('comments', ''))
-    ]
-    
-    for item, value in reservoir_items:
-        row_cells = reservoir_table.add_row().cells
-        row_cells[0].text = item
-        row_cells[1].text = str(value)
-        if item != "Comments:":
-            row_cells[0].paragraphs[0].runs[0].font.bold = True
-
-    # Hydraulic Drive Unit Section
-    drive = inspection_data.get('hydraulic_drive', {})
-    doc.add_heading('Hydraulic Drive Unit', level=1)
-    
-    drive_table = doc.add_table(rows=0, cols=3)
-    drive_table.style = 'Table Grid'
-    
-    # Drive unit items
-    drive_items = [
-        ("General condition & Noise", drive.get('general_condition', ''), ""),
-        ("Hold down bolts and Foundation base plate", drive.get('hold_down_bolts', ''), ""),
-        ("Cooling system and Lube fitting integrity", drive.get('cooling_lube', ''), ""),
-        ("NDE Temperature (°C)", "", drive.get('nde_temp', '')),
-        ("NDE Temperature (°C)", "", drive.get('nde_temp2', '')),
-        ("Motor Body Temperature (°C)", "", drive.get('motor_body_temp', '')),
-        ("Vibration (mm/sec)", "", drive.get('vibration', '')),
-        ("Temperature (°C)", "", drive.get('temperature', '')),
-        ("Comments:", drive.get('comments', ''), "")
-    ]
-    
-    for item, status, value in drive_items:
-        row_cells = drive_table.add_row().cells
-        row_cells[0].text = item
-        row_cells[1].text = str(status)
-        row_cells[2].text = str(value)
-        if item not in ["Comments:"]:
-            row_cells[0].paragraphs[0].runs[0].font.bold = True
-
-    # Hydraulic Pump Section
-    pump = inspection_data.get('hydraulic_pump', {})
-    doc.add_heading('Hydraulic Oil Supply Pump', level=1)
-    
-    pump_table = doc.add_table(rows=0, cols=3)
-    pump_table.style = 'Table Grid'
-    
-    # Pump items
-    pump_items = [
-        ("General condition & Noise", pump.get('general_condition', ''), ""),
-        ("Pedestal hold down bolts and Foundation base plate", pump.get('pedestal_bolts', ''), ""),
-        ("Pump casing & Suction/discharge line fittings", pump.get('casing_fittings', ''), ""),
-        ("Check Flexible hose supply lines for chafe and cracks", pump.get('flexible_hoses', ''), ""),
-        ("Pump Temperature (°C)", "", pump.get('pump_temp', '')),
-        ("Vibration (mm/sec)", "", pump.get('vibration', '')),
-        ("Temperature (°C)", "", pump.get('temperature', '')),
-        ("Comments:", pump.get('comments', ''), "")
-    ]
-    
-    for item, status, value in pump_items:
-        row_cells = pump_table.add_row().cells
-        row_cells[0].text = item
-        row_cells[1].text = str(status)
-        row_cells[2].text = str(value)
-        if item not in ["Comments:"]:
-            row_cells[0].paragraphs[0].runs[0].font.bold = True
-
-    # Add more sections similarly for:
-    # - Motor M2
-    # - Rotary Hydraulic Drive Motor and Gearbox
-    # - Planetary Gear Reducer
-    # - Rake Lift mechanism
-    # - Automatic Grease Lubrication Unit
-    
-    return doc
-
-# ... (le reste du code reste inchangé)
-
-# ... (le reste du code reste inchangé)
-
-#----------------------------------------------Fin-----------------------------------------------------------------------------------------------------
-def export_to_csv(inspection_info, inspection_data):
-    """Export inspection data to CSV"""
-    csv_data = []
-    
-    # Basic information
-    base_info = {
-        'Date': inspection_info['inspection_date'].strftime("%Y-%m-%d"),
-        'Technician': inspection_info['technician_name'],
-        'Group': inspection_info['group'],
-        'Equipment_Tag': inspection_info['equipment_tag'],
-        'WO_Number': inspection_info['wo_number'],
-        'Inspection_Type': inspection_info['inspection_type'],
-        'Visual_Check': inspection_info['visual_check'],
-        'Vibration_Check': inspection_info['vibration_check']
-    }
     
-    # Flatten inspection data
-    flattened_data = {}
-    for section, data in inspection_data.items():
-        if isinstance(data, dict):
-            for key, value in data.items():
-                flattened_data[f"{section}_{key}"] = value
-        else:
-            flattened_data[section] = data
+    with col2:
+        if st.button("🖨️ Download PDF Report"):
+            pdf_bytes = cached_artifact('pdf', pdf_report.template_version(checklist),
+                                        pdf_report.render_pdf_bytes)
+            
+            st.download_button(
+                label="Download PDF",
+                data=pdf_bytes,
+                file_name=f"inspection_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+                mime=pdf_report.PDF_MIME
+            )
     
-    # Combine all data
-    combined_data = {**base_info, **flattened_data}
-    csv_data.append(combined_data)
+    with col3:
+        if st.button("📊 Download CSV Data"):
+            csv_data = cached_artifact('csv', export_version(checklist),
+                                       lambda info, data: csv_bytes([(info, data)], checklist))
+            
+            st.download_button(
+                label="Download CSV",
+                data=csv_data,
+                file_name=f"inspection_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv"
+            )
     
-    df = pd.DataFrame(csv_data)
-    return df
+    with col4:
+        if st.button("📗 Download Excel Data"):
+            xlsx_data = cached_artifact('xlsx', export_version(checklist),
+                                        lambda info, data: xlsx_bytes([(info, data)], checklist))
+            
+            st.download_button(
+                label="Download XLSX",
+                data=xlsx_data,
+                file_name=f"inspection_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                mime=XLSX_MIME
+            )
+
+def route_setup():
+    """Set up a route: who, when and which assets, then prefetch their history"""
+    from route import load_route, parse_route
+
+    with st.form("route_setup"):
+        col1, col2 = st.columns(2)
+        with col1:
+            technician_name = st.text_input("Technician Name", placeholder="e.g., Rodin")
+            group = st.text_input("Group", placeholder="e.g., Group A")
+            inspection_date = st.date_input("Inspection Date", datetime.now())
+            inspection_type = st.selectbox("Select Inspection Type",
+                                           list(get_checklist().inspection_types))
+        with col2:
+            stops_text = st.text_area(
+                "Equipment Tags", height=210,
+                placeholder="31 - TM - 01, WO123456\n31 - TM - 02",
+                help="One equipment tag per line, optionally followed by a comma and "
+                     "its work order number"
+            )
+        loaded = st.form_submit_button("Load Route", type="primary")
+
+    if not loaded:
+        return
+    stops = parse_route(stops_text)
+    if not technician_name or not group or not stops:
+        st.error("Please enter technician name, group and at least one equipment tag.")
+        return
+    st.session_state.route = {
+        'info': {
+            'technician_name': technician_name,
+            'group': group,
+            'inspection_date': inspection_date,
+            'inspection_type': inspection_type,
+            'equipment_type': selected_equipment().key,
+        },
+        'stops': load_route(get_central_store(), get_rules(), stops, inspection_date),
+        'prefill': {},
+        'values': {},
+        'skipped': set(),
+    }
+    st.session_state.route_current = 0
+    st.rerun()
+
+def render_stop_field(index, stop, section, field):
+    """Render a field of a route stop, pre-filled from the asset's last inspection"""
+    route = st.session_state.route
+    key = f"route{index}_{section.key}_{field.key}"
+    # Widgets of the stops not on screen are dropped; restore what was entered
+    if key not in st.session_state:
+        entered = route['values'].get(index, {}).get(section.key, {})
+        if index not in route['prefill']:
+            route['prefill'][index] = stop.prefill(get_checklist())
+        value = entered.get(field.key, route['prefill'][index].get(section.key, {}).get(field.key))
+        if value is not None:
+            st.session_state[key] = value
+
+    inspection_date = route['info']['inspection_date']
+    value = render_field(section, field, key=key, equipment_tag=stop.equipment_tag,
+                         reading_history=lambda section_key, field_key:
+                             stop.previous_reading(section_key, field_key, inspection_date))
+    last = stop.last_value(section.key, field.key)
+    if field.type == 'number' and last not in (None, ''):
+        st.caption(f"Last inspection ({stop.last_inspection_date}): {last}")
+    return value
+
+def move_stop(step):
+    st.session_state.route_current += step
+
+@st.fragment
+@metrics.timed('route_stop')
+def route_stop():
+    """Form of the current asset of the route; moving between assets reruns
+    only this part of the page"""
+    route = st.session_state.route
+    stops = route['stops']
+
+    def status(index):
+        return "⏭️" if index in route['skipped'] else "✅" if index in route['values'] else "⬜"
+
+    st.progress(len(set(route['values']) | route['skipped']) / len(stops),
+                text=f"{len(route['values'])} of {len(stops)} assets inspected")
+    st.caption("  ·  ".join(f"{status(index)} {stop.equipment_tag}"
+                            for index, stop in enumerate(stops)))
+    col1, col2, col3 = st.columns([1, 4, 1])
+    with col1:
+        st.button("◀ Previous", on_click=move_stop, args=(-1,),
+                  disabled=st.session_state.route_current == 0)
+    with col2:
+        index = st.selectbox("Asset", range(len(stops)),
+                             format_func=lambda index: f"{index + 1}. {stops[index].equipment_tag}",
+                             key="route_current", label_visibility="collapsed")
+    with col3:
+        st.button("Next ▶", on_click=move_stop, args=(1,),
+                  disabled=st.session_state.route_current == len(stops) - 1)
+
+    stop = stops[index]
+    details = f"**{stop.equipment_tag}**"
+    if stop.wo_number:
+        details += f" – {stop.wo_number}"
+        if stop.work_order_version:
+            details += f" (already submitted, this will be revision {stop.work_order_version + 1})"
+    if stop.latest is not None:
+        details += (f" – last inspected {stop.last_inspection_date} by "
+                    f"{stop.latest[0].get('technician_name') or 'unknown'}")
+    else:
+        details += " – no previous inspection"
+    st.markdown(details)
+
+    if st.checkbox("Skip this asset", value=index in route['skipped'], key=f"route{index}_skip"):
+        route['skipped'].add(index)
+        route['values'].pop(index, None)
+        return
+    route['skipped'].discard(index)
 
+    values = {}
+    for section in get_checklist().form_sections:
+        values[section.key] = render_section(
+            section, lambda section, field: render_stop_field(index, stop, section, field))
+    route['values'][index] = values
+
+def submit_route():
+    """Validate every inspected asset and queue the whole route as one batch"""
+    from baselines import anomaly_scores
+    from route import stop_info
+
+    route = st.session_state.route
+    checklist = get_checklist()
+    stops = route['stops']
+    remaining = [stop.equipment_tag for index, stop in enumerate(stops)
+                 if index not in route['values'] and index not in route['skipped']]
+    if remaining:
+        st.error("Not inspected yet (inspect or skip them): " + ", ".join(remaining))
+        return
+
+    inspections, problems = [], []
+    for index in sorted(route['values']):
+        stop = stops[index]
+        inspection_info = stop_info(route['info'], stop)
+        inspection_data = dict(route['values'][index])
+        errors, _ = checklist.validate_inspection(inspection_info, inspection_data)
+        if errors:
+            problems.append(f"{stop.equipment_tag}: {' '.join(errors)}")
+            continue
+        scores = asset_baselines(stop.equipment_tag).score_inspection(inspection_data)
+        inspection_data['anomaly_scores'] = anomaly_scores(scores)
+        attachments, failed = collect_photos(f"route{index}_")
+        problems.extend(f"{stop.equipment_tag}: photo not attached ({message})." for message in failed)
+        if attachments:
+            inspection_data['attachments'] = attachments
+        expected_version = stop.work_order_version if stop.wo_number else None
+        inspections.append((inspection_info, inspection_data, expected_version))
+    if problems:
+        metrics.count('submissions', len(problems), outcome='invalid')
+        st.error("Please complete the route before submitting: " + " ".join(problems))
+        return
+
+    get_queue().enqueue_many(inspections)
+    get_sync_worker().wake()
+    for key in [key for key in st.session_state.get('photo_jobs', {}) if key.startswith('route')]:
+        del st.session_state.photo_jobs[key]
+    metrics.count('submissions', len(inspections), outcome='queued')
+    metrics.count('routes')
+    st.session_state.route_submitted = (len(inspections), len(route['skipped']))
+    del st.session_state.route
+    st.rerun()
+
+def route_mode():
+    """Inspection round over several assets, submitted as one batch"""
+    submitted = st.session_state.pop('route_submitted', None)
+    if submitted:
+        st.success(f"Route completed successfully! {submitted[0]} inspection(s) submitted"
+                   + (f", {submitted[1]} asset(s) skipped." if submitted[1] else "."))
+
+    if 'route' not in st.session_state:
+        route_setup()
+        return
+
+    route = st.session_state.route
+    info = route['info']
+    st.subheader(f"🗺️ Route of {info['technician_name']} ({info['group']}) – "
+                 f"{info['inspection_type']}, {info['inspection_date']}")
+    route_stop()
+
+    st.markdown("---")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Complete Route", type="primary"):
+            submit_route()
+    with col2:
+        if st.button("Abandon Route"):
+            del st.session_state.route
+            st.rerun()
+
+    rejected_submissions(info['technician_name'])
+
+@metrics.timed('page')
 def main():
     """Main application function"""
+    start_metrics_endpoint()
+    metrics.count('reruns')
     initialize_session_state()
     
-    # Display logo
-    create_logo_placeholder()
-    
-    st.markdown('<h1 class="main-header">Hydraulic Power Pack Inspection System</h1>', 
-                unsafe_allow_html=True)
-    
-    # Create main form
-    with st.form("inspection_form"):
-        # Get inspection info
-        inspection_info = create_inspection_form()
-        
-        st.markdown("---")
-        
-        # Inspection sections
-        inspection_data = {}
-        
-        # Safety section
-        inspection_data['safety'] = safety_section()
-        
-        # General rake operating condition
-        inspection_data['operating'] = general_rake_condition_section()
-        
-        # Reservoir section
-        inspection_data['reservoir'] = reservoir_section()
-        
-        # Hydraulic drive unit
-        inspection_data['hydraulic_drive'] = hydraulic_drive_unit_section()
-        
-        # Hydraulic pump
-        inspection_data['hydraulic_pump'] = hydraulic_pump_section()
-        
-        # Form submission
+    # Display logo and title
+    render_page_header()
+    
+    # Only the selected equipment type is loaded; the form follows its checklist
+    types = dict(equipment_types())
+    st.sidebar.selectbox("Equipment Type", list(types), format_func=types.get,
+                         key=INFO_KEYS['equipment_type'], disabled='route' in st.session_state,
+                         help="Each type has its own checklist, limits and report layout")
+    
+    # A technician's round over several assets is entered in route mode
+    mode = st.sidebar.radio("Mode", ["Single Asset", "Route"], key="mode",
+                            help="Route: inspect several assets in one round and submit them together")
+    if mode == "Route":
+        route_mode()
+        return
+
+    # Get inspection info
+    inspection_info = create_inspection_form()
+    
+    st.markdown("---")
+    
+    # Inspection sections, each rerunning on its own when edited
+    inspection_data = {}
+    for section in get_checklist().form_sections:
+        inspection_data[section.key] = section_fragment(section)
+    
+    # Vibration waveforms (measurement points of checklists with a vibration section)
+    vibration_settings, vibration_uploads = {}, {}
+    if any(section.key == 'vibration' for section in get_checklist().sections):
+        vibration_settings, vibration_uploads = vibration_section()
+    
+    # Submission (a full rerun, so every section reports its current values)
+    st.markdown("---")
+    submitted = st.button("Complete Inspection", type="primary")
+    # "Submit as revision N" after a work order conflict submits on the next run
+    submitted = st.session_state.pop('resubmit', False) or submitted
+    
+    if submitted:
+        errors, _ = get_checklist().validate_inspection(inspection_info, inspection_data)
+        if errors:
+            metrics.count('submissions', outcome='invalid')
+            st.error("Please complete the inspection before submitting: " + " ".join(errors))
+        elif work_order_conflict(inspection_info):
+            metrics.count('submissions', outcome='conflict')
+        else:
+            st.session_state.vibration_results = {}
+            if inspection_info['vibration_check'] and vibration_uploads:
+                with st.spinner("Analysing vibration waveforms..."):
+                    st.session_state.vibration_results = analyse_vibration_uploads(
+                        vibration_settings, vibration_uploads, inspection_data)
+            
+            with st.spinner("Processing photos..."):
+                attachments, failed = collect_photos()
+            for message in failed:
+                st.warning(f"Photo not attached: {message}")
+            if attachments:
+                inspection_data['attachments'] = attachments
+            
+            # Scores against the asset's baselines are kept with the inspection
+            from baselines import anomaly_scores
+            scores = asset_baselines(inspection_info['equipment_tag']).score_inspection(inspection_data)
+            inspection_data['anomaly_scores'] = anomaly_scores(scores)
+            
+            # Queue locally first; the sync worker uploads it when the network allows
+            wo_number = inspection_info['wo_number']
+            get_queue().enqueue(inspection_info, inspection_data,
+                                draft_id=st.session_state.draft_id,
+                                expected_version=work_order_revision(wo_number) if wo_number else None)
+            get_sync_worker().wake()
+            metrics.count('submissions', outcome='queued')
+            start_new_draft()
+            st.success("Inspection completed successfully!")
+            
+            # Store data in session state
+            st.session_state.inspection_info = inspection_info
+            st.session_state.inspection_data = inspection_data
+    
+    conflict = st.session_state.get('wo_conflict')
+    if conflict is not None:
+        st.error(f"{conflict}. Review their inspection before submitting yours.")
+        if st.button(f"Submit as revision {conflict.current_version + 1} instead"):
+            st.session_state.wo_revisions[conflict.wo_number] = conflict.current_version
+            st.session_state.resubmit = True
+            del st.session_state.wo_conflict
+            st.rerun()
+    
+    rejected_submissions(inspection_info['technician_name'])
+    
+    pending = get_queue().pending_count()
+    if pending:
+        worker = get_sync_worker()
+        status = f"⏳ {pending} inspection(s) waiting to sync"
+        if worker.last_error is not None:
+            status += f" (last attempt failed: {worker.last_error})"
+        st.caption(status)
+    
+    # Vibration analysis of the completed inspection
+    if st.session_state.get('vibration_results'):
         st.markdown("---")
-        submitted = st.form_submit_button("Complete Inspection", type="primary")
-        
-        if submitted:
-            if not inspection_info['technician_name'] or not inspection_info['group']:
-                st.error("Please enter technician name and group before submitting.")
-            else:
-                st.success("Inspection completed successfully!")
-                
-                # Store data in session state
-                st.session_state.inspection_info = inspection_info
-                st.session_state.inspection_data = inspection_data
+        st.subheader("📈 Vibration Analysis")
+        show_vibration_results(st.session_state.vibration_results)
     
     # Export options (only show if inspection is completed)
     if hasattr(st.session_state, 'inspection_info'):
-        st.markdown("---")
-        st.subheader("📥 Export Options")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            if st.button("📄 Download Word Report"):
-                doc = create_docx_report(st.session_state.inspection_info, 
-                                       st.session_state.inspection_data)
-                
-                # Save document to bytes
-                doc_bytes = io.BytesIO()
-                doc.save(doc_bytes)
-                doc_bytes.seek(0)
-                
-                st.download_button(
-                    label="Download DOCX",
-                    data=doc_bytes.getvalue(),
-                    file_name=f"inspection_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                )
-        
-        with col2:
-            if st.button("📊 Download CSV Data"):
-                df = export_to_csv(st.session_state.inspection_info, 
-                                 st.session_state.inspection_data)
-                
-                csv_buffer = io.StringIO()
-                df.to_csv(csv_buffer, index=False)
-                csv_data = csv_buffer.getvalue()
-                
-                st.download_button(
-                    label="Download CSV",
-                    data=csv_data,
-                    file_name=f"inspection_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
-                )
+        export_options()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,265 @@
+"""Opt-in runtime instrumentation: timing spans and counters.
+
+Instrumentation is off unless one of these environment variables is set
+when the process starts:
+
+    VIBROSENS_METRICS=1              collect (the API serves them on /metrics)
+    VIBROSENS_METRICS_PORT=9464      also serve Prometheus text on :9464/metrics
+    VIBROSENS_METRICS_HOST=0.0.0.0   address to serve it on (default 127.0.0.1)
+    VIBROSENS_METRICS_LOG=spans.log  also append every span to a JSON lines file
+
+Timed code is wrapped with the timed decorator or the span context manager.
+While instrumentation is off, timed returns the function itself and span
+returns a shared do-nothing context manager, so disabled instrumentation
+costs nothing in decorated functions and well under a microsecond per span.
+
+Spans are recorded in the histogram vibrosens_span_seconds{span=...}; counts
+and sizes go to counters (vibrosens_<name>_total) and histograms
+(vibrosens_<name>) with the labels given by the caller.
+"""
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+PORT = os.environ.get('VIBROSENS_METRICS_PORT')
+# Loopback unless the scraper is on another host
+HOST = os.environ.get('VIBROSENS_METRICS_HOST', '127.0.0.1')
+LOG_PATH = os.environ.get('VIBROSENS_METRICS_LOG')
+ENABLED = bool(os.environ.get('VIBROSENS_METRICS') or PORT or LOG_PATH)
+
+PREFIX = 'vibrosens_'
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+# /metrics server of this process (see serve())
+_server = None
+_server_lock = threading.Lock()
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels, extra=()):
+    pairs = sorted(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Counters and histograms of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """Prometheus text exposition of every metric"""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(((key, (h.buckets, list(h.counts), h.sum, h.count))
+                                 for key, h in self.histograms.items()), key=lambda item: item[0])
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}{name}_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {_number(value)}")
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            metric = f"{PREFIX}{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _number(float(bound))
+                lines.append(f"{metric}_bucket{_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{metric}_count{_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+_log_lock = threading.Lock()
+_log_stream = None
+
+
+def _log_span(name, started, elapsed, labels):
+    global _log_stream
+    line = json.dumps({'ts': round(started, 6), 'span': name, 'ms': round(elapsed * 1000, 3),
+                       **labels})
+    with _log_lock:
+        if _log_stream is None:
+            _log_stream = open(LOG_PATH, 'a', encoding='utf-8', buffering=1)
+        _log_stream.write(line + '\n')
+
+
+def count(name, value=1, **labels):
+    """Add value to the counter vibrosens_<name>_total"""
+    if ENABLED:
+        REGISTRY.inc(name, value, **labels)
+
+
+def observe(name, value, buckets=SECONDS_BUCKETS, **labels):
+    """Record value in the histogram vibrosens_<name>"""
+    if ENABLED:
+        REGISTRY.observe(name, value, buckets, **labels)
+
+
+def record_span(name, elapsed, started=None, **labels):
+    REGISTRY.observe('span_seconds', elapsed, SECONDS_BUCKETS, span=name, **labels)
+    if LOG_PATH:
+        _log_span(name, time.time() - elapsed if started is None else started, elapsed, labels)
+
+
+class _Span:
+    __slots__ = ('name', 'labels', 'started', 'wall')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_span(self.name, time.perf_counter() - self.started, self.wall, **self.labels)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **labels):
+    """Context manager timing its block as span name"""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name, labels)
+
+
+def timed(name):
+    """Decorator timing every call of a function as span name (coroutines
+    until they return, generator functions until the generator is exhausted
+    or closed)"""
+    def decorate(function):
+        if not ENABLED:
+            return function
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def coroutine_wrapper(*args, **kwargs):
+                with _Span(name, {}):
+                    return await function(*args, **kwargs)
+            return coroutine_wrapper
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                with _Span(name, {}):
+                    yield from function(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def serve(port, host=HOST):
+    """Serve the registry as Prometheus text on http://host:port/metrics from
+    a daemon thread.  Only one server is started per process."""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server",
+                             daemon=True).start()
+    return _server
+
+
+def serve_from_environment():
+    """Start the /metrics endpoint if VIBROSENS_METRICS_PORT is set"""
+    if not PORT:
+        return None
+    try:
+        return serve(PORT)
+    except OSError:
+        # Another app process on this host already serves the port
+        return None
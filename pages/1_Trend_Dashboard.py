@@ -0,0 +1,111 @@
+import streamlit as st
+from datetime import date
+from storage import shared_store
+from equipment import get_equipment
+from trends import TrendCache, charts_for
+
+# Only downsampled series reach the browser; the full history stays in the
+# shared TrendCache and is topped up with new inspections as they arrive.
+
+st.set_page_config(
+    page_title="Vibro-Sens Trend Dashboard",
+    page_icon="📈",
+    layout="wide"
+)
+
+DOWNSAMPLING_METHODS = {
+    "Min/max buckets": 'minmax',
+    "LTTB": 'lttb',
+}
+
+def get_store():
+    """Central inspection store, shared with the inspection form and every session"""
+    return shared_store()
+
+@st.cache_resource
+def get_trend_cache():
+    """Trend series shared by every session"""
+    return TrendCache()
+
+def dashboard_options():
+    """Equipment tag, date range and downsampling settings"""
+    tags = get_store().equipment_tags()
+    if not tags:
+        return None
+
+    col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
+    with col1:
+        equipment_tag = st.selectbox("Equipment Tag #", tags)
+    with col2:
+        date_range = st.date_input("Date Range", value=(), max_value=date.today(),
+                                   help="Leave empty to show the whole history")
+    with col3:
+        method = st.selectbox("Downsampling", list(DOWNSAMPLING_METHODS))
+    with col4:
+        max_points = st.selectbox("Points per series", [500, 2000, 5000], index=1)
+
+    start, end = (date_range + (None, None))[:2] if date_range else (None, None)
+    return {
+        'equipment_tag': equipment_tag,
+        'start': start,
+        'end': end,
+        'method': DOWNSAMPLING_METHODS[method],
+        'max_points': max_points,
+    }
+
+def limit_lines(figure, rules, columns, equipment_tag):
+    """Dashed lines at the alarm limits of the plotted readings"""
+    levels = set()
+    for column in columns:
+        rule = rules.rule(column, 'alarm', equipment_tag)
+        if rule is not None:
+            levels.update(level for level in (rule.low, rule.high) if level is not None)
+    for level in sorted(levels):
+        figure.add_hline(y=level, line_dash="dash", line_color="#C0392B", opacity=0.6)
+
+@st.fragment(run_every=60)
+def trend_charts(options):
+    """Trend charts of one tag; reruns every minute to pick up new inspections"""
+    import plotly.graph_objects as go
+
+    series = get_trend_cache().series(get_store(), options['equipment_tag'])
+    st.caption(f"{len(series)} inspections on record")
+
+    # Charts and limits of the tag's equipment type
+    equipment = get_equipment(series.equipment_type)
+    for title, units, traces in charts_for(equipment.checklist):
+        figure = go.Figure()
+        shown = total = 0
+        for column, label in traces:
+            dates, values, n_readings = series.downsample(
+                column, options['max_points'], options['method'],
+                options['start'], options['end'])
+            if not n_readings:
+                continue
+            figure.add_trace(go.Scattergl(x=dates, y=values, name=label, mode='lines+markers',
+                                          marker=dict(size=4)))
+            shown += len(values)
+            total += n_readings
+
+        st.subheader(title)
+        if not total:
+            st.info(f"No {title.lower()} recorded for this equipment tag yet.")
+            continue
+        limit_lines(figure, equipment.get_rules(), [column for column, _ in traces], options['equipment_tag'])
+        figure.update_layout(yaxis_title=units, height=380, margin=dict(t=20, b=40),
+                             legend=dict(orientation="h", y=-0.2))
+        st.plotly_chart(figure, use_container_width=True)
+        if shown < total:
+            st.caption(f"Showing {shown:,} of {total:,} readings")
+
+def main():
+    st.title("📈 Trend Dashboard")
+
+    options = dashboard_options()
+    if options is None:
+        st.info("No inspections have been stored yet.")
+        return
+
+    trend_charts(options)
+
+main()
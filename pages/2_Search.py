@@ -0,0 +1,80 @@
+import time
+
+import streamlit as st
+from storage import central_db_path, shared_store
+from search import SearchIndex
+
+# The index lives in the store's database and is topped up with the
+# inspections stored since the last search before each query.
+
+st.set_page_config(
+    page_title="Vibro-Sens Inspection Search",
+    page_icon="🔎",
+    layout="wide"
+)
+
+DB_PATH = central_db_path()
+
+def get_store():
+    """Central inspection store, shared with the inspection form and every session"""
+    return shared_store(DB_PATH)
+
+@st.cache_resource
+def get_search_index():
+    """Full-text index of the store, shared by every session"""
+    return SearchIndex(DB_PATH)
+
+def search_options():
+    """Search words, equipment tag and date range"""
+    col1, col2, col3 = st.columns([3, 2, 2])
+    with col1:
+        text = st.text_input("Search comments and findings",
+                             placeholder='e.g. milky oil, "hose chafing", leak',
+                             help='Words match by prefix ("chaf" finds "chafing"); '
+                                  'use quotes for an exact phrase')
+    with col2:
+        equipment_tag = st.selectbox("Equipment Tag #", ["All"] + get_store().equipment_tags())
+    with col3:
+        date_range = st.date_input("Date Range", value=(),
+                                   help="Leave empty to search the whole history")
+    start, end = (date_range + (None, None))[:2] if date_range else (None, None)
+    return {
+        'text': text,
+        'equipment_tag': None if equipment_tag == "All" else equipment_tag,
+        'start_date': start,
+        'end_date': end,
+    }
+
+def show_hit(hit):
+    """One matching inspection"""
+    st.markdown(f"**{hit.inspection_date}** · {hit.equipment_tag} · {hit.inspection_type}"
+                f" · WO {hit.wo_number or '–'} · {hit.technician_name}")
+    if hit.findings:
+        st.markdown(f"⚠️ {hit.findings}")
+    if hit.comments:
+        st.markdown(f"💬 {hit.comments}")
+    st.divider()
+
+def main():
+    st.title("🔎 Inspection Search")
+
+    index = get_search_index()
+    with st.spinner("Indexing new inspections..."):
+        index.refresh()
+
+    options = search_options()
+    if not options['text'].strip():
+        st.info("Search the comments and the items reported Not OK of every stored inspection.")
+        return
+
+    started = time.perf_counter()
+    hits = index.search(options['text'], options['equipment_tag'],
+                        options['start_date'], options['end_date'])
+    elapsed = (time.perf_counter() - started) * 1000
+    st.caption(f"{len(hits)} best matches in {elapsed:.0f} ms")
+    if not hits:
+        st.info("No inspection matches this search.")
+    for hit in hits:
+        show_hit(hit)
+
+main()
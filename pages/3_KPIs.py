@@ -0,0 +1,103 @@
+import time
+
+import pandas as pd
+import streamlit as st
+from checklist import ChecklistError
+from equipment import equipment_types, get_equipment
+from kpis import OVERDUE_DAYS, KpiAggregates
+from storage import central_db_path, shared_store
+
+# The page reads only the KPI aggregate tables, which are brought up to
+# date with the change events logged since the last visit before rendering.
+
+st.set_page_config(
+    page_title="Vibro-Sens KPIs",
+    page_icon="📊",
+    layout="wide"
+)
+
+DB_PATH = central_db_path()
+
+@st.cache_resource
+def get_aggregates():
+    """KPI aggregates of the store, shared by every session"""
+    shared_store(DB_PATH)  # the change log is created with the store
+    return KpiAggregates(DB_PATH)
+
+def kpi_options():
+    """Period and overdue threshold"""
+    col1, col2 = st.columns(2)
+    with col1:
+        weeks = st.selectbox("Period", [4, 12, 26, 52], index=1,
+                             format_func=lambda n: f"Last {n} weeks")
+    with col2:
+        overdue_days = st.number_input("Overdue after (days)", min_value=1,
+                                       value=OVERDUE_DAYS, step=1)
+    return weeks, int(overdue_days)
+
+def section_titles(equipment):
+    """{section key: title} of an equipment type's checklist"""
+    try:
+        return {section.key: section.title for section in get_equipment(equipment).get_checklist().sections}
+    except ChecklistError:  # type no longer registered
+        return {}
+
+def section_table(aggregates, weeks):
+    """% Not OK per equipment type and checklist section over the period"""
+    equipment_titles = dict(equipment_types())
+    titles = {}
+    rows = []
+    for equipment, key, not_ok, checked in aggregates.section_not_ok(weeks):
+        if not checked:
+            continue
+        if equipment not in titles:
+            titles[equipment] = section_titles(equipment)
+        rows.append((equipment_titles.get(equipment, equipment),
+                     titles[equipment].get(key, key.replace('_', ' ').title()),
+                     not_ok, checked, 100.0 * not_ok / checked))
+    return pd.DataFrame(rows, columns=["Equipment", "Section", "Not OK", "Items checked", "% Not OK"]) \
+        .sort_values("% Not OK", ascending=False)
+
+def main():
+    st.title("📊 Inspection KPIs")
+
+    aggregates = get_aggregates()
+    started = time.perf_counter()
+    aggregates.refresh()
+    weeks, overdue_days = kpi_options()
+
+    sections = section_table(aggregates, weeks)
+    groups = pd.DataFrame(aggregates.group_weeks(weeks), columns=["Group", "Week", "Inspections"])
+    overdue = pd.DataFrame(aggregates.overdue_assets(overdue_days),
+                           columns=["Equipment Tag #", "Last Inspection", "Days Since"])
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Inspections", int(groups["Inspections"].sum()))
+    col2.metric("Items Not OK", f"{sections['% Not OK'].mean():.1f} %" if len(sections) else "–",
+                help="Average over the sections of the share of status items reported Not OK")
+    col3.metric("Overdue Assets", f"{len(overdue)} / {aggregates.asset_count()}")
+
+    st.subheader("Not OK by Section")
+    if sections.empty:
+        st.info("No inspections in this period.")
+    else:
+        chart = sections.set_index(sections["Equipment"] + " – " + sections["Section"])
+        st.bar_chart(chart["% Not OK"], horizontal=True)
+        st.dataframe(sections, hide_index=True, width='stretch',
+                     column_config={"% Not OK": st.column_config.NumberColumn(format="%.1f %%")})
+
+    st.subheader("Inspections per Group per Week")
+    if groups.empty:
+        st.info("No inspections in this period.")
+    else:
+        st.bar_chart(groups.pivot(index="Week", columns="Group", values="Inspections").fillna(0))
+
+    st.subheader(f"Assets Not Inspected for {overdue_days} Days")
+    if overdue.empty:
+        st.success("Every asset has been inspected recently.")
+    else:
+        st.dataframe(overdue, hide_index=True, width='stretch')
+
+    st.caption(f"Loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+main()
@@ -0,0 +1,507 @@
+"""PDF rendering of inspection reports, without going through Word.
+
+Reports follow the same section layout as the Word report (see report.py)
+and are written straight to PDF: the standard Helvetica, ZapfDingbats and
+Symbol fonts are declared once per file and shared by every page, label cells and
+column widths of each checklist are laid out once per process, and pages
+are streamed to the output as soon as they are complete.  A month of
+inspections can be concatenated into one archive PDF, with a bookmark per
+inspection:
+
+    python pdf_report.py --db inspections.db --month 2025-06 -o archive_2025-06.pdf
+    python pdf_report.py inspections.jsonl -o archive.pdf
+"""
+import argparse
+import calendar
+import io
+import time
+import zlib
+
+import metrics
+from checklist import get_checklist
+from equipment import checklist_for
+from records import read_jsonl
+from report import _format_value, _value_column
+
+PDF_MIME = "application/pdf"
+
+# Bump whenever the PDF layout changes, so cached PDFs are re-rendered
+PDF_TEMPLATE_VERSION = 3
+
+PAGE_WIDTH, PAGE_HEIGHT = 595.28, 841.89  # A4 in points
+MARGIN = 42
+CONTENT_WIDTH = PAGE_WIDTH - 2 * MARGIN
+
+FONT_SIZE = 9
+LEADING = 11
+CELL_PADDING = 3
+
+# Resource name -> base font.  Standard fonts need no embedded font program.
+FONTS = {
+    'F1': 'Helvetica',
+    'F2': 'Helvetica-Bold',
+    'F3': 'ZapfDingbats',
+    'F4': 'Symbol',
+}
+REGULAR, BOLD, DINGBATS, SYMBOL = 'F1', 'F2', 'F3', 'F4'
+
+# Glyph widths (1/1000 em) of printable ASCII, from the Adobe font metrics
+_HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+_WIDTHS = {REGULAR: _HELVETICA_WIDTHS, BOLD: _HELVETICA_BOLD_WIDTHS}
+
+# Characters outside WinAnsiEncoding drawn from the symbol fonts:
+# character -> (font, code, width)
+_SYMBOL_GLYPHS = {
+    '✓': (DINGBATS, '3', 755),
+    '✗': (DINGBATS, '7', 768),
+    'Δ': (SYMBOL, 'D', 612),
+}
+
+
+def template_version(checklist=None):
+    """Version of the rendered layout: PDF layout plus checklist schema"""
+    checklist = checklist or get_checklist()
+    return f"pdf{PDF_TEMPLATE_VERSION}/{checklist.name}/{checklist.version}"
+
+
+def text_width(text, font=REGULAR, size=FONT_SIZE):
+    widths = _WIDTHS[font]
+    total = 0
+    for char in text:
+        code = ord(char)
+        if 32 <= code < 127:
+            total += widths[code - 32]
+        elif char in _SYMBOL_GLYPHS:
+            total += _SYMBOL_GLYPHS[char][2]
+        else:
+            total += 556
+    return total * size / 1000
+
+
+def wrap_text(text, width, font=REGULAR, size=FONT_SIZE):
+    """Split text into lines no wider than width, breaking at spaces
+    (and inside words longer than a line)"""
+    lines = []
+    for paragraph in str(text).split('\n'):
+        line = ''
+        for word in paragraph.split(' '):
+            candidate = f"{line} {word}" if line else word
+            if text_width(candidate, font, size) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            while text_width(word, font, size) > width and len(word) > 1:
+                cut = len(word) - 1
+                while cut > 1 and text_width(word[:cut], font, size) > width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+def _pdf_string(text):
+    """PDF literal string in WinAnsiEncoding (unknown characters become '?')"""
+    out = []
+    for byte in str(text).encode('cp1252', errors='replace'):
+        if byte in (0x28, 0x29, 0x5C):  # ( ) \
+            out.append('\\' + chr(byte))
+        elif 32 <= byte < 127:
+            out.append(chr(byte))
+        else:
+            out.append(f"\\{byte:03o}")
+    return f"({''.join(out)})"
+
+
+class PdfWriter:
+    """Minimal PDF 1.4 writer streaming objects to a binary stream.
+
+    Only object offsets are kept in memory, so documents of any number of
+    pages are written with constant memory.  The page tree, bookmarks and
+    cross-reference table are written by close()."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._position = 0
+        self._offsets = [0]
+        self._page_ids = []
+        self._bookmarks = []
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._catalog_id = self._reserve()
+        self._pages_id = self._reserve()
+        self._font_ids = {}
+        for name, base_font in FONTS.items():
+            encoding = "" if base_font in ('ZapfDingbats', 'Symbol') else " /Encoding /WinAnsiEncoding"
+            self._font_ids[name] = self._add_object(
+                f"<< /Type /Font /Subtype /Type1 /BaseFont /{base_font}{encoding} >>")
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    def _write(self, data):
+        self.stream.write(data)
+        self._position += len(data)
+
+    def _reserve(self):
+        self._offsets.append(None)
+        return len(self._offsets) - 1
+
+    def _add_object(self, body, object_id=None):
+        if object_id is None:
+            object_id = self._reserve()
+        self._offsets[object_id] = self._position
+        if isinstance(body, str):
+            body = body.encode('latin-1')
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (object_id, body))
+        return object_id
+
+    def add_page(self, content):
+        """Add a page drawn by a content stream (bytes); returns its object id"""
+        data = zlib.compress(content)
+        content_id = self._add_object(
+            b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(data), data))
+        page_id = self._add_object(
+            f"<< /Type /Page /Parent {self._pages_id} 0 R "
+            f"/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] /Contents {content_id} 0 R >>")
+        self._page_ids.append(page_id)
+        return page_id
+
+    def add_bookmark(self, title, page_id):
+        self._bookmarks.append((title, page_id))
+
+    def close(self):
+        fonts = " ".join(f"/{name} {object_id} 0 R" for name, object_id in self._font_ids.items())
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        # Fonts are inherited by every page from the root of the page tree
+        self._add_object(
+            f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} "
+            f"/Resources << /Font << {fonts} >> >> >>", self._pages_id)
+
+        outlines = ""
+        if self._bookmarks:
+            outline_id = self._reserve()
+            item_ids = [self._reserve() for _ in self._bookmarks]
+            for index, (title, page_id) in enumerate(self._bookmarks):
+                links = ""
+                if index:
+                    links += f" /Prev {item_ids[index - 1]} 0 R"
+                if index + 1 < len(item_ids):
+                    links += f" /Next {item_ids[index + 1]} 0 R"
+                self._add_object(
+                    f"<< /Title {_pdf_string(title)} /Parent {outline_id} 0 R{links} "
+                    f"/Dest [{page_id} 0 R /XYZ null null null] >>", item_ids[index])
+            self._add_object(
+                f"<< /Type /Outlines /First {item_ids[0]} 0 R /Last {item_ids[-1]} 0 R "
+                f"/Count {len(item_ids)} >>", outline_id)
+            outlines = f" /Outlines {outline_id} 0 R /PageMode /UseOutlines"
+        self._add_object(f"<< /Type /Catalog /Pages {self._pages_id} 0 R{outlines} >>",
+                         self._catalog_id)
+
+        xref_position = self._position
+        lines = [f"xref\n0 {len(self._offsets)}\n", "0000000000 65535 f \n"]
+        lines.extend(f"{offset:010d} 00000 n \n" for offset in self._offsets[1:])
+        lines.append(f"trailer\n<< /Size {len(self._offsets)} /Root {self._catalog_id} 0 R >>\n"
+                     f"startxref\n{xref_position}\n%%EOF\n")
+        self._write("".join(lines).encode('ascii'))
+
+
+class _Canvas:
+    """Drawing operators of one page"""
+
+    def __init__(self):
+        self.operators = []
+
+    def text(self, x, y, text, font=REGULAR, size=FONT_SIZE):
+        operators = self.operators
+        run = ''
+        for char in text:
+            if char in _SYMBOL_GLYPHS:
+                if run:
+                    operators.append(f"BT /{font} {size} Tf {x:.2f} {y:.2f} Td {_pdf_string(run)} Tj ET")
+                    x += text_width(run, font, size)
+                    run = ''
+                symbol_font, code, width = _SYMBOL_GLYPHS[char]
+                operators.append(f"BT /{symbol_font} {size} Tf {x:.2f} {y:.2f} Td ({code}) Tj ET")
+                x += width * size / 1000
+            else:
+                run += char
+        if run:
+            operators.append(f"BT /{font} {size} Tf {x:.2f} {y:.2f} Td {_pdf_string(run)} Tj ET")
+
+    def centred_text(self, y, text, font=REGULAR, size=FONT_SIZE):
+        self.text((PAGE_WIDTH - text_width(text, font, size)) / 2, y, text, font, size)
+
+    def rectangle(self, x, y, width, height):
+        self.operators.append(f"{x:.2f} {y:.2f} {width:.2f} {height:.2f} re S")
+
+    def line(self, x1, y1, x2, y2):
+        self.operators.append(f"{x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S")
+
+    def content(self):
+        return ("0.5 w\n" + "\n".join(self.operators)).encode('latin-1')
+
+
+class _SectionLayout:
+    """Column widths and wrapped labels of one report section"""
+
+    def __init__(self, section):
+        self.section = section
+        if section.report_columns == 3:
+            self.widths = [0.44 * CONTENT_WIDTH, 0.28 * CONTENT_WIDTH, 0.28 * CONTENT_WIDTH]
+        else:
+            self.widths = [0.5 * CONTENT_WIDTH, 0.5 * CONTENT_WIDTH]
+        label_width = self.widths[0] - 2 * CELL_PADDING
+        self.rows = []
+        for field in section.report_fields:
+            font = REGULAR if field.type == 'text' else BOLD
+            self.rows.append((field, wrap_text(field.report_label, label_width, font), font,
+                              _value_column(section, field)))
+        self.intro = wrap_text(section.intro, CONTENT_WIDTH) if section.intro else []
+
+
+_layouts = {}
+
+
+def _section_layouts(checklist):
+    """Section layouts, built once per process and checklist"""
+    key = (checklist.name, checklist.version)
+    if key not in _layouts:
+        _layouts[key] = [_SectionLayout(section) for section in checklist.report_sections]
+    return _layouts[key]
+
+
+INFO_WIDTHS = [CONTENT_WIDTH * share for share in (0.19, 0.31, 0.19, 0.31)]
+
+
+class _ReportPages:
+    """Lays out one inspection report onto pages of a PdfWriter"""
+
+    def __init__(self, writer, header, footer):
+        self.writer = writer
+        self.header = header
+        self.footer = footer
+        self.first_page_id = None
+        self.page_number = 0
+        self.canvas = None
+        self.y = self.top = 0
+        # Lines of one table row that fit on an empty page
+        self.page_lines = int((PAGE_HEIGHT - 2 * MARGIN - 8 - 2 * CELL_PADDING) // LEADING)
+
+    def new_page(self):
+        self.finish_page()
+        self.page_number += 1
+        self.canvas = _Canvas()
+        self.canvas.centred_text(PAGE_HEIGHT - 28, self.header, size=8)
+        self.canvas.text(MARGIN, 22, f"{self.footer} - page {self.page_number}", size=7)
+        self.y = self.top = PAGE_HEIGHT - MARGIN - 8
+
+    def finish_page(self):
+        if self.canvas is not None:
+            page_id = self.writer.add_page(self.canvas.content())
+            if self.first_page_id is None:
+                self.first_page_id = page_id
+            self.canvas = None
+
+    def ensure(self, height):
+        if self.y - height < MARGIN:
+            self.new_page()
+
+    def heading(self, text, size=11, keep_with=0):
+        self.ensure(size + 8 + keep_with)
+        self.y -= size + 6
+        self.canvas.text(MARGIN, self.y, text, BOLD, size)
+        self.y -= 4
+
+    def paragraph(self, lines):
+        for line in lines:
+            self.ensure(LEADING)
+            self.y -= LEADING
+            self.canvas.text(MARGIN, self.y + 2, line)
+        self.y -= 3
+
+    def row(self, widths, cells):
+        """One table row; cells are (lines, font) in column order.  A row
+        taller than a page is split across pages, repeating its label cell."""
+        label = cells[0]
+        while True:
+            count = max(len(lines) for lines, _ in cells)
+            room = int((self.y - MARGIN - 2 * CELL_PADDING) // LEADING)
+            if count <= room:
+                self._draw_row(widths, cells, count)
+                return
+            fresh_page = self.y == self.top
+            if not fresh_page and (count <= self.page_lines or room < len(label[0])):
+                self.new_page()
+                continue
+            self._draw_row(widths, [(lines[:room], font) for lines, font in cells], room)
+            rest = [(lines[room:], font) for lines, font in cells]
+            if len(label[0]) < room:
+                rest[0] = label
+            cells = rest
+            self.new_page()
+
+    def _draw_row(self, widths, cells, count):
+        height = count * LEADING + 2 * CELL_PADDING
+        top = self.y
+        x = MARGIN
+        canvas = self.canvas
+        for width, (lines, font) in zip(widths, cells):
+            canvas.rectangle(x, top - height, width, height)
+            baseline = top - CELL_PADDING - FONT_SIZE
+            for line in lines:
+                if line:
+                    canvas.text(x + CELL_PADDING, baseline, line, font)
+                baseline -= LEADING
+            x += width
+        self.y = top - height
+
+
+def _value_lines(value, width, z=None):
+    if value is None or value == '':
+        return ['']
+    if isinstance(value, bool):
+        return ["✓" if value else "✗"]
+    return wrap_text(_format_value(value, z), width - 2 * CELL_PADDING)
+
+
+def draw_report(writer, inspection_info, inspection_data, checklist=None):
+    """Add the pages of one inspection report to a PdfWriter and return the
+    object id of its first page.  The layout is that of the checklist of the
+    inspection's equipment type."""
+    checklist = checklist or checklist_for(inspection_info)
+    footer = " - ".join(str(part) for part in (
+        inspection_info['inspection_date'].strftime("%d/%m/%Y"),
+        inspection_info.get('equipment_tag'),
+        inspection_info.get('wo_number')) if part)
+    pages = _ReportPages(writer, checklist.report_header, footer)
+    pages.new_page()
+    pages.canvas.centred_text(pages.y - 14, checklist.title, BOLD, 14)
+    pages.y -= 24
+
+    # Inspection details
+    pages.heading("Inspection Details", keep_with=LEADING + 2 * CELL_PADDING)
+    blank = ([''], REGULAR)
+    pages.row(INFO_WIDTHS, [
+        (["Check by:"], REGULAR),
+        (_value_lines(f"{inspection_info['technician_name']} / {inspection_info['group']}",
+                      INFO_WIDTHS[1]), REGULAR),
+        (["Date:"], REGULAR),
+        ([inspection_info['inspection_date'].strftime("%d/%m/%Y")], REGULAR),
+    ])
+    for label, key in checklist.report_details:
+        value = inspection_info.get(key) if key else None
+        pages.row(INFO_WIDTHS, [([label], REGULAR),
+                                (_value_lines(value, INFO_WIDTHS[1]), REGULAR), blank, blank])
+
+    scores = inspection_data.get('anomaly_scores', {})
+    for layout in _section_layouts(checklist):
+        section = layout.section
+        values = inspection_data.get(section.key, {})
+        first_row = len(layout.rows[0][1]) * LEADING + 2 * CELL_PADDING if layout.rows else 0
+        pages.heading(section.title, keep_with=first_row + (LEADING if layout.intro else 0))
+        if layout.intro:
+            pages.paragraph(layout.intro)
+        for field, label_lines, label_font, value_column in layout.rows:
+            cells = [(label_lines, label_font)] + [blank] * (len(layout.widths) - 1)
+            z = scores.get(f"{section.key}_{field.key}")
+            cells[value_column] = (_value_lines(values.get(field.key), layout.widths[value_column], z),
+                                   REGULAR)
+            pages.row(layout.widths, cells)
+        pages.y -= 4
+
+    pages.finish_page()
+    return pages.first_page_id
+
+
+def bookmark_title(inspection_info):
+    parts = [inspection_info['inspection_date'].isoformat(),
+             inspection_info.get('equipment_tag'), inspection_info.get('wo_number')]
+    return " ".join(str(part) for part in parts if part)
+
+
+@metrics.timed('report.pdf')
+def render_pdf_bytes(inspection_info, inspection_data):
+    """Render an inspection report to PDF bytes"""
+    buffer = io.BytesIO()
+    writer = PdfWriter(buffer)
+    draw_report(writer, inspection_info, inspection_data)
+    writer.close()
+    return buffer.getvalue()
+
+
+def render_archive(inspections, target):
+    """Concatenate the reports of a stream of (inspection_info, inspection_data)
+    pairs into one PDF (path or binary stream), one bookmark per inspection.
+    Returns (inspections, pages) written."""
+    stream = open(target, 'wb') if isinstance(target, str) else target
+    try:
+        writer = PdfWriter(stream)
+        count = 0
+        for inspection_info, inspection_data in inspections:
+            page_id = draw_report(writer, inspection_info, inspection_data)
+            writer.add_bookmark(bookmark_title(inspection_info), page_id)
+            count += 1
+        writer.close()
+    finally:
+        if stream is not target:
+            stream.close()
+    return count, writer.page_count
+
+
+def month_range(month):
+    """First and last day (ISO) of a YYYY-MM month"""
+    year, number = (int(part) for part in month.split('-'))
+    last_day = calendar.monthrange(year, number)[1]
+    return f"{year:04d}-{number:02d}-01", f"{year:04d}-{number:02d}-{last_day:02d}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render inspection reports into one PDF archive")
+    parser.add_argument('source', nargs='?',
+                        help="JSON lines file of inspection records ('-' for stdin)")
+    parser.add_argument('--db', help="render inspections from this inspection store instead")
+    parser.add_argument('--month', help="only inspections of this month, YYYY-MM (with --db)")
+    parser.add_argument('--tag', help="only inspections for this equipment tag (with --db)")
+    parser.add_argument('--type', help="only inspections of this type (with --db)")
+    parser.add_argument('--since', help="first inspection date, YYYY-MM-DD (with --db)")
+    parser.add_argument('--until', help="last inspection date, YYYY-MM-DD (with --db)")
+    parser.add_argument('-o', '--output', required=True, help="output PDF file")
+    args = parser.parse_args(argv)
+    if (args.source is None) == (args.db is None):
+        parser.error("give either a JSON lines source or --db")
+
+    if args.db:
+        from storage import InspectionStore
+        since, until = month_range(args.month) if args.month else (args.since, args.until)
+        inspections = InspectionStore(args.db).query(
+            equipment_tag=args.tag, inspection_type=args.type,
+            start_date=since, end_date=until)
+    else:
+        inspections = read_jsonl(args.source)
+
+    started = time.perf_counter()
+    count, page_count = render_archive(inspections, args.output)
+    elapsed = time.perf_counter() - started
+    print(f"Rendered {count} reports ({page_count} pages) to {args.output} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import json
+import sys
+from datetime import date, datetime
+
+
+def inspection_to_record(inspection_info, inspection_data):
+    """Convert an inspection into a JSON-serialisable record"""
+    info = dict(inspection_info)
+    if isinstance(info.get('inspection_date'), (date, datetime)):
+        info['inspection_date'] = info['inspection_date'].isoformat()
+    return {'info': info, 'data': inspection_data}
+
+
+def record_to_inspection(record):
+    """Convert a stored record back into (inspection_info, inspection_data)"""
+    info = dict(record['info'])
+    inspection_date = info.get('inspection_date')
+    if isinstance(inspection_date, str):
+        info['inspection_date'] = date.fromisoformat(inspection_date[:10])
+    return info, record.get('data', {})
+
+
+def read_jsonl(path):
+    """Stream inspections from a JSON lines file ('-' reads stdin)"""
+    stream = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield record_to_inspection(json.loads(line))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def write_jsonl(inspections, path):
+    """Write (inspection_info, inspection_data) pairs to a JSON lines file"""
+    with open(path, 'w', encoding='utf-8') as stream:
+        for inspection_info, inspection_data in inspections:
+            stream.write(json.dumps(inspection_to_record(inspection_info, inspection_data)))
+            stream.write('\n')
@@ -0,0 +1,337 @@
+"""Word report rendering for hydraulic power pack inspections.
+
+The layout comes from the inspection checklist (see checklist.py).  The
+static parts of the check sheet (styles, header, headings and table
+skeletons with their labels) are built once per process and every report is
+cloned from that template, so only the inspection values are written per
+report.  Run as a script to render a batch of stored inspections:
+
+    python report.py inspections.jsonl -o reports/ -j 4
+    python report.py --db inspections.db --since 2025-06-01 --until 2025-06-30
+"""
+import argparse
+import io
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from docx import Document
+from docx.shared import Pt, Inches
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+import metrics
+from checklist import get_checklist
+from equipment import checklist_for
+from records import read_jsonl
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Bump whenever the report layout changes, so cached reports are re-rendered
+TEMPLATE_VERSION = 4
+
+# Longest side of a photo in the report
+PHOTO_SIZE = Inches(3)
+
+# Reports rendered per task of a batch
+BATCH_CHUNK_SIZE = 8
+
+def _value_column(section, field):
+    """Table column holding a field's value in the report"""
+    if section.report_columns == 3 and field.type == 'number':
+        return 2
+    return 1
+
+
+def _build_template(checklist):
+    """Build the static skeleton of the check sheet with empty value cells"""
+    doc = Document()
+
+    # Set default font
+    style = doc.styles['Normal']
+    font = style.font
+    font.name = 'Arial'
+    font.size = Pt(9)
+
+    # Header with logo placeholder
+    header = doc.sections[0].header
+    header_para = header.paragraphs[0]
+    header_run = header_para.add_run()
+    # Logo placeholder - in real app, use: header_run.add_picture("logo.png", width=Inches(1.0))
+    header_run.add_text(checklist.report_header)
+    header_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    # Title
+    title = doc.add_heading(checklist.title, 0)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title.style.font.size = Pt(14)
+    title.style.font.bold = True
+
+    # Inspection Information
+    doc.add_heading('Inspection Details', level=1)
+    # Rows of the inspection details after the "Check by / Date" header row
+    info_table = doc.add_table(rows=1 + len(checklist.report_details), cols=4)
+    info_table.style = 'Table Grid'
+
+    # Set column widths
+    col_widths = [Inches(1.2), Inches(2.0), Inches(1.2), Inches(2.0)]
+    for i, width in enumerate(col_widths):
+        info_table.columns[i].width = width
+
+    hdr_row = info_table.rows[0].cells
+    hdr_row[0].text = "Check by:"
+    hdr_row[2].text = "Date:"
+    for row, (label, _) in zip(info_table.rows[1:], checklist.report_details):
+        row.cells[0].text = label
+
+    for section in checklist.report_sections:
+        doc.add_heading(section.title, level=1)
+        if section.intro:
+            doc.add_paragraph(section.intro)
+
+        fields = section.report_fields
+        table = doc.add_table(rows=len(fields), cols=section.report_columns)
+        table.style = 'Table Grid'
+
+        for row, field in zip(table.rows, fields):
+            label_cell = row.cells[0]
+            label_cell.text = field.report_label
+            if field.type != 'text':
+                label_cell.paragraphs[0].runs[0].font.bold = True
+
+    return doc
+
+
+_templates = {}
+
+
+def template_bytes(checklist=None):
+    """Serialised report template, built once per process and checklist"""
+    checklist = checklist or get_checklist()
+    key = (checklist.name, checklist.version)
+    if key not in _templates:
+        buffer = io.BytesIO()
+        _build_template(checklist).save(buffer)
+        _templates[key] = buffer.getvalue()
+    return _templates[key]
+
+
+def template_version(checklist=None):
+    """Version of the rendered layout: report layout plus checklist schema"""
+    checklist = checklist or get_checklist()
+    return f"docx{TEMPLATE_VERSION}/{checklist.name}/{checklist.version}"
+
+
+def _format_value(value, z=None):
+    """Report text of a value, with its anomaly score against the asset's
+    baseline when one was recorded"""
+    text = '' if value is None else str(value)
+    if z is not None:
+        from baselines import ANOMALY_Z, UNUSUAL_Z
+        flag = " anomaly" if abs(z) >= ANOMALY_Z else " unusual" if abs(z) >= UNUSUAL_Z else ""
+        text += f" (z {z:+.1f}{flag})"
+    return text
+
+
+def _add_photos(doc, inspection_data, checklist, attachment_store=None):
+    """Photos section: the report-size variant of every attached photo,
+    grouped by checklist item"""
+    from attachments import AttachmentStore, photos_of
+
+    photos = photos_of(inspection_data)
+    if not any(photos.values()):
+        return
+    store = attachment_store or AttachmentStore()
+    doc.add_heading("Photos", level=1)
+    labels = {column: f"{section.title} – {field.report_label}"
+              for column, section, field in checklist.columns()}
+    ordered = [column for column in labels if photos.get(column)]
+    ordered += [column for column in photos if column not in labels and photos[column]]
+    for column in ordered:
+        doc.add_paragraph(labels.get(column, column)).runs[0].bold = True
+        paragraph = doc.add_paragraph()
+        for photo in photos[column]:
+            image = store.read(photo.id, 'report')
+            if image is None:
+                paragraph.add_run(f"[{photo.name or photo.id[:12]} not available] ")
+                continue
+            if photo.height > photo.width:
+                paragraph.add_run().add_picture(io.BytesIO(image), height=PHOTO_SIZE)
+            else:
+                paragraph.add_run().add_picture(io.BytesIO(image), width=PHOTO_SIZE)
+            paragraph.add_run(" ")
+
+
+@metrics.timed('report.docx')
+def create_docx_report(inspection_info, inspection_data, checklist=None, attachment_store=None):
+    """Create a comprehensive Word document report aligned with provided templates,
+    laid out by the checklist of the inspection's equipment type"""
+    checklist = checklist or checklist_for(inspection_info)
+    doc = Document(io.BytesIO(template_bytes(checklist)))
+    tables = doc.tables
+
+    # Inspection details
+    info_rows = tables[0].rows
+    hdr_row = info_rows[0].cells
+    hdr_row[1].text = f"{inspection_info['technician_name']} / {inspection_info['group']}"
+    hdr_row[3].text = inspection_info['inspection_date'].strftime("%d/%m/%Y")
+    for row, (_, key) in zip(info_rows[1:], checklist.report_details):
+        if key is None:
+            continue
+        value = inspection_info.get(key)
+        if isinstance(value, bool):
+            value = "✓" if value else "✗"
+        row.cells[1].text = '' if value is None else str(value)
+
+    scores = inspection_data.get('anomaly_scores', {})
+    for table, section in zip(tables[1:], checklist.report_sections):
+        values = inspection_data.get(section.key, {})
+        for row, field in zip(table.rows, section.report_fields):
+            value = values.get(field.key)
+            if value is not None and value != '':
+                z = scores.get(f"{section.key}_{field.key}")
+                row.cells[_value_column(section, field)].text = _format_value(value, z)
+
+    _add_photos(doc, inspection_data, checklist, attachment_store)
+    return doc
+
+
+def render_docx_bytes(inspection_info, inspection_data):
+    """Render an inspection report to DOCX bytes"""
+    doc_bytes = io.BytesIO()
+    create_docx_report(inspection_info, inspection_data).save(doc_bytes)
+    return doc_bytes.getvalue()
+
+
+def report_filename(inspection_info):
+    """Stable file name for an inspection report"""
+    parts = [
+        inspection_info['inspection_date'].strftime("%Y%m%d"),
+        inspection_info.get('equipment_tag', ''),
+        inspection_info.get('wo_number', ''),
+    ]
+    stem = "_".join(re.sub(r'[^A-Za-z0-9-]+', '', part) for part in parts if part)
+    return f"inspection_report_{stem}.docx"
+
+
+_artifact_cache = None
+
+
+def _init_worker(cache_dir=None):
+    """Open the shared artifact cache of a worker.  Templates are built the
+    first time a worker renders a report of their checklist."""
+    global _artifact_cache
+    if cache_dir:
+        from artifact_cache import ArtifactCache
+        # Disk tier only: batch workers rarely see the same inspection twice
+        _artifact_cache = ArtifactCache(max_bytes=0, directory=cache_dir)
+
+
+def _render_to_file(job):
+    inspection_info, inspection_data, path = job
+    if _artifact_cache is not None:
+        version = template_version(checklist_for(inspection_info))
+        doc_bytes = _artifact_cache.get_or_render('docx', version, inspection_info,
+                                                  inspection_data, render_docx_bytes)
+    else:
+        doc_bytes = render_docx_bytes(inspection_info, inspection_data)
+    with open(path, 'wb') as stream:
+        stream.write(doc_bytes)
+    return path
+
+
+def _render_chunk(jobs):
+    return [_render_to_file(job) for job in jobs]
+
+
+def render_batch(inspections, output_dir, workers=None, chunksize=BATCH_CHUNK_SIZE, cache_dir=None):
+    """Render a stream of (inspection_info, inspection_data) pairs to DOCX files
+    in output_dir using a process pool, yielding the path of each report as
+    its task finishes.
+
+    Inspections are sent to the workers in tasks of chunksize, with at most
+    one task per worker in flight, so no more than workers * chunksize
+    inspections are read ahead of the reports written.  With cache_dir,
+    reports already rendered into that artifact cache (by the app or a
+    previous run) are copied from it instead of being re-rendered."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    def jobs():
+        seen = {}
+        for inspection_info, inspection_data in inspections:
+            name = report_filename(inspection_info)
+            count = seen.get(name, 0)
+            seen[name] = count + 1
+            if count:
+                name = f"{name[:-5]}_{count}.docx"
+            yield inspection_info, inspection_data, os.path.join(output_dir, name)
+
+    if workers == 1:
+        _init_worker(cache_dir)
+        for job in jobs():
+            yield _render_to_file(job)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    queued = jobs()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_dir,)) as executor:
+        pending = set()
+        try:
+            while True:
+                if len(pending) == workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+                # Read the next task only once a worker is free for it
+                task = list(islice(queued, chunksize))
+                if not task:
+                    break
+                pending.add(executor.submit(_render_chunk, task))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        finally:
+            # Stopped early: drop the tasks not started yet
+            for future in pending:
+                future.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render inspection reports in batch")
+    parser.add_argument('source', nargs='?',
+                        help="JSON lines file of inspection records ('-' for stdin)")
+    parser.add_argument('--db', help="render inspections from this inspection store instead")
+    parser.add_argument('--tag', help="only inspections for this equipment tag (with --db)")
+    parser.add_argument('--type', help="only inspections of this type (with --db)")
+    parser.add_argument('--since', help="first inspection date, YYYY-MM-DD (with --db)")
+    parser.add_argument('--until', help="last inspection date, YYYY-MM-DD (with --db)")
+    parser.add_argument('-o', '--output-dir', default='reports', help="directory for the DOCX files")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument('--cache-dir', default=os.environ.get('VIBROSENS_ARTIFACT_DIR'),
+                        help="artifact cache directory shared with the app "
+                             "(default: $VIBROSENS_ARTIFACT_DIR)")
+    args = parser.parse_args(argv)
+    if (args.source is None) == (args.db is None):
+        parser.error("give either a JSON lines source or --db")
+
+    if args.db:
+        from storage import InspectionStore
+        inspections = InspectionStore(args.db).query(
+            equipment_tag=args.tag, inspection_type=args.type,
+            start_date=args.since, end_date=args.until)
+    else:
+        inspections = read_jsonl(args.source)
+
+    started = time.perf_counter()
+    rendered = sum(1 for _ in render_batch(inspections, args.output_dir, workers=args.workers,
+                                           cache_dir=args.cache_dir))
+    elapsed = time.perf_counter() - started
+    print(f"Rendered {rendered} reports to {args.output_dir} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Route inspections: one technician's round over several power packs.
+
+A route is a list of equipment tags (each optionally with its work order
+number) inspected on the same day by the same technician.  Everything the
+form needs about the assets is loaded when the route is set up, instead of
+once per asset and per rerun:
+
+* the first and latest inspection of every asset, in one store query (the
+  latest readings pre-fill the form and are shown for comparison, and both
+  feed the rate-of-change and delta-vs-baseline rules),
+* the revision of every work order on the route, in one query,
+* the effective limit rules of every asset.
+
+The filled-in route is queued as one batch and stored in one transaction.
+"""
+from dataclasses import dataclass
+
+from checklist import get_checklist
+
+
+@dataclass
+class RouteStop:
+    """One asset of a route, with what was prefetched for it"""
+    equipment_tag: str
+    wo_number: str = ''
+    first: tuple = None
+    latest: tuple = None
+    work_order_version: int = 0
+
+    @property
+    def last_inspection_date(self):
+        return self.latest[0]['inspection_date'] if self.latest else None
+
+    def last_value(self, section_key, field_key):
+        if self.latest is None:
+            return None
+        return self.latest[1].get(section_key, {}).get(field_key)
+
+    def previous_reading(self, section_key, field_key, inspection_date):
+        """(previous value, days since it, baseline value) of one reading"""
+        if self.latest is None:
+            return None, None, None
+        days = (inspection_date - self.last_inspection_date).days
+        return (self.last_value(section_key, field_key), days,
+                self.first[1].get(section_key, {}).get(field_key))
+
+    def prefill(self, checklist=None):
+        """{section: {field: value}} of the latest inspection that can be
+        used as form defaults: statuses, choices and readings, not comments"""
+        checklist = checklist or get_checklist()
+        values = {}
+        for section in checklist.form_sections:
+            for field in section.form_fields:
+                value = self.last_value(section.key, field.key)
+                if field.options:
+                    if value not in field.options:
+                        continue
+                elif field.type == 'number':
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    if ((field.min is not None and value < field.min)
+                            or (field.max is not None and value > field.max)):
+                        continue
+                    value = float(value)
+                else:
+                    continue
+                values.setdefault(section.key, {})[field.key] = value
+        return values
+
+
+def parse_route(text):
+    """[(equipment_tag, wo_number)] from one "tag" or "tag, WO#" per line,
+    in order and without repeated tags"""
+    stops = {}
+    for line in text.splitlines():
+        equipment_tag, _, wo_number = line.partition(',')
+        equipment_tag = equipment_tag.strip()
+        if equipment_tag and equipment_tag not in stops:
+            stops[equipment_tag] = wo_number.strip()
+    return list(stops.items())
+
+
+def load_route(store, rules, stops, inspection_date):
+    """RouteStops of [(equipment_tag, wo_number)], with the history, work
+    order revisions and limit rules of every asset fetched in bulk"""
+    snapshots = store.asset_snapshots([tag for tag, _ in stops], before=inspection_date)
+    work_orders = store.work_orders([wo_number for _, wo_number in stops])
+    route = []
+    for equipment_tag, wo_number in stops:
+        # Per-asset rules are resolved here once instead of on the first reading
+        rules.rules_for(equipment_tag)
+        first, latest = snapshots.get(equipment_tag) or (None, None)
+        work_order = work_orders.get(wo_number)
+        route.append(RouteStop(equipment_tag=equipment_tag, wo_number=wo_number,
+                               first=first, latest=latest,
+                               work_order_version=work_order.version if work_order else 0))
+    return route
+
+
+def stop_info(route_info, stop):
+    """inspection_info of one stop of a route"""
+    return {
+        'technician_name': route_info['technician_name'],
+        'group': route_info['group'],
+        'inspection_date': route_info['inspection_date'],
+        'equipment_tag': stop.equipment_tag,
+        'wo_number': stop.wo_number,
+        'inspection_type': route_info['inspection_type'],
+        'equipment_type': route_info.get('equipment_type'),
+        'visual_check': True,
+        'vibration_check': False,
+    }
@@ -0,0 +1,425 @@
+"""Limit evaluation engine shared by the live form and fleet-wide checks.
+
+Rules are compiled from the checklist limits (the alarm bands) and from the
+limits file checklists/<name>.limits.json, which adds alert bands,
+rate-of-change and delta-vs-baseline rules per reading column and lets
+individual assets override any of them:
+
+    {
+      "defaults": {
+        "hydraulic_pump_vibration": {
+          "alert": {"high": 4.5, "message": "..."},
+          "rate": {"max_per_day": 0.1, "direction": "rise", "message": "..."},
+          "baseline": {"max_delta": 2.5, "message": "..."}
+        }
+      },
+      "assets": {
+        "31 - TM - 05": {"hydraulic_pump_vibration": {"alert": {"high": 3.5, "message": "..."}}}
+      }
+    }
+
+Setting a rule to null for an asset disables it for that asset.  Baselines
+are the asset's first recorded reading unless a "value" is configured.
+
+The same compiled RuleSet checks one reading on the form (check()) or whole
+columns of history at once (evaluate()), e.g. for every asset, each with
+the rules of its equipment type:
+
+    python rules.py --history history/ -o exceedances.csv
+"""
+import argparse
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+from checklist import CHECKLIST_DIR, DEFAULT_CHECKLIST, ChecklistError, get_checklist
+
+SEVERITIES = ('alert', 'alarm')
+RULE_KINDS = ('alert', 'alarm', 'rate', 'baseline')
+DIRECTIONS = ('rise', 'fall', 'both')
+
+RULE_SETTINGS = {
+    'alert': {'low', 'high', 'high_exclusive', 'message'},
+    'alarm': {'low', 'high', 'high_exclusive', 'message'},
+    'rate': {'max_per_day', 'direction', 'message'},
+    'baseline': {'max_delta', 'value', 'message'},
+}
+
+EXCEEDANCE_COLUMNS = ['equipment_tag', 'inspection_date', 'column', 'rule', 'severity',
+                      'value', 'limit', 'message']
+
+
+@dataclass(frozen=True)
+class Rule:
+    column: str
+    kind: str
+    message: str
+    low: float = None
+    high: float = None
+    high_exclusive: bool = False
+    max_per_day: float = None
+    direction: str = 'both'
+    max_delta: float = None
+    value: float = None
+
+    @property
+    def severity(self):
+        # Trend rules are early warnings; only the alarm band is an alarm
+        return 'alarm' if self.kind == 'alarm' else 'alert'
+
+    def check(self, value, previous=None, days=None, baseline=None):
+        """Return the message if value breaks the rule.
+
+        previous and days (since the previous reading) are needed for rate
+        rules, baseline for baseline rules without a configured value."""
+        if value is None or value == '':
+            return None
+        value = float(value)
+
+        if self.kind in SEVERITIES:
+            if self.low is not None and value < self.low:
+                return self.message
+            if self.high is not None and (value >= self.high if self.high_exclusive
+                                          else value > self.high):
+                return self.message
+            return None
+
+        if self.kind == 'rate':
+            if previous is None or previous == '':
+                return None
+            rate = (value - float(previous)) / max(days or 1, 1)
+            return self.message if _rate_exceeded(rate, self.max_per_day, self.direction) else None
+
+        baseline = self.value if self.value is not None else baseline
+        if baseline is None or baseline == '':
+            return None
+        return self.message if abs(value - float(baseline)) > self.max_delta else None
+
+
+def _rate_exceeded(rate, max_per_day, direction):
+    if direction == 'rise':
+        return rate > max_per_day
+    if direction == 'fall':
+        return -rate > max_per_day
+    return abs(rate) > max_per_day
+
+
+def _compile_rule(column, kind, spec, where):
+    unknown = set(spec) - RULE_SETTINGS[kind]
+    if unknown:
+        raise ChecklistError(f"{where}: unknown {kind} settings {sorted(unknown)}")
+    if 'message' not in spec:
+        raise ChecklistError(f"{where}: missing 'message'")
+    if kind in SEVERITIES and spec.get('low') is None and spec.get('high') is None:
+        raise ChecklistError(f"{where}: {kind} bands need 'low' and/or 'high'")
+    if kind == 'rate':
+        if spec.get('max_per_day') is None:
+            raise ChecklistError(f"{where}: rate rules need 'max_per_day'")
+        if spec.get('direction', 'both') not in DIRECTIONS:
+            raise ChecklistError(f"{where}: direction must be one of {DIRECTIONS}")
+    if kind == 'baseline' and spec.get('max_delta') is None:
+        raise ChecklistError(f"{where}: baseline rules need 'max_delta'")
+    return Rule(column=column, kind=kind, **spec)
+
+
+def _compile_column_rules(spec, columns, where):
+    rules = {}
+    for column, kinds in spec.items():
+        if column not in columns:
+            raise ChecklistError(f"{where}: unknown reading column '{column}'")
+        if columns[column].type != 'number':
+            raise ChecklistError(f"{where}.{column}: only number fields can have rules")
+        for kind, rule_spec in kinds.items():
+            if kind not in RULE_KINDS:
+                raise ChecklistError(f"{where}.{column}: unknown rule '{kind}'")
+            rules[column, kind] = (None if rule_spec is None else
+                                   _compile_rule(column, kind, rule_spec, f"{where}.{column}.{kind}"))
+    return rules
+
+
+class RuleSet:
+    """Compiled limit rules of one checklist, with per-asset overrides"""
+
+    def __init__(self, defaults, assets=None):
+        self.defaults = {key: rule for key, rule in defaults.items() if rule is not None}
+        self.assets = assets or {}
+        self._effective = {}
+
+    @property
+    def columns(self):
+        keys = set(self.defaults)
+        for overrides in self.assets.values():
+            keys.update(key for key, rule in overrides.items() if rule is not None)
+        return sorted({column for column, _ in keys})
+
+    def rule(self, column, kind, equipment_tag=None):
+        """Effective rule for an asset, or None"""
+        overrides = self.assets.get(equipment_tag, {})
+        if (column, kind) in overrides:
+            return overrides[column, kind]
+        return self.defaults.get((column, kind))
+
+    def rules_for(self, equipment_tag=None):
+        """Effective rules for an asset, grouped by column"""
+        if equipment_tag not in self._effective:
+            rules = {}
+            keys = set(self.defaults) | set(self.assets.get(equipment_tag, {}))
+            for column, kind in sorted(keys, key=lambda key: (key[0], RULE_KINDS.index(key[1]))):
+                rule = self.rule(column, kind, equipment_tag)
+                if rule is not None:
+                    rules.setdefault(column, []).append(rule)
+            self._effective[equipment_tag] = rules
+        return self._effective[equipment_tag]
+
+    def check(self, column, value, equipment_tag=None, previous=None, days=None, baseline=None):
+        """(severity, message) for every rule one reading breaks, alarms first"""
+        breaches = []
+        for rule in self.rules_for(equipment_tag).get(column, ()):
+            message = rule.check(value, previous, days, baseline)
+            if message:
+                breaches.append((rule.severity, message))
+        breaches.sort(key=lambda breach: breach[0] != 'alarm')
+        return breaches
+
+    def evaluate(self, frame):
+        """Flag every exceedance in a frame of readings in one vectorised pass.
+
+        frame needs equipment_tag and inspection_date columns plus one column
+        per reading (as returned by history_export.read_history).  Returns a
+        DataFrame with EXCEEDANCE_COLUMNS, one row per broken rule per reading."""
+        import numpy as np
+        import pandas as pd
+
+        codes, tags = pd.factorize(frame['equipment_tag'], sort=True)
+        days = frame['inspection_date'].to_numpy('datetime64[D]').astype(np.int64)
+        # Rate and baseline rules follow each asset's readings in date order
+        order = np.lexsort((days, codes))
+        sorted_codes = codes[order]
+        sorted_days = days[order]
+
+        found = []
+        for column in self.columns:
+            if column not in frame:
+                continue
+            values = frame[column].to_numpy(np.float64, na_value=np.nan)
+            for kind in RULE_KINDS:
+                table = self._threshold_table(column, kind, tags)
+                if table is None:
+                    continue
+                if kind in SEVERITIES:
+                    rows, limit = _band_exceedances(values, codes, table)
+                else:
+                    evaluate_sorted = _rate_exceedances if kind == 'rate' else _baseline_exceedances
+                    rows, limit = evaluate_sorted(values[order], sorted_codes, sorted_days, table)
+                    rows = order[rows]
+                if len(rows):
+                    found.append((column, kind, rows, limit, table['message']))
+
+        return _exceedance_frame(frame, codes, days, tags, found)
+
+    def _threshold_table(self, column, kind, tags):
+        """Per-asset parameter arrays of one rule, indexed by tag code"""
+        import numpy as np
+
+        rules = [self.rule(column, kind, tag) for tag in tags]
+        if all(rule is None for rule in rules):
+            return None
+
+        def array(name, missing):
+            return np.array([missing if rule is None or getattr(rule, name) is None
+                             else getattr(rule, name) for rule in rules], dtype=np.float64)
+
+        table = {
+            'enabled': np.array([rule is not None for rule in rules]),
+            'message': np.array([rule.message if rule else '' for rule in rules], dtype=object),
+        }
+        if kind in SEVERITIES:
+            table['low'] = array('low', -np.inf)
+            table['high'] = array('high', np.inf)
+            table['high_exclusive'] = np.array([bool(rule and rule.high_exclusive) for rule in rules])
+        elif kind == 'rate':
+            table['max_per_day'] = array('max_per_day', np.inf)
+            directions = [rule.direction if rule else 'both' for rule in rules]
+            table['rise'] = np.array([direction != 'fall' for direction in directions])
+            table['fall'] = np.array([direction != 'rise' for direction in directions])
+        else:
+            table['max_delta'] = array('max_delta', np.inf)
+            table['value'] = array('value', np.nan)
+        return table
+
+
+def _band_exceedances(values, codes, table):
+    import numpy as np
+
+    low = table['low'][codes]
+    high = table['high'][codes]
+    above = np.where(table['high_exclusive'][codes], values >= high, values > high)
+    below = values < low
+    hit = (below | above) & table['enabled'][codes]
+    rows = np.flatnonzero(hit)
+    return rows, np.where(below[rows], low[rows], high[rows])
+
+
+def _rate_exceedances(values, codes, days, table):
+    import numpy as np
+
+    # Compare each reading with the asset's previous non-empty reading
+    valid = np.flatnonzero(~np.isnan(values))
+    values, codes, days = values[valid], codes[valid], days[valid]
+    same_asset = codes[1:] == codes[:-1]
+    rate = np.diff(values) / np.maximum(np.diff(days), 1)
+    later = codes[1:]
+    limit = table['max_per_day'][later]
+    hit = same_asset & table['enabled'][later] & (
+        (table['rise'][later] & (rate > limit)) | (table['fall'][later] & (-rate > limit)))
+    rows = np.flatnonzero(hit) + 1
+    return valid[rows], limit[rows - 1]
+
+
+def _baseline_exceedances(values, codes, days, table):
+    import numpy as np
+
+    valid = np.flatnonzero(~np.isnan(values))
+    values, codes = values[valid], codes[valid]
+    # Index of the first reading of each asset, carried forward over its rows
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    first = np.zeros(len(values), dtype=np.int64)
+    first[starts] = starts
+    first = np.maximum.accumulate(first)
+
+    configured = table['value'][codes]
+    baseline = np.where(np.isnan(configured), values[first], configured)
+    limit = table['max_delta'][codes]
+    hit = (np.abs(values - baseline) > limit) & table['enabled'][codes]
+    rows = np.flatnonzero(hit)
+    return valid[rows], baseline[rows] + np.copysign(limit[rows], values[rows] - baseline[rows])
+
+
+def _exceedance_frame(frame, codes, days, tags, found):
+    import numpy as np
+    import pandas as pd
+
+    if not found:
+        return pd.DataFrame(columns=EXCEEDANCE_COLUMNS)
+
+    # Assemble plain arrays and build the frame once; per-rule labels become
+    # categoricals so a large result costs little more than its numbers
+    messages = sorted({message for *_, table_messages in found for message in table_messages})
+    message_codes = {message: code for code, message in enumerate(messages)}
+    rows = np.concatenate([rule_rows for _, _, rule_rows, _, _ in found])
+    rule_codes = np.repeat(np.arange(len(found)), [len(rule_rows) for _, _, rule_rows, _, _ in found])
+    limits = np.concatenate([limit for _, _, _, limit, _ in found])
+    values = np.concatenate([frame[column].to_numpy(np.float64, na_value=np.nan)[rule_rows]
+                             for column, _, rule_rows, _, _ in found])
+    row_messages = np.concatenate([
+        np.array([message_codes[message] for message in table_messages])[codes[rule_rows]]
+        for _, _, rule_rows, _, table_messages in found])
+
+    row_codes = codes[rows]
+    # One int64 sort key (asset, date, row) sorts much faster than lexsort
+    span = int(days.max() - days.min()) + 1
+    order = np.argsort((row_codes * span + (days[rows] - days.min())) * len(frame) + rows)
+    rows, rule_codes = rows[order], rule_codes[order]
+    columns = [column for column, _, _, _, _ in found]
+    kinds = [kind for _, kind, _, _, _ in found]
+
+    def categorical(labels):
+        categories = sorted(set(labels))
+        lookup = np.array([categories.index(label) for label in labels])
+        return pd.Categorical.from_codes(lookup[rule_codes], categories)
+
+    return pd.DataFrame({
+        'equipment_tag': pd.Categorical.from_codes(row_codes[order], tags),
+        'inspection_date': frame['inspection_date'].to_numpy()[rows],
+        'column': categorical(columns),
+        'rule': categorical(kinds),
+        'severity': categorical(['alarm' if kind == 'alarm' else 'alert' for kind in kinds]),
+        'value': values[order],
+        'limit': limits[order],
+        'message': pd.Categorical.from_codes(row_messages[order], messages),
+    })
+
+
+def _checklist_alarms(checklist):
+    """Alarm bands from the limits declared in the checklist schema"""
+    return {(name, 'alarm'): Rule(column=name, kind='alarm', message=field.limits.message,
+                                  low=field.limits.low, high=field.limits.high,
+                                  high_exclusive=field.limits.high_exclusive)
+            for name, _, field in checklist.columns() if field.limits is not None}
+
+
+def compile_rules(spec, checklist):
+    """Validate a parsed limits file and compile it against its checklist"""
+    where = f"{checklist.name}.limits"
+    columns = {name: field for name, _, field in checklist.columns()}
+
+    defaults = _checklist_alarms(checklist)
+    defaults.update(_compile_column_rules(spec.get('defaults', {}), columns, f"{where}.defaults"))
+    assets = {tag: _compile_column_rules(overrides, columns, f"{where}.assets.{tag}")
+              for tag, overrides in spec.get('assets', {}).items()}
+    return RuleSet(defaults, assets)
+
+
+def load_rules(name=DEFAULT_CHECKLIST):
+    """Compile the checklist alarm limits together with checklists/<name>.limits.json"""
+    checklist = get_checklist(name)
+    path = os.path.join(CHECKLIST_DIR, f"{name}.limits.json")
+    spec = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as stream:
+            try:
+                spec = json.load(stream)
+            except json.JSONDecodeError as error:
+                raise ChecklistError(f"{path}: {error}") from error
+    return compile_rules(spec, checklist)
+
+
+@lru_cache(maxsize=None)
+def get_rules(name=DEFAULT_CHECKLIST):
+    """Compiled rules, loaded once per process"""
+    return load_rules(name)
+
+
+def main(argv=None):
+    from equipment import REGISTRY
+
+    parser = argparse.ArgumentParser(description="Flag limit exceedances across the inspection history")
+    parser.add_argument('--history', default='history', help="root of the Parquet history")
+    parser.add_argument('--tag', help="only this equipment tag")
+    parser.add_argument('--since', help="first inspection date (YYYY-MM-DD)")
+    parser.add_argument('--until', help="last inspection date (YYYY-MM-DD)")
+    parser.add_argument('--severity', choices=SEVERITIES, help="only alerts or only alarms")
+    parser.add_argument('--equipment-type', choices=list(REGISTRY), help="only this equipment type")
+    parser.add_argument('-o', '--output', help="write exceedances to this CSV file")
+    args = parser.parse_args(argv)
+
+    from datetime import date
+    import pandas as pd
+    from equipment import DEFAULT_EQUIPMENT, get_equipment
+    from history_export import read_history
+
+    keys = [args.equipment_type] if args.equipment_type else list(REGISTRY)
+    rule_sets = {key: get_equipment(key).get_rules() for key in keys}
+    columns = sorted({column for rules in rule_sets.values() for column in rules.columns})
+    frame = read_history(args.history, equipment_tag=args.tag, equipment_type=args.equipment_type,
+                         columns=['equipment_tag', 'inspection_date', 'equipment_type'] + columns,
+                         start_date=date.fromisoformat(args.since) if args.since else None,
+                         end_date=date.fromisoformat(args.until) if args.until else None)
+    # Each inspection is checked against the rules of its equipment type
+    types = frame['equipment_type'].astype(object).fillna(DEFAULT_EQUIPMENT)
+    exceedances = pd.concat([rules.evaluate(frame[types == key]) for key, rules in rule_sets.items()],
+                            ignore_index=True)
+    if args.severity:
+        exceedances = exceedances[exceedances['severity'] == args.severity]
+
+    if args.output:
+        exceedances.to_csv(args.output, index=False)
+    else:
+        print(exceedances.to_string(index=False))
+    print(f"{len(exceedances)} exceedances in {len(frame)} inspections "
+          f"({frame['equipment_tag'].nunique()} assets)")
+
+
+if __name__ == "__main__":
+    main()
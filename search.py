@@ -0,0 +1,282 @@
+"""Full-text search over inspection comments and findings.
+
+The free-text comments of every section and the items reported as findings
+(any status or choice other than the first option, e.g. "Hydraulic Pump –
+Pump Noise: Not OK") are indexed in an SQLite FTS5 table kept in the
+inspection store's own database file.  The index is maintained
+incrementally: it remembers the id of the last inspection it has indexed
+and only reads the inspections stored since, in short transactions, so it
+is brought up to date in milliseconds before a search.
+
+Searches are ranked with BM25 (findings weigh more than comments), can be
+limited to one equipment tag and a date range, and words match by stem and
+prefix ("leak" finds "leaking", "chaf" finds "chafing"); "quoted words"
+match as a phrase.  To keep every search well under 100 ms on a decade of
+inspections, only the MAX_CANDIDATES most recent matches are ranked (a
+word found in nearly every inspection would otherwise be scored tens of
+thousands of times), the equipment tag is matched inside the index and a
+date range is turned into a range of inspection ids, which the index seeks
+to directly.  Matches are highlighted in Python on the returned hits only.
+
+    python search.py "milky oil" [--tag TAG] [--since DATE] [--until DATE]
+    python search.py --rebuild   re-index everything (after checklist label changes)
+"""
+import re
+from dataclasses import dataclass
+
+import metrics
+from equipment import checklist_for
+from records import record_to_inspection
+from storage import ConnectionPool, DEFAULT_DB_PATH, load_records
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS inspection_search USING fts5(
+    findings, comments, asset,
+    tokenize = 'porter unicode61 remove_diacritics 2',
+    prefix = '3'
+);
+CREATE TABLE IF NOT EXISTS inspection_search_state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    last_id INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO inspection_search_state (id, last_id) VALUES (0, 0);
+"""
+
+# BM25 weights of the findings and comments columns (the asset column only
+# narrows searches to one equipment tag)
+FINDINGS_WEIGHT = 2.0
+COMMENTS_WEIGHT = 1.0
+
+# Most recent matches ranked per search
+MAX_CANDIDATES = 5000
+
+# Inspections indexed per write transaction
+INDEX_BATCH = 1000
+
+# The most recent matches are ranked first; only the best ones are then
+# joined with their inspection and indexed text
+SEARCH_SQL = """
+SELECT i.id, i.inspection_date, i.equipment_tag, i.inspection_type, i.wo_number,
+       i.technician_name, t.findings, t.comments, best.score
+FROM (
+    SELECT id, score FROM (
+        SELECT s.rowid AS id, bm25(inspection_search, {weights}) AS score
+        FROM inspection_search s{join}
+        WHERE inspection_search MATCH ?{filters}
+        ORDER BY s.rowid DESC LIMIT ?
+    ) ORDER BY score LIMIT ?
+) best
+JOIN inspections i ON i.id = best.id
+JOIN inspection_search t ON t.rowid = best.id
+ORDER BY best.score, i.inspection_date DESC
+""".replace('{weights}', f"{FINDINGS_WEIGHT}, {COMMENTS_WEIGHT}, 0.0")
+
+_TERMS = re.compile(r'"([^"]*)"|([^\s"]+)')
+_WORD = re.compile(r'\w+')
+_MARKDOWN = re.compile(r'([\\`*_{}\[\]<>#|~])')
+_SUFFIXES = ('ings', 'ing', 'ed', 'es', 's')
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    """One matching inspection; findings and comments are Markdown excerpts
+    with the matching words in bold"""
+    id: int
+    inspection_date: str
+    equipment_tag: str
+    inspection_type: str
+    wo_number: str
+    technician_name: str
+    findings: str
+    comments: str
+    score: float
+
+
+def search_text(inspection_data, checklist):
+    """(findings, comments) text of an inspection as it is indexed"""
+    findings, comments = [], []
+    for section in checklist.sections:
+        values = inspection_data.get(section.key)
+        if not isinstance(values, dict):
+            continue
+        for field in section.fields:
+            value = values.get(field.key)
+            if field.options:
+                if value in field.options and value != field.options[0]:
+                    label = field.report_label.rstrip(': ')
+                    findings.append(f"{section.title} – {label}: {value}")
+            elif field.type == 'text' and isinstance(value, str) and value.strip():
+                comments.append(value.strip())
+    return '\n'.join(findings), '\n'.join(comments)
+
+
+def match_query(text):
+    """FTS5 query of a search box entry: every word must match (by prefix),
+    "quoted words" as a phrase.  Returns None if there is nothing to search."""
+    terms = []
+    for phrase, word in _TERMS.findall(text):
+        if phrase:
+            words = _WORD.findall(phrase)
+            if words:
+                terms.append('"' + ' '.join(words) + '"')
+        else:
+            terms.extend(f'"{token}"*' for token in _WORD.findall(word))
+    return ' '.join(terms) or None
+
+
+def _stem(word):
+    """Rough stem of a search word, for highlighting what the index matched"""
+    word = word.lower()
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def highlight(text, words, width=240):
+    """Markdown excerpt of the lines of text containing one of words, with
+    every word starting like one of them in bold ('' if none matches)"""
+    if not words or not text:
+        return ''
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(_stem(word)) for word in words) + r')\w*',
+                         re.IGNORECASE)
+    excerpts = []
+    for line in text.splitlines():
+        found = pattern.search(line)
+        if found is None:
+            continue
+        if len(line) > width:
+            begin = max(0, found.start() - width // 3)
+            line = ('…' if begin else '') + line[begin:begin + width] + '…'
+        excerpts.append(pattern.sub(lambda match: f"**{match.group(0)}**",
+                                    _MARKDOWN.sub(r'\\\1', line)))
+    return ' · '.join(excerpts)
+
+
+class SearchIndex:
+    """FTS5 index of the inspections of one store"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, pool_size=2, timeout=30.0):
+        self.path = path
+        self._pool = ConnectionPool(path, pool_size, timeout)
+        self._pool.executescript(SCHEMA)
+
+    def close(self):
+        self._pool.close()
+
+    def pending(self):
+        """Whether inspections have been stored since the last refresh"""
+        with self._pool.reading() as conn:
+            last_id = conn.execute("SELECT last_id FROM inspection_search_state").fetchone()[0]
+            return conn.execute("SELECT EXISTS (SELECT 1 FROM inspections WHERE id > ?)",
+                                (last_id,)).fetchone()[0] == 1
+
+    @metrics.timed('search.refresh')
+    def refresh(self, batch_size=INDEX_BATCH):
+        """Index the inspections stored since the last refresh.  Returns the
+        number of inspections read."""
+        if not self.pending():
+            return 0
+        total = 0
+        while True:
+            # Each batch is its own transaction, so submissions are never held
+            # up for long, and app processes refreshing at once do not clash
+            with self._pool.writing() as conn:
+                last_id = conn.execute("SELECT last_id FROM inspection_search_state").fetchone()[0]
+                rows = conn.execute(
+                    "SELECT id, payload, archive_part FROM inspections WHERE id > ? "
+                    "ORDER BY id LIMIT ?", (last_id, batch_size)).fetchall()
+                if not rows:
+                    return total
+                records = load_records(conn, rows)
+                documents = []
+                for row_id, *_ in rows:
+                    inspection_info, inspection_data = record_to_inspection(records[row_id])
+                    findings, comments = search_text(inspection_data,
+                                                     checklist_for(inspection_info))
+                    if findings or comments:
+                        documents.append((row_id, findings, comments,
+                                          inspection_info.get('equipment_tag', '')))
+                conn.executemany(
+                    "INSERT INTO inspection_search (rowid, findings, comments, asset) "
+                    "VALUES (?, ?, ?, ?)", documents)
+                conn.execute("UPDATE inspection_search_state SET last_id = ?", (rows[-1][0],))
+            total += len(rows)
+
+    def rebuild(self):
+        """Drop the index and index every stored inspection again"""
+        with self._pool.writing() as conn:
+            conn.execute("DELETE FROM inspection_search")
+            conn.execute("UPDATE inspection_search_state SET last_id = 0")
+        return self.refresh()
+
+    @metrics.timed('search.query')
+    def search(self, text, equipment_tag=None, start_date=None, end_date=None, limit=50):
+        """[SearchHit] of the best matches of text, best first"""
+        query = match_query(text)
+        if query is None:
+            return []
+        match = f"{{findings comments}} : ({query})"
+        filters, params = [], []
+        if equipment_tag:
+            tokens = _WORD.findall(equipment_tag)
+            if tokens:
+                match += ' AND asset : ^"' + ' '.join(tokens) + '"'
+            # The index matches the tag's words; the exact tag is checked here
+            filters.append("i.equipment_tag = ?")
+            params.append(equipment_tag)
+
+        with self._pool.reading() as conn:
+            if start_date or end_date:
+                start = str(start_date)[:10] if start_date else '0000-00-00'
+                end = str(end_date)[:10] if end_date else '9999-99-99'
+                first_id, last_id = conn.execute(
+                    "SELECT MIN(id), MAX(id) FROM inspections WHERE inspection_date BETWEEN ? AND ?",
+                    (start, end)).fetchone()
+                if first_id is None:
+                    return []
+                filters += ["s.rowid BETWEEN ? AND ?", "i.inspection_date BETWEEN ? AND ?"]
+                params += [first_id, last_id, start, end]
+            sql = (SEARCH_SQL
+                   .replace('{join}', " JOIN inspections i ON i.id = s.rowid" if filters else '')
+                   .replace('{filters}', ''.join(f" AND {f}" for f in filters)))
+            rows = conn.execute(sql, [match] + params + [MAX_CANDIDATES, limit]).fetchall()
+
+        words = _WORD.findall(text)
+        return [SearchHit(*row[:6], highlight(row[6], words), highlight(row[7], words), row[8])
+                for row in rows]
+
+
+def main():
+    import argparse
+    import os
+    import time
+
+    parser = argparse.ArgumentParser(description="Search inspection comments and findings")
+    parser.add_argument('query', nargs='?', default='')
+    parser.add_argument('--db', default=os.environ.get('VIBROSENS_CENTRAL_DB') or DEFAULT_DB_PATH)
+    parser.add_argument('--tag')
+    parser.add_argument('--since')
+    parser.add_argument('--until')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--rebuild', action='store_true', help="re-index every inspection")
+    args = parser.parse_args()
+
+    index = SearchIndex(args.db)
+    started = time.perf_counter()
+    indexed = index.rebuild() if args.rebuild else index.refresh()
+    if indexed:
+        print(f"Indexed {indexed} inspections in {time.perf_counter() - started:.2f} s")
+    if not args.query:
+        return
+    started = time.perf_counter()
+    hits = index.search(args.query, args.tag, args.since, args.until, args.limit)
+    elapsed = (time.perf_counter() - started) * 1000
+    for hit in hits:
+        print(f"{hit.inspection_date}  {hit.equipment_tag:<16} {hit.wo_number:<10} "
+              f"{hit.findings or hit.comments}")
+    print(f"{len(hits)} results in {elapsed:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
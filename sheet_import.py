@@ -0,0 +1,514 @@
+"""Bulk import of filled Word check sheets.
+
+Parses filled .docx check sheets back into the (inspection_info,
+inspection_data) pairs the form produces: reports written by this app as
+well as the legacy Thickener I/II check sheets.  Rows are matched against
+the checklist by label (a field's form label, report label or any of its
+"aliases"), status items by the option that is marked (e.g. "OK [X]").
+
+A directory tree is parsed with a process pool.  Every file is recorded in
+an import manifest with its content hash, so unchanged files and copies of
+sheets that were already imported are skipped on the next run, and files
+that could not be parsed are listed in a failure report:
+
+    python sheet_import.py /shares/cm/thickeners --db inspections.db -j 8
+"""
+import argparse
+import csv
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+from docx import Document
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from checklist import DEFAULT_CHECKLIST, get_checklist
+
+DEFAULT_MANIFEST_PATH = 'sheet_imports.db'
+
+DATE_FORMATS = ('%d/%m/%Y', '%d/%m/%y', '%Y-%m-%d', '%d-%m-%Y', '%d.%m.%Y')
+
+# Inspection details, as written by report.py or printed on the legacy sheets.
+# An empty capture means the value is in the next cell.
+INFO_PATTERNS = [
+    ('check_by', re.compile(r'^check(?:ed)?\s+by\s*:?\s*(.*)$', re.I | re.S)),
+    ('date', re.compile(r'^date\s*:?\s*(.*)$', re.I | re.S)),
+    ('wo_number', re.compile(r'^(?:wo|work\s+order)\b\s*#?\s*:?\s*(.*)$', re.I | re.S)),
+    ('equipment_tag', re.compile(r'^equipment\s+tag\s*#\s*:?\s*(.*)$', re.I | re.S)),
+    ('inspection_type', re.compile(r'^inspection\s+type\s*:?\s*(.*)$', re.I | re.S)),
+    ('visual_check', re.compile(r'^visual\s+check\s*:?\s*(.*)$', re.I | re.S)),
+    ('vibration_check', re.compile(r'^vibration\s+check\s*:?\s*(.*)$', re.I | re.S)),
+]
+CHECKBOX_PATTERN = re.compile(r'(visual|vibration)\s*\[([^\]]*)\]', re.I)
+NUMBER_PATTERN = re.compile(r'[-+]?\d+(?:[.,]\d+)?')
+UNCHECKED_MARKS = {'', '✗', 'no', 'false'}
+
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    imported_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sheets_sha256 ON sheets (sha256);
+"""
+
+
+class SheetParseError(ValueError):
+    """Raised when a check sheet cannot be turned into an inspection"""
+
+
+def _normalise(text):
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text.lower()).split())
+
+
+def _prefix_pattern(label):
+    """Regex matching a label at the start of a cell, however it is punctuated"""
+    words = _normalise(label).split()
+    return re.compile(r'^\W*' + r'\W+'.join(map(re.escape, words)) + r'(?![0-9a-z])\W*', re.I)
+
+
+class SheetLayout:
+    """Label lookup tables compiled from a checklist"""
+
+    def __init__(self, checklist):
+        self.checklist = checklist
+        # (normalised heading, section or None for sections the checklist lacks)
+        self.headers = []
+        for section in checklist.sections:
+            for title in (section.title, *section.aliases):
+                self.headers.append((_normalise(title), section))
+        for title in checklist.unmapped_sections:
+            self.headers.append((_normalise(title), None))
+        # Longest heading first so "planetary gear reducer primary" beats shorter ones
+        self.headers.sort(key=lambda header: -len(header[0]))
+
+        self.labels = {}
+        self.prefixes = {}
+        for section in checklist.sections:
+            labels = {}
+            for field in section.fields:
+                for label in dict.fromkeys((field.label, field.report_label, *field.aliases)):
+                    labels.setdefault(_normalise(label), []).append(field)
+            self.labels[section.key] = labels
+            self.prefixes[section.key] = sorted(
+                ((_prefix_pattern(label), fields) for label, fields in labels.items()),
+                key=lambda prefix: -len(prefix[0].pattern))
+
+    def header(self, text):
+        """(matched, section) for a heading; section is None for unmapped sections"""
+        normalised = _normalise(text)
+        for title, section in self.headers:
+            if normalised == title or normalised.startswith(title + ' '):
+                return True, section
+        return False, None
+
+    def match(self, section, text):
+        """(fields, inline remainder) if a cell starts with a field label of the section"""
+        fields = self.labels[section.key].get(_normalise(text))
+        if fields:
+            return fields, ''
+        for pattern, fields in self.prefixes[section.key]:
+            found = pattern.match(text)
+            if found:
+                return fields, text[found.end():].strip()
+        return None, None
+
+
+@lru_cache(maxsize=None)
+def get_layout(name=DEFAULT_CHECKLIST):
+    return SheetLayout(get_checklist(name))
+
+
+def _iter_blocks(doc):
+    """Paragraphs and tables of the document body, in order"""
+    body = doc.element.body
+    for child in body.iterchildren():
+        if child.tag.endswith('}p'):
+            yield Paragraph(child, doc)
+        elif child.tag.endswith('}tbl'):
+            yield Table(child, doc)
+
+
+W_TC, W_P, W_T = qn('w:tc'), qn('w:p'), qn('w:t')
+
+
+def _cell_text(tc):
+    return '\n'.join(''.join(text.text or '' for text in paragraph.iter(W_T))
+                     for paragraph in tc.iterchildren(W_P)).strip()
+
+
+def _row_cells(tr):
+    """Texts of the distinct cells of a table row.  Read straight from the XML:
+    a horizontally merged cell is a single w:tc, and the continuation of a
+    vertically merged one is skipped since its text is in the cell above."""
+    return [_cell_text(tc) for tc in tr.iterchildren(W_TC) if tc.vMerge != 'continue']
+
+
+def _parse_number(texts):
+    for text in texts:
+        found = NUMBER_PATTERN.search(text)
+        if found:
+            return float(found.group().replace(',', '.'))
+    return None
+
+
+def _parse_option(field, texts):
+    """Selected option of a status/choice item.
+
+    Legacy sheets print every option followed by a box to mark ("OK | X |
+    Not OK | "); reports written by the app hold the selected option only."""
+    options = {_normalise(option): option for option in field.options}
+    # Short forms used on the paper sheets, e.g. "Green ok" for "Green (OK)"
+    printed = [(index, options.get(_normalise(text))) for index, text in enumerate(texts)]
+    printed = [(index, option) for index, option in printed if option is not None]
+
+    if len(printed) >= 2:
+        marked = []
+        for index, option in printed:
+            mark = texts[index + 1] if index + 1 < len(texts) else ''
+            if _normalise(mark) in options:
+                mark = ''
+            if _is_marked(mark):
+                marked.append(option)
+        return marked[0] if len(marked) == 1 else None
+
+    if printed:
+        return printed[0][1]
+    for text in texts:
+        for normalised, option in options.items():
+            if _normalise(text).startswith(normalised):
+                return option
+    return None
+
+
+def _parse_date(text):
+    text = re.sub(r'\s+', '', text)
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _is_marked(text):
+    return text.strip().lower() not in UNCHECKED_MARKS
+
+
+class _SheetParser:
+    def __init__(self, layout):
+        self.layout = layout
+        self.section = None
+        self.visited = set()
+        self.info = {}
+        self.data = {}
+        self.comment = None
+
+    def heading(self, text):
+        matched, section = self.layout.header(text)
+        if not matched:
+            return False
+        # A component repeated further down the sheet (e.g. a second drive
+        # motor) is a different asset; keep the first one only
+        if section is not None and section.key in self.visited and section is not self.section:
+            section = None
+        self.section = section
+        self.comment = None
+        if section is not None:
+            self.visited.add(section.key)
+        return True
+
+    def row(self, texts):
+        if not any(texts):
+            return
+        if self._info(texts):
+            return
+        if len([text for text in texts if text]) == 1:
+            text = next(text for text in texts if text)
+            if self.heading(text):
+                return
+            if self.comment is not None and self.section is not None \
+                    and self.layout.match(self.section, text)[0] is None:
+                self._append_comment(text)
+                return
+        if self.section is None:
+            return
+
+        # Split the row at every cell that starts with a field label
+        matches = []
+        for index, text in enumerate(texts):
+            fields, remainder = self.layout.match(self.section, text) if text else (None, None)
+            if fields:
+                matches.append((index, fields, remainder))
+        self.comment = None
+        for position, (index, fields, remainder) in enumerate(matches):
+            end = matches[position + 1][0] if position + 1 < len(matches) else len(texts)
+            self._set(fields, remainder, texts[index + 1:end])
+
+    def _set(self, fields, remainder, values):
+        section_values = self.data.setdefault(self.section.key, {})
+        # Labels printed twice (e.g. two "NDE (°C)" rows) fill their fields in order
+        field = next((field for field in fields if field.key not in section_values), None)
+        if field is None:
+            return
+        if field.type == 'number':
+            # Text after a label is a value only if it starts with the number
+            # ("PRV 1 (°C) 45"), not a printed note such as "CCD1, 2 & 3"
+            inline = NUMBER_PATTERN.match(remainder)
+            value = _parse_number([inline.group()] if inline else values)
+        elif field.type in ('status', 'choice'):
+            value = _parse_option(field, [remainder] + values if remainder else values)
+        else:
+            value = '\n'.join(text for text in [remainder] + values if text) or None
+            self.comment = field
+        if value is not None:
+            section_values[field.key] = value
+
+    def _append_comment(self, text):
+        section_values = self.data.setdefault(self.section.key, {})
+        previous = section_values.get(self.comment.key)
+        section_values[self.comment.key] = f"{previous}\n{text}" if previous else text
+
+    def _info(self, texts):
+        found = False
+        for index, text in enumerate(texts):
+            for point, mark in CHECKBOX_PATTERN.findall(text):
+                self.info.setdefault(f"{point.lower()}_check", _is_marked(mark))
+                found = True
+            for key, pattern in INFO_PATTERNS:
+                match = pattern.match(text)
+                if not match:
+                    continue
+                value = match.group(1).strip()
+                if not value and index + 1 < len(texts):
+                    value = texts[index + 1]
+                if key in ('visual_check', 'vibration_check'):
+                    value = _is_marked(value)
+                self.info.setdefault(key, value)
+                found = True
+                break
+        return found
+
+
+def infer_inspection_type(text, inspection_types):
+    """Inspection type named in a title or file name, by its distinguishing words"""
+    normalised = f" {_normalise(text)} "
+    matches = []
+    for inspection_type in inspection_types:
+        words = _normalise(inspection_type).split()
+        # "Thickener II Rake ..." is identified by "thickener ii"
+        key = ' '.join(words[:2])
+        if f" {key} " in normalised:
+            matches.append(inspection_type)
+    return matches[0] if len(matches) == 1 else None
+
+
+def parse_check_sheet(source, name='', inspection_type=None, checklist=None):
+    """Parse a filled check sheet (path or binary stream) into
+    (inspection_info, inspection_data). Raises SheetParseError."""
+    checklist = checklist or get_checklist()
+    layout = get_layout(checklist.name)
+    try:
+        doc = Document(source)
+    except Exception as error:
+        raise SheetParseError(f"not a readable .docx file: {error}") from error
+
+    parser = _SheetParser(layout)
+    title = []
+    for block in _iter_blocks(doc):
+        if isinstance(block, Paragraph):
+            text = block.text.strip()
+            if text and not parser.heading(text):
+                title.append(text)
+            continue
+        for tr in block._tbl.tr_lst:
+            parser.row(_row_cells(tr))
+
+    info = parser.info
+    inspection_date = _parse_date(info.get('date', ''))
+    if inspection_date is None:
+        raise SheetParseError(f"no valid inspection date ({info.get('date', 'missing')!r})")
+    equipment_tag = re.sub(r'\s+', ' ', info.get('equipment_tag', '')).strip()
+    if not equipment_tag or equipment_tag.endswith('-'):
+        raise SheetParseError(f"no equipment tag number ({equipment_tag or 'missing'!r})")
+    # The app's own reports state the type in their details table; older
+    # sheets only name it in their title or file name
+    inspection_type = (inspection_type
+                       or infer_inspection_type(info.get('inspection_type', ''), checklist.inspection_types)
+                       or infer_inspection_type(' '.join(title[:3] + [name]), checklist.inspection_types))
+    if inspection_type is None:
+        raise SheetParseError("cannot tell the inspection type; pass it explicitly")
+    if not any(parser.data.values()):
+        raise SheetParseError("no checklist items recognised")
+
+    technician_name, _, group = info.get('check_by', '').partition('/')
+    return {
+        'technician_name': technician_name.strip(),
+        'group': group.strip(),
+        'inspection_date': inspection_date,
+        'equipment_tag': equipment_tag,
+        'wo_number': re.sub(r'^#\s*', '', info.get('wo_number', '')).strip(),
+        'inspection_type': inspection_type,
+        'visual_check': info.get('visual_check', True),
+        'vibration_check': info.get('vibration_check', True),
+    }, {key: values for key, values in parser.data.items() if values}
+
+
+class ImportManifest:
+    """Record of every sheet seen by the importer, keyed by path"""
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(MANIFEST_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def unchanged(self):
+        """{path: (size, mtime_ns)} of every sheet already processed, except
+        those that failed (retried on every run, e.g. with --type given)"""
+        return {path: (size, mtime_ns) for path, size, mtime_ns in self._conn.execute(
+            "SELECT path, size, mtime_ns FROM sheets WHERE status != 'failed'")}
+
+    def known_hashes(self):
+        return {sha256 for (sha256,) in self._conn.execute(
+            "SELECT sha256 FROM sheets WHERE status IN ('imported', 'duplicate')")}
+
+    def record(self, rows):
+        """Store (path, size, mtime_ns, sha256, status, error) rows"""
+        imported_at = datetime.now().isoformat(timespec='seconds')
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sheets (path, size, mtime_ns, sha256, status, error, "
+                "imported_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [row + (imported_at,) for row in rows])
+
+
+def find_sheets(root):
+    """Paths of the .docx files under root, skipping Word lock files"""
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.docx') and not name.startswith('~$'):
+                yield os.path.join(directory, name)
+
+
+def _parse_job(job):
+    path, inspection_type = job
+    with open(path, 'rb') as stream:
+        content = stream.read()
+    sha256 = hashlib.sha256(content).hexdigest()
+    try:
+        inspection = parse_check_sheet(io.BytesIO(content), os.path.basename(path), inspection_type)
+    except SheetParseError as error:
+        return path, sha256, None, str(error)
+    except Exception as error:
+        return path, sha256, None, f"{type(error).__name__}: {error}"
+    return path, sha256, inspection, None
+
+
+def import_sheets(root, store, manifest, inspection_type=None, workers=None,
+                  chunksize=16, batch_size=500):
+    """Parse every new or changed check sheet under root into the store.
+    Returns (counts, failures) where failures lists (path, error)."""
+    processed = manifest.unchanged()
+    known = manifest.known_hashes()
+    counts = {'imported': 0, 'duplicate': 0, 'failed': 0, 'unchanged': 0}
+    failures = []
+
+    stats = {}
+    jobs = []
+    for path in find_sheets(root):
+        stat = os.stat(path)
+        stats[path] = (stat.st_size, stat.st_mtime_ns)
+        if processed.get(path) == stats[path]:
+            counts['unchanged'] += 1
+        else:
+            jobs.append((path, inspection_type))
+
+    pending, records = [], []
+
+    def flush():
+        if pending:
+            store.insert_idempotent(pending)
+            pending.clear()
+        manifest.record(records)
+        records.clear()
+
+    def collect(results):
+        for path, sha256, inspection, error in results:
+            size, mtime_ns = stats[path]
+            if error is not None:
+                status = 'failed'
+                failures.append((path, error))
+            elif sha256 in known:
+                status = 'duplicate'
+            else:
+                status = 'imported'
+                known.add(sha256)
+                # The content hash doubles as the store's idempotency key
+                pending.append((f"docx:{sha256[:32]}", *inspection))
+            counts[status] += 1
+            records.append((path, size, mtime_ns, sha256, status, error))
+            if len(records) >= batch_size:
+                flush()
+        flush()
+
+    if workers == 1:
+        collect(map(_parse_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=get_layout) as executor:
+            collect(executor.map(_parse_job, jobs, chunksize=chunksize))
+    return counts, failures
+
+
+def write_failure_report(failures, path):
+    with open(path, 'w', newline='', encoding='utf-8') as stream:
+        writer = csv.writer(stream)
+        writer.writerow(['path', 'error'])
+        writer.writerows(failures)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import filled Word check sheets into the inspection store")
+    parser.add_argument('root', help="directory tree holding the .docx check sheets")
+    parser.add_argument('--db', default=None, help="inspection store to import into")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST_PATH,
+                        help="file recording the sheets already imported")
+    parser.add_argument('--type', dest='inspection_type',
+                        help="inspection type of every sheet (default: from the title or file name)")
+    parser.add_argument('--failures', default='import_failures.csv',
+                        help="CSV report of the sheets that could not be parsed")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes")
+    args = parser.parse_args(argv)
+
+    from storage import InspectionStore, DEFAULT_DB_PATH
+    store = InspectionStore(args.db or DEFAULT_DB_PATH)
+    manifest = ImportManifest(args.manifest)
+
+    start = time.perf_counter()
+    counts, failures = import_sheets(args.root, store, manifest, args.inspection_type, args.jobs)
+    elapsed = time.perf_counter() - start
+
+    print(f"Imported {counts['imported']} sheets, skipped {counts['unchanged']} unchanged and "
+          f"{counts['duplicate']} duplicates, {counts['failed']} failed in {elapsed:.1f}s")
+    if failures:
+        write_failure_report(failures, args.failures)
+        print(f"Failures written to {args.failures}")
+
+
+if __name__ == "__main__":
+    main()
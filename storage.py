@@ -0,0 +1,662 @@
+"""Persistent inspection store backed by SQLite.
+
+Inspections are kept as JSON records alongside indexed columns for the
+fields they are usually looked up by (equipment tag, date, inspection type
+and work order), so fleet queries do not need to decode every record.
+
+One store is shared by every session of the app (and can be shared by
+several app processes on the same host): writes go through a single writer
+connection in immediate transactions, reads through a small pool of reader
+connections, and concurrent submissions for the same work order are
+resolved with optimistic concurrency on the work order revision.
+
+Old inspections can be moved to the archive tier (see archive.py): their
+payload is moved to a compressed Parquet file and only the indexed columns
+stay here, with archive_part pointing at the file.  Every method reading
+payloads loads those of archived inspections from their file, so queries,
+trends and exports span both tiers.
+
+Every stored inspection also appends a change event to change_log in the
+same transaction, whichever path stored it (form submissions through the
+sync queue, the ingestion API, imports).  The log is append-only and is
+what the KPI aggregates (kpis.py) are maintained and rebuilt from.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+
+import metrics
+from records import inspection_to_record, record_to_inspection
+
+DEFAULT_DB_PATH = os.environ.get('VIBROSENS_DB', 'inspections.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inspections (
+    id INTEGER PRIMARY KEY,
+    inspection_date TEXT NOT NULL,
+    equipment_tag TEXT NOT NULL,
+    inspection_type TEXT NOT NULL,
+    wo_number TEXT NOT NULL DEFAULT '',
+    technician_name TEXT NOT NULL DEFAULT '',
+    group_name TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    idempotency_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_inspections_tag_type_date
+    ON inspections (equipment_tag, inspection_type, inspection_date);
+CREATE INDEX IF NOT EXISTS idx_inspections_type_date
+    ON inspections (inspection_type, inspection_date);
+CREATE INDEX IF NOT EXISTS idx_inspections_wo
+    ON inspections (wo_number);
+CREATE INDEX IF NOT EXISTS idx_inspections_date
+    ON inspections (inspection_date);
+CREATE INDEX IF NOT EXISTS idx_inspections_tag_date
+    ON inspections (equipment_tag, inspection_date);
+"""
+
+# Statements applied after SCHEMA; columns added since the first release are
+# created here for stores that predate them.
+MIGRATIONS = [
+    ('idempotency_key', "ALTER TABLE inspections ADD COLUMN idempotency_key TEXT"),
+    ('archive_part', "ALTER TABLE inspections ADD COLUMN archive_part INTEGER"),
+]
+
+def _backfill_change_log(conn, batch_size=1000):
+    """Change events of the inspections stored before the change log existed"""
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, payload, archive_part, created_at FROM inspections WHERE id > ? "
+            "ORDER BY id LIMIT ?", (last_id, batch_size)).fetchall()
+        if not rows:
+            return
+        records = load_records(conn, [row[:3] for row in rows])
+        for row_id, _, _, created_at in rows:
+            _log_change(conn, row_id, records[row_id], created_at)
+        last_id = rows[-1][0]
+
+
+# Tables added since the first release: (table, statements, or functions
+# called with the connection, run once to create and backfill it)
+TABLE_MIGRATIONS = [
+    ('work_orders', [
+        """CREATE TABLE work_orders (
+            wo_number TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            inspection_id INTEGER NOT NULL,
+            technician_name TEXT NOT NULL DEFAULT '',
+            updated_at TEXT NOT NULL
+        )""",
+        # Inspections already stored count as the revisions of their work order
+        """INSERT INTO work_orders (wo_number, version, inspection_id, technician_name, updated_at)
+           SELECT wo_number, COUNT(*), MAX(id), technician_name, created_at
+           FROM inspections WHERE wo_number != '' GROUP BY wo_number""",
+    ]),
+    # Immutable archive files holding the payloads of archived inspections
+    ('archive_parts', [
+        """CREATE TABLE archive_parts (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            month TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )""",
+    ]),
+    ('change_log', [
+        """CREATE TABLE change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            inspection_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            event TEXT NOT NULL
+        )""",
+        _backfill_change_log,
+    ]),
+]
+
+POST_MIGRATION_SCHEMA = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_inspections_idempotency
+    ON inspections (idempotency_key) WHERE idempotency_key IS NOT NULL;
+-- Every stored inspection of a work order is a new revision of it, whichever
+-- path stored it (form, sync, import)
+CREATE TRIGGER IF NOT EXISTS trg_inspections_work_order
+AFTER INSERT ON inspections WHEN NEW.wo_number != ''
+BEGIN
+    INSERT INTO work_orders (wo_number, version, inspection_id, technician_name, updated_at)
+    VALUES (NEW.wo_number, 1, NEW.id, NEW.technician_name, NEW.created_at)
+    ON CONFLICT (wo_number) DO UPDATE SET
+        version = version + 1,
+        inspection_id = excluded.inspection_id,
+        technician_name = excluded.technician_name,
+        updated_at = excluded.updated_at;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_change_log_no_update
+BEFORE UPDATE ON change_log
+BEGIN
+    SELECT RAISE(ABORT, 'change_log is append-only');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_change_log_no_delete
+BEFORE DELETE ON change_log
+BEGIN
+    SELECT RAISE(ABORT, 'change_log is append-only');
+END;
+"""
+
+# Columns of an inspection kept in its archive part
+ARCHIVE_COLUMNS = ('id', 'inspection_date', 'equipment_tag', 'inspection_type', 'wo_number',
+                   'technician_name', 'group_name', 'created_at', 'idempotency_key', 'payload')
+
+INSERT_SQL = """
+INSERT INTO inspections (inspection_date, equipment_tag, inspection_type, wo_number,
+                         technician_name, group_name, created_at, payload)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_IDEMPOTENT_SQL = """
+INSERT OR IGNORE INTO inspections (inspection_date, equipment_tag, inspection_type, wo_number,
+                                   technician_name, group_name, created_at, payload,
+                                   idempotency_key)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _iso(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    return value
+
+
+def load_records(conn, rows):
+    """{id: record} of (id, payload, archive_part) rows, reading the payloads
+    of archived inspections from their archive part"""
+    records, archived = {}, {}
+    for row_id, payload, part in rows:
+        if part is None:
+            records[row_id] = json.loads(payload)
+        else:
+            archived.setdefault(part, []).append(row_id)
+    if archived:
+        from archive import read_payloads
+        # Part paths are relative to the directory of the database
+        database = conn.execute("PRAGMA database_list").fetchone()[2]
+        parts = list(archived)
+        paths = dict(conn.execute(
+            f"SELECT id, path FROM archive_parts WHERE id IN ({', '.join('?' * len(parts))})",
+            parts).fetchall())
+        for part, ids in archived.items():
+            path = os.path.join(os.path.dirname(database), paths[part])
+            for row_id, payload in read_payloads(path, ids).items():
+                records[row_id] = json.loads(payload)
+    return records
+
+
+def _log_change(conn, inspection_id, record, created_at):
+    from kpis import change_event
+    conn.execute(
+        "INSERT INTO change_log (inspection_id, created_at, event) VALUES (?, ?, ?)",
+        (inspection_id, created_at,
+         json.dumps(change_event(inspection_id, record), separators=(',', ':'))))
+
+
+def _insert(conn, sql, record, created_at, *extra):
+    """Insert one inspection record and log its change event.  Returns its
+    id, or None if an idempotent insert skipped it."""
+    cursor = conn.execute(sql, _record_values(record, created_at) + extra)
+    if cursor.rowcount != 1:
+        return None
+    _log_change(conn, cursor.lastrowid, record, created_at)
+    return cursor.lastrowid
+
+
+def _record_values(record, created_at):
+    info = record['info']
+    return (
+        info['inspection_date'],
+        info.get('equipment_tag', ''),
+        info.get('inspection_type', ''),
+        info.get('wo_number', ''),
+        info.get('technician_name', ''),
+        info.get('group', ''),
+        created_at,
+        json.dumps(record, separators=(',', ':')),
+    )
+
+
+@dataclass(frozen=True)
+class WorkOrder:
+    """Latest revision of a work order"""
+    wo_number: str
+    version: int
+    inspection_id: int
+    technician_name: str
+    updated_at: str
+
+
+class WorkOrderConflict(Exception):
+    """An inspection was submitted against a work order revision that is no
+    longer the latest one (someone else submitted the same work order since)"""
+
+    def __init__(self, wo_number, expected_version, current):
+        self.wo_number = wo_number
+        self.expected_version = expected_version
+        self.current = current
+        if current is None:
+            # Expected a revision of a work order that was never submitted
+            super().__init__(f"Work order {wo_number} has not been submitted yet (revision 0), "
+                             f"not revision {expected_version}")
+            return
+        who = current.technician_name or "another user"
+        super().__init__(f"Work order {wo_number} was submitted by {who} at {current.updated_at} "
+                         f"(revision {current.version}) since this inspection was started")
+
+    @property
+    def current_version(self):
+        """Latest stored revision of the work order (0 if never submitted)"""
+        return self.current.version if self.current else 0
+
+
+class ConnectionPool:
+    """SQLite connections shared by every thread of a process.
+
+    SQLite allows one writer at a time, so writes go through a single
+    connection in BEGIN IMMEDIATE transactions (taking the write lock up
+    front, so concurrent transactions queue instead of failing on a lock
+    upgrade).  Reads use up to `size` reader connections, which in WAL mode
+    never wait behind the writer.  The busy timeout covers other processes
+    writing to the same file."""
+
+    def __init__(self, path, size=4, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._write_lock = threading.Lock()
+        # In-memory databases are private to their connection
+        self._size = 0 if path == ':memory:' else size
+        self._readers = queue.LifoQueue()
+        self._created = 0
+        self._create_lock = threading.Lock()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False)
+
+    def executescript(self, script):
+        """Run a schema script on the writer connection"""
+        with self._write_lock:
+            self._writer.executescript(script)
+
+    @contextmanager
+    def writing(self):
+        """Writer connection inside a transaction, committed on success"""
+        with self._write_lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def reading(self):
+        """A reader connection, returned to the pool afterwards"""
+        if not self._size:
+            with self._write_lock:
+                yield self._writer
+            return
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._create_lock:
+                create = self._created < self._size
+                if create:
+                    self._created += 1
+            conn = self._connect() if create else self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self._writer.close()
+
+
+class InspectionStore:
+    """Embedded inspection store (SQLite in WAL mode) with pooled connections"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, pool_size=4, timeout=30.0):
+        self.path = path
+        self._pool = ConnectionPool(path, pool_size, timeout)
+        self._pool.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        with self._pool.writing() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(inspections)")}
+            for column, statement in MIGRATIONS:
+                if column not in columns:
+                    conn.execute(statement)
+            tables = {name for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table, statements in TABLE_MIGRATIONS:
+                if table not in tables:
+                    for statement in statements:
+                        if callable(statement):
+                            statement(conn)
+                        else:
+                            conn.execute(statement)
+        self._pool.executescript(POST_MIGRATION_SCHEMA)
+
+    def close(self):
+        self._pool.close()
+
+    @metrics.timed('storage.save')
+    def save(self, inspection_info, inspection_data):
+        """Store one inspection and return its id"""
+        created_at = datetime.now().isoformat(timespec='seconds')
+        record = inspection_to_record(inspection_info, inspection_data)
+        with self._pool.writing() as conn:
+            return _insert(conn, INSERT_SQL, record, created_at)
+
+    @metrics.timed('storage.bulk_insert')
+    def bulk_insert(self, inspections):
+        """Store many (inspection_info, inspection_data) pairs in one transaction"""
+        created_at = datetime.now().isoformat(timespec='seconds')
+        records = [inspection_to_record(info, data) for info, data in inspections]
+        with self._pool.writing() as conn:
+            for record in records:
+                _insert(conn, INSERT_SQL, record, created_at)
+        return len(records)
+
+    @metrics.timed('storage.insert_idempotent')
+    def insert_idempotent(self, keyed_inspections):
+        """Store (idempotency_key, inspection_info, inspection_data) tuples in one
+        transaction, skipping keys that are already stored. Returns the number
+        of new inspections."""
+        created_at = datetime.now().isoformat(timespec='seconds')
+        records = [(key, inspection_to_record(info, data)) for key, info, data in keyed_inspections]
+        with self._pool.writing() as conn:
+            return sum(_insert(conn, INSERT_IDEMPOTENT_SQL, record, created_at, key) is not None
+                       for key, record in records)
+
+    @metrics.timed('storage.submit')
+    def submit(self, keyed_inspections):
+        """Store (idempotency_key, inspection_info, inspection_data, expected_version)
+        tuples in one transaction, with optimistic concurrency on the work order.
+
+        An inspection is stored only if its work order is still at
+        expected_version (0 for a work order never submitted before, None to
+        skip the check); otherwise it is rejected with a WorkOrderConflict.
+        Keys that are already stored are skipped, so retried batches are safe.
+        Returns ([idempotency keys stored], {idempotency_key: WorkOrderConflict})."""
+        created_at = datetime.now().isoformat(timespec='seconds')
+        stored, conflicts = [], {}
+        with self._pool.writing() as conn:
+            for key, info, data, expected_version in keyed_inspections:
+                if conn.execute("SELECT 1 FROM inspections WHERE idempotency_key = ?",
+                                (key,)).fetchone():
+                    continue
+                wo_number = info.get('wo_number') or ''
+                if wo_number and expected_version is not None:
+                    current = self._work_order(conn, wo_number)
+                    if (current.version if current else 0) != expected_version:
+                        conflicts[key] = WorkOrderConflict(wo_number, expected_version, current)
+                        continue
+                _insert(conn, INSERT_IDEMPOTENT_SQL, inspection_to_record(info, data),
+                        created_at, key)
+                stored.append(key)
+        return stored, conflicts
+
+    @staticmethod
+    def _work_order(conn, wo_number):
+        row = conn.execute(
+            "SELECT wo_number, version, inspection_id, technician_name, updated_at "
+            "FROM work_orders WHERE wo_number = ?", (wo_number,)).fetchone()
+        return WorkOrder(*row) if row else None
+
+    @metrics.timed('storage.work_order')
+    def work_order(self, wo_number):
+        """Latest revision of a work order, or None if it was never submitted"""
+        with self._pool.reading() as conn:
+            return self._work_order(conn, wo_number)
+
+    @metrics.timed('storage.work_orders')
+    def work_orders(self, wo_numbers):
+        """{wo_number: WorkOrder} of the work orders already submitted"""
+        wo_numbers = [wo for wo in dict.fromkeys(wo_numbers) if wo]
+        if not wo_numbers:
+            return {}
+        with self._pool.reading() as conn:
+            rows = conn.execute(
+                "SELECT wo_number, version, inspection_id, technician_name, updated_at "
+                f"FROM work_orders WHERE wo_number IN ({', '.join('?' * len(wo_numbers))})",
+                wo_numbers).fetchall()
+        return {row[0]: WorkOrder(*row) for row in rows}
+
+    def _where(self, equipment_tag=None, inspection_type=None, wo_number=None,
+               start_date=None, end_date=None):
+        clauses, params = [], []
+        for column, value in (('equipment_tag', equipment_tag),
+                              ('inspection_type', inspection_type),
+                              ('wo_number', wo_number)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if start_date is not None:
+            clauses.append("inspection_date >= ?")
+            params.append(_iso(start_date))
+        if end_date is not None:
+            clauses.append("inspection_date <= ?")
+            params.append(_iso(end_date))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    @metrics.timed('storage.query')
+    def query(self, equipment_tag=None, inspection_type=None, wo_number=None,
+              start_date=None, end_date=None, limit=None, page_size=1000):
+        """Yield (inspection_info, inspection_data) pairs matching the filters,
+        oldest first. Dates are inclusive.
+
+        Rows are read page_size at a time (keyset pagination on date and id),
+        so iterating over any range of inspections holds one page in memory."""
+        where, params = self._where(equipment_tag, inspection_type, wo_number,
+                                    start_date, end_date)
+        after = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_where, page_params = where, list(params)
+            if after is not None:
+                page_where += " AND " if where else " WHERE "
+                page_where += "(inspection_date, id) > (?, ?)"
+                page_params.extend(after)
+            size = page_size if remaining is None else min(page_size, remaining)
+            with self._pool.reading() as conn:
+                rows = conn.execute(
+                    f"SELECT id, inspection_date, payload, archive_part FROM inspections{page_where} "
+                    "ORDER BY inspection_date, id LIMIT ?", page_params + [size]).fetchall()
+                records = load_records(conn, [(row_id, payload, part)
+                                              for row_id, _, payload, part in rows])
+            for row_id, *_ in rows:
+                yield record_to_inspection(records[row_id])
+            if len(rows) < size:
+                return
+            after = (rows[-1][1], rows[-1][0])
+            if remaining is not None:
+                remaining -= len(rows)
+
+    @metrics.timed('storage.latest')
+    def latest(self, equipment_tag, before=None):
+        """Most recent (inspection_info, inspection_data) of an asset, optionally
+        strictly before a date, or None"""
+        where, params = self._where(equipment_tag=equipment_tag)
+        if before is not None:
+            where += " AND inspection_date < ?"
+            params.append(_iso(before))
+        with self._pool.reading() as conn:
+            row = conn.execute(
+                f"SELECT id, payload, archive_part FROM inspections{where} "
+                "ORDER BY inspection_date DESC, id DESC LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            return record_to_inspection(load_records(conn, [row])[row[0]])
+
+    @metrics.timed('storage.asset_snapshots')
+    def asset_snapshots(self, equipment_tags, before=None):
+        """{equipment_tag: (first, latest)} inspections of several assets,
+        optionally strictly before a date, in one query (None for an asset
+        without inspections)"""
+        tags = list(dict.fromkeys(equipment_tags))
+        snapshots = {tag: None for tag in tags}
+        if not tags:
+            return snapshots
+        before_clause = " AND inspection_date < :before" if before is not None else ""
+        pick = ("SELECT id FROM inspections WHERE equipment_tag = route.tag"
+                f"{before_clause} ORDER BY inspection_date {{0}}, id {{0}} LIMIT 1")
+        values = ', '.join(f"(:tag{index})" for index in range(len(tags)))
+        params = {f"tag{index}": tag for index, tag in enumerate(tags)}
+        if before is not None:
+            params['before'] = _iso(before)
+        with self._pool.reading() as conn:
+            # Only the (equipment_tag, inspection_date) index is read to find
+            # the first and latest rows; their payloads are fetched by id
+            ids = conn.execute(
+                f"WITH route(tag) AS (VALUES {values}) "
+                f"SELECT tag, ({pick.format('ASC')}), ({pick.format('DESC')}) FROM route",
+                params).fetchall()
+            wanted = sorted({row_id for _, *pair in ids for row_id in pair if row_id is not None})
+            records = load_records(conn, conn.execute(
+                f"SELECT id, payload, archive_part FROM inspections "
+                f"WHERE id IN ({', '.join('?' * len(wanted))})", wanted).fetchall()) if wanted else {}
+        inspections = {row_id: record_to_inspection(record) for row_id, record in records.items()}
+        for tag, first_id, latest_id in ids:
+            if latest_id is not None:
+                snapshots[tag] = (inspections[first_id], inspections[latest_id])
+        return snapshots
+
+    @metrics.timed('storage.rows_after')
+    def rows_after(self, last_id=0, limit=1000, equipment_tag=None):
+        """Return up to limit (id, inspection_info, inspection_data) tuples
+        stored after last_id (optionally for one asset), in insertion order"""
+        where, params = self._where(equipment_tag=equipment_tag)
+        where += " AND id > ?" if where else " WHERE id > ?"
+        with self._pool.reading() as conn:
+            rows = conn.execute(
+                f"SELECT id, payload, archive_part FROM inspections{where} ORDER BY id LIMIT ?",
+                params + [last_id, limit]).fetchall()
+            records = load_records(conn, rows)
+        return [(row_id, *record_to_inspection(records[row_id])) for row_id, *_ in rows]
+
+    def last_id(self):
+        """Id of the most recently stored inspection (0 if empty)"""
+        with self._pool.reading() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM inspections").fetchone()[0]
+
+    @metrics.timed('storage.count')
+    def count(self, equipment_tag=None, inspection_type=None, wo_number=None,
+              start_date=None, end_date=None):
+        """Number of inspections matching the filters"""
+        where, params = self._where(equipment_tag, inspection_type, wo_number,
+                                    start_date, end_date)
+        with self._pool.reading() as conn:
+            return conn.execute(
+                f"SELECT COUNT(*) FROM inspections{where}", params).fetchone()[0]
+
+    def equipment_tags(self):
+        """All equipment tags with at least one stored inspection"""
+        with self._pool.reading() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT equipment_tag FROM inspections ORDER BY equipment_tag").fetchall()
+        return [tag for (tag,) in rows]
+
+    # Archive tier (see archive.py)
+
+    def archivable_months(self, before):
+        """{month: inspections} of the inspections dated before a date that
+        are not archived yet"""
+        with self._pool.reading() as conn:
+            rows = conn.execute(
+                "SELECT substr(inspection_date, 1, 7), COUNT(*) FROM inspections "
+                "WHERE inspection_date < ? AND archive_part IS NULL GROUP BY 1 ORDER BY 1",
+                (_iso(before),)).fetchall()
+        return dict(rows)
+
+    @metrics.timed('storage.archive_rows')
+    def archive_rows(self, month, before):
+        """ARCHIVE_COLUMNS tuples of the inspections of a month (YYYY-MM) dated
+        before a date that are not archived yet, in id order"""
+        with self._pool.reading() as conn:
+            return conn.execute(
+                f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM inspections "
+                "WHERE inspection_date BETWEEN ? AND ? AND inspection_date < ? "
+                "AND archive_part IS NULL ORDER BY id",
+                (f"{month}-00", f"{month}-99", _iso(before))).fetchall()
+
+    @metrics.timed('storage.mark_archived')
+    def mark_archived(self, path, month, ids, size):
+        """Record an archive part holding the payloads of ids and drop those
+        payloads from the store, in one transaction.  path is relative to the
+        directory of the database.  Returns the part id."""
+        with self._pool.writing() as conn:
+            part = conn.execute(
+                "INSERT INTO archive_parts (path, month, rows, bytes, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (path, month, len(ids), size, datetime.now().isoformat(timespec='seconds'))).lastrowid
+            conn.executemany(
+                "UPDATE inspections SET payload = '', archive_part = ? "
+                "WHERE id = ? AND archive_part IS NULL", ((part, row_id) for row_id in ids))
+        return part
+
+    def archive_parts(self):
+        """[(id, path, month, rows, bytes)] of the archive parts, oldest month first"""
+        with self._pool.reading() as conn:
+            return conn.execute("SELECT id, path, month, rows, bytes FROM archive_parts "
+                                "ORDER BY month, id").fetchall()
+
+    def tier_counts(self):
+        """(inspections with their payload here, archived inspections)"""
+        with self._pool.reading() as conn:
+            hot, archived = conn.execute(
+                "SELECT COUNT(*) - COUNT(archive_part), COUNT(archive_part) FROM inspections"
+            ).fetchone()
+        return hot, archived
+
+    def vacuum(self):
+        """Rebuild the database file to return the space of dropped payloads
+        to the file system (holds the write lock while it runs)"""
+        self._pool.executescript("VACUUM")
+
+
+def central_db_path():
+    """Database submissions are synced to and the app's pages read from: the
+    one named by VIBROSENS_CENTRAL_DB, else the local store"""
+    return os.environ.get('VIBROSENS_CENTRAL_DB') or DEFAULT_DB_PATH
+
+
+_shared_stores = {}
+_shared_stores_lock = threading.Lock()
+
+
+def shared_store(path=None):
+    """InspectionStore of a database shared by every caller in this process
+    (the app and each of its pages), so each database has one connection
+    pool.  Defaults to the central store."""
+    path = os.path.abspath(path or central_db_path())
+    with _shared_stores_lock:
+        store = _shared_stores.get(path)
+        if store is None:
+            store = _shared_stores[path] = InspectionStore(path)
+        return store
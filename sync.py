@@ -0,0 +1,301 @@
+"""Offline-first capture: local draft autosave and queued background sync.
+
+Drafts and submitted inspections are written to a small SQLite queue on the
+device running the app, so nothing is lost if the browser session or the
+network drops.  A background SyncWorker drains the outbox to the central
+inspection store in compressed batches, retrying with exponential backoff.
+Every queued inspection carries an idempotency key derived from its work
+order number, submission time and a random nonce, so a batch that is retried after a
+partial failure never creates duplicates, and the work order revision it
+was based on, so a submission that crossed someone else's on the same work
+order is rejected (and kept for review) instead of silently stored.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import uuid
+import zlib
+from datetime import datetime
+
+import metrics
+from records import inspection_to_record, record_to_inspection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = os.environ.get('VIBROSENS_QUEUE_DB', 'field_queue.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    draft_id TEXT NOT NULL,
+    part TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (draft_id, part)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    synced_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (id) WHERE synced_at IS NULL;
+"""
+
+# Outbox columns added since the first release
+MIGRATIONS = [
+    ('expected_version', "ALTER TABLE outbox ADD COLUMN expected_version INTEGER"),
+    ('rejected_at', "ALTER TABLE outbox ADD COLUMN rejected_at TEXT"),
+]
+
+
+def idempotency_key(wo_number, submitted_at, nonce=''):
+    """Stable key for one submission of a work order.  The nonce keeps apart
+    submissions of the same work order made in the same millisecond."""
+    return hashlib.sha256(f"{wo_number}|{submitted_at}|{nonce}".encode('utf-8')).hexdigest()[:32]
+
+
+def new_draft_id():
+    return uuid.uuid4().hex[:12]
+
+
+def _now():
+    return datetime.now().isoformat(timespec='milliseconds')
+
+
+class FieldQueue:
+    """Durable local queue of drafts and submitted inspections"""
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Field data must survive a power loss on the tablet
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        with self._conn:
+            for column, statement in MIGRATIONS:
+                if column not in columns:
+                    self._conn.execute(statement)
+
+    def close(self):
+        self._conn.close()
+
+    # Drafts
+
+    def save_draft_part(self, draft_id, part, values):
+        """Autosave one part (the header or one section) of a draft"""
+        payload = json.dumps(values, default=str, separators=(',', ':'))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO drafts (draft_id, part, payload, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (draft_id, part) DO UPDATE SET payload = excluded.payload, "
+                "updated_at = excluded.updated_at",
+                (draft_id, part, payload, _now()))
+
+    def load_draft(self, draft_id):
+        """Return {part: values} for a draft (empty if unknown)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT part, payload FROM drafts WHERE draft_id = ?", (draft_id,)).fetchall()
+        return {part: json.loads(payload) for part, payload in rows}
+
+    def discard_draft(self, draft_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM drafts WHERE draft_id = ?", (draft_id,))
+
+    # Outbox
+
+    def enqueue(self, inspection_info, inspection_data, submitted_at=None, draft_id=None,
+                expected_version=None):
+        """Queue a submitted inspection for sync and return its idempotency key.
+        The draft it came from, if any, is discarded in the same transaction.
+        expected_version is the work order revision the inspection was based
+        on (0 for a new work order, None to store it unconditionally)."""
+        return self.enqueue_many([(inspection_info, inspection_data, expected_version)],
+                                 submitted_at, draft_id)[0]
+
+    @metrics.timed('sync.enqueue_many')
+    def enqueue_many(self, inspections, submitted_at=None, draft_id=None):
+        """Queue several (inspection_info, inspection_data, expected_version)
+        submissions in one transaction, e.g. a whole route, and return their
+        idempotency keys.  They are uploaded together in the next batch."""
+        submitted_at = submitted_at or _now()
+        rows = []
+        for inspection_info, inspection_data, expected_version in inspections:
+            key = idempotency_key(inspection_info.get('wo_number', ''), submitted_at,
+                                  uuid.uuid4().hex)
+            payload = json.dumps(inspection_to_record(inspection_info, inspection_data),
+                                 separators=(',', ':'))
+            rows.append((key, payload, submitted_at, expected_version))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, payload, created_at, "
+                "expected_version) VALUES (?, ?, ?, ?)", rows)
+            if draft_id is not None:
+                self._conn.execute("DELETE FROM drafts WHERE draft_id = ?", (draft_id,))
+        return [row[0] for row in rows]
+
+    def pending(self, limit=100):
+        """Return up to limit unsynced (id, idempotency_key, payload, expected_version)
+        rows, leaving out rejected ones"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, idempotency_key, payload, expected_version FROM outbox "
+                "WHERE synced_at IS NULL AND rejected_at IS NULL ORDER BY id LIMIT ?",
+                (limit,)).fetchall()
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM outbox "
+                "WHERE synced_at IS NULL AND rejected_at IS NULL").fetchone()[0]
+
+    def rejected(self):
+        """(idempotency_key, inspection_info, inspection_data, reason) of the
+        submissions rejected by the central store, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idempotency_key, payload, last_error FROM outbox "
+                "WHERE synced_at IS NULL AND rejected_at IS NOT NULL ORDER BY id").fetchall()
+        return [(key, *record_to_inspection(json.loads(payload)), reason)
+                for key, payload, reason in rows]
+
+    def mark_rejected(self, rejected):
+        """Park submissions rejected by the sink ({idempotency_key: reason})"""
+        rejected_at = _now()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET rejected_at = ?, last_error = ? WHERE idempotency_key = ?",
+                [(rejected_at, str(reason)[:500], key) for key, reason in rejected.items()])
+
+    def requeue(self, key, expected_version=None):
+        """Send a rejected submission again, based on another work order revision"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET rejected_at = NULL, last_error = NULL, expected_version = ? "
+                "WHERE idempotency_key = ?", (expected_version, key))
+
+    def discard(self, key):
+        """Drop a queued submission that is no longer wanted"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM outbox WHERE idempotency_key = ? AND synced_at IS NULL",
+                               (key,))
+
+    def mark_synced(self, ids):
+        synced_at = _now()
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE outbox SET synced_at = ? WHERE id = ?",
+                                   [(synced_at, row_id) for row_id in ids])
+
+    def mark_failed(self, ids, error):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                [(str(error)[:500], row_id) for row_id in ids])
+
+
+def encode_batch(rows):
+    """Compress queued rows into one upload body"""
+    batch = [{'key': key, 'record': json.loads(payload), 'expected_version': expected_version}
+             for _, key, payload, expected_version in rows]
+    return zlib.compress(json.dumps(batch, separators=(',', ':')).encode('utf-8'), 6)
+
+
+def decode_batch(body):
+    """Inverse of encode_batch: list of (idempotency_key, inspection_info,
+    inspection_data, expected_version)"""
+    batch = json.loads(zlib.decompress(body).decode('utf-8'))
+    return [(item['key'], *record_to_inspection(item['record']), item.get('expected_version'))
+            for item in batch]
+
+
+class StoreSink:
+    """Sync target writing batches straight into an InspectionStore"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __call__(self, body):
+        _, conflicts = self.store.submit(decode_batch(body))
+        return {key: str(conflict) for key, conflict in conflicts.items()}
+
+
+class SyncWorker(threading.Thread):
+    """Background thread draining the outbox to a sink in compressed batches.
+
+    sink(body) receives the output of encode_batch() and must either store
+    the whole batch (idempotently) or raise.  It returns the inspections it
+    rejected for good, as {idempotency_key: reason}; those are parked in
+    the queue for review instead of being retried.  Failed batches are
+    retried with exponential backoff and jitter, up to max_backoff seconds
+    apart.
+    """
+
+    def __init__(self, queue, sink, batch_size=100, interval=30.0, max_backoff=600.0):
+        super().__init__(name="vibrosens-sync", daemon=True)
+        self.queue = queue
+        self.sink = sink
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.last_error = None
+        self.last_sync = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._failures = 0
+
+    def wake(self):
+        """Sync as soon as possible, e.g. right after a submission"""
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    @metrics.timed('sync.sync_once')
+    def sync_once(self):
+        """Upload pending inspections batch by batch; returns the number synced"""
+        synced = 0
+        while True:
+            rows = self.queue.pending(self.batch_size)
+            if not rows:
+                return synced
+            try:
+                rejected = self.sink(encode_batch(rows)) or {}
+            except Exception as error:
+                self.queue.mark_failed([row[0] for row in rows], error)
+                raise
+            if rejected:
+                self.queue.mark_rejected(rejected)
+                metrics.count('sync_rejected', len(rejected))
+            ids = [row_id for row_id, key, _, _ in rows if key not in rejected]
+            self.queue.mark_synced(ids)
+            metrics.count('synced', len(ids))
+            synced += len(ids)
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                if self.sync_once():
+                    self.last_sync = datetime.now()
+                self._failures = 0
+                self.last_error = None
+                delay = self.interval
+            except Exception as error:
+                self._failures += 1
+                self.last_error = error
+                delay = min(self.max_backoff, self.interval * 2 ** min(self._failures, 10))
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning("Inspection sync failed (attempt %d), retrying in %.0fs: %s",
+                               self._failures, delay, error)
+            self._wake.wait(delay)
+            self._wake.clear()
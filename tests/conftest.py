@@ -0,0 +1,31 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+# The modules live at the top of the repository, next to main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def inspection_info():
+    """Details of a complete thickener power pack inspection"""
+    return {
+        'technician_name': "Ann",
+        'group': "Group A",
+        'inspection_date': date(2025, 6, 2),
+        'equipment_tag': "31 - TM - 05",
+        'wo_number': "WO100",
+        'inspection_type': "Thickener I Rake Drive Hydraulic Power Pack",
+        'visual_check': True,
+        'vibration_check': False,
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    from storage import InspectionStore
+    store = InspectionStore(str(tmp_path / "inspections.db"))
+    yield store
+    store.close()
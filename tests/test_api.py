@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from api import IngestWriter, check_record
+from records import inspection_to_record
+
+
+@pytest.fixture
+def record(inspection_info):
+    return inspection_to_record(inspection_info, {})
+
+
+def test_check_record_accepts_valid_record(record):
+    result, item = check_record(dict(record, expected_version=0))
+    assert result['status'] == 'valid'
+    assert item[3] == 0
+
+
+@pytest.mark.parametrize('expected_version', [2.5, "abc", {"a": 1}, True, -1])
+def test_check_record_rejects_mistyped_expected_version(record, expected_version):
+    result, item = check_record(dict(record, expected_version=expected_version))
+    assert result['status'] == 'invalid' and item is None
+    assert "expected_version must be a non-negative integer." in result['errors']
+
+
+@pytest.mark.parametrize('key, value', [('equipment_tag', ["31 - TM - 05"]),
+                                        ('equipment_type', ["fan"]),
+                                        ('visual_check', "yes")])
+def test_check_record_rejects_mistyped_info(record, key, value):
+    record['info'][key] = value
+    result, item = check_record(record)
+    assert result['status'] == 'invalid' and item is None
+
+
+def test_check_record_rejects_unknown_equipment_type(record):
+    record['info']['equipment_type'] = 'conveyor'
+    result, _ = check_record(record)
+    assert result['status'] == 'invalid'
+
+
+def ingest(store, records):
+    """Outcomes of storing records through the API's ingest writer"""
+    async def run():
+        writer = IngestWriter(store)
+        writer.start()
+        try:
+            items = [check_record(record)[1] for record in records]
+            return await writer.submit(items)
+        finally:
+            await writer.stop()
+    return asyncio.run(run())
+
+
+def test_ingest_reports_stale_revision_of_new_work_order_as_conflict(store, record):
+    stale = dict(record, key='k1', expected_version=2)
+    other = dict(record, key='k2', expected_version=0)
+    other['info'] = dict(record['info'], wo_number="WO200")
+    outcomes = ingest(store, [stale, other])
+    assert outcomes['k1'][0] == 'conflict'
+    assert outcomes['k2'] == ('stored', None)
+
+
+def test_ingest_reports_duplicates(store, record):
+    assert ingest(store, [dict(record, key='k1')]) == {'k1': ('stored', None)}
+    assert ingest(store, [dict(record, key='k1')]) == {'k1': ('duplicate', None)}
+
+
+def test_ingest_isolates_store_failures(store, record, monkeypatch):
+    submit = store.submit
+
+    def failing_submit(items):
+        if any(key == 'bad' for key, *_ in items):
+            raise RuntimeError("disk I/O error")
+        return submit(items)
+
+    monkeypatch.setattr(store, 'submit', failing_submit)
+    good = dict(record, key='good')
+    bad = dict(record, key='bad')
+    bad['info'] = dict(record['info'], wo_number="WO200")
+    outcomes = ingest(store, [good, bad])
+    assert outcomes['good'] == ('stored', None)
+    assert outcomes['bad'][0] == 'error'
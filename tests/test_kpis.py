@@ -0,0 +1,40 @@
+from datetime import date
+
+from kpis import KpiAggregates
+
+
+def test_sections_are_kept_per_equipment_type(store, inspection_info):
+    pump_info = dict(inspection_info, equipment_type='centrifugal_pump',
+                     equipment_tag="31 - PP - 01", inspection_type="Slurry Pump")
+    store.bulk_insert([
+        (inspection_info, {'safety': {'equipment_tags': "Not OK", 'housekeeping': "OK"}}),
+        (pump_info, {'safety': {'equipment_tags': "OK", 'guards': "OK", 'housekeeping': "OK"}}),
+    ])
+    aggregates = KpiAggregates(store.path)
+    try:
+        assert aggregates.refresh() == 2
+        rows = aggregates.section_not_ok(as_of=date(2025, 6, 5))
+    finally:
+        aggregates.close()
+    assert sorted(rows) == [('centrifugal_pump', 'safety', 0, 3),
+                            ('thickener_power_pack', 'safety', 1, 2)]
+
+
+def test_aggregates_without_equipment_type_are_rebuilt(store, inspection_info):
+    store.save(inspection_info, {'safety': {'equipment_tags': "Not OK"}})
+    aggregates = KpiAggregates(store.path)
+    aggregates.refresh()
+    # Aggregates as kept before they were split by equipment type
+    with aggregates._pool.writing() as conn:
+        conn.execute("DROP TABLE kpi_section_week")
+        conn.execute("CREATE TABLE kpi_section_week (section TEXT NOT NULL, week TEXT NOT NULL, "
+                     "not_ok INTEGER NOT NULL, checked INTEGER NOT NULL, PRIMARY KEY (section, week))")
+    aggregates.close()
+
+    aggregates = KpiAggregates(store.path)
+    try:
+        assert aggregates.refresh() == 1
+        assert aggregates.section_not_ok(as_of=date(2025, 6, 5)) == [('thickener_power_pack', 'safety', 1, 1)]
+        assert aggregates.asset_count() == 1
+    finally:
+        aggregates.close()
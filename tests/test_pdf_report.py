@@ -0,0 +1,34 @@
+import re
+import zlib
+
+from pdf_report import MARGIN, render_pdf_bytes
+
+STREAM = re.compile(rb"stream\n(.*?)\nendstream", re.S)
+TEXT = re.compile(r"BT /\w+ [\d.]+ Tf [\d.]+ ([\d.]+) Td \((.*?)\) Tj ET")
+
+
+def page_texts(pdf):
+    """[(baseline, text), ...] of every page, in page order"""
+    pages = []
+    for stream in STREAM.findall(pdf):
+        content = zlib.decompress(stream).decode('latin-1')
+        pages.append([(float(y), text) for y, text in TEXT.findall(content)])
+    return pages
+
+
+def test_tall_row_is_split_across_pages(inspection_info):
+    words = [f"word{index}" for index in range(1500)]
+    pdf = render_pdf_bytes(inspection_info, {'safety': {'comments': " ".join(words)}})
+    pages = page_texts(pdf)
+
+    # Nothing is drawn in the bottom margin, except the page footer
+    for texts in pages:
+        assert all(y >= MARGIN for y, text in texts if " - page " not in text)
+    # Every word of the comment is printed once, in order
+    printed = [word for texts in pages for _, text in texts
+               for word in text.split() if word.startswith("word")]
+    assert printed == words
+    # The label cell is repeated on every page the row continues on
+    continued = [texts for texts in pages if any(text.startswith("word") for _, text in texts)]
+    assert len(continued) > 1
+    assert all(any(text == "Comments:" for _, text in texts) for texts in continued)
@@ -0,0 +1,53 @@
+from report import create_docx_report
+from sheet_import import ImportManifest, import_sheets, parse_check_sheet
+
+INSPECTION_DATA = {
+    'safety': {'equipment_tags': "OK", 'housekeeping': "Not OK"},
+    'reservoir': {'prv1_temp': 45.0, 'delta_pressure': 120.0},
+}
+
+
+def write_report(path, inspection_info, inspection_data=INSPECTION_DATA):
+    create_docx_report(inspection_info, inspection_data).save(str(path))
+
+
+def test_failed_sheets_are_retried(tmp_path, store, inspection_info):
+    sheets = tmp_path / "sheets"
+    sheets.mkdir()
+    # Neither the sheet nor its file name tells the inspection type
+    write_report(sheets / "sheet.docx", dict(inspection_info, inspection_type=''))
+    manifest = ImportManifest(str(tmp_path / "manifest.db"))
+    try:
+        counts, failures = import_sheets(str(sheets), store, manifest, workers=1)
+        assert counts['failed'] == 1
+        assert "inspection type" in failures[0][1]
+
+        inspection_type = inspection_info['inspection_type']
+        counts, failures = import_sheets(str(sheets), store, manifest, inspection_type, workers=1)
+        assert counts['imported'] == 1 and counts['unchanged'] == 0 and not failures
+
+        counts, _ = import_sheets(str(sheets), store, manifest, inspection_type, workers=1)
+        assert counts['unchanged'] == 1 and counts['imported'] == 0
+    finally:
+        manifest.close()
+    assert store.count() == 1
+
+
+def test_report_round_trip(tmp_path, inspection_info):
+    path = tmp_path / "WO100.docx"
+    write_report(path, inspection_info)
+
+    info, data = parse_check_sheet(str(path))
+    for key in ('equipment_tag', 'wo_number', 'inspection_type', 'inspection_date',
+                'visual_check', 'vibration_check'):
+        assert info[key] == inspection_info[key]
+    assert data['safety'] == INSPECTION_DATA['safety']
+    assert data['reservoir'] == INSPECTION_DATA['reservoir']
+
+
+def test_report_round_trip_other_thickener(tmp_path, inspection_info):
+    inspection_type = "Thickener II Rake Drive Hydraulic Power Pack"
+    path = tmp_path / "sheet.docx"
+    write_report(path, dict(inspection_info, inspection_type=inspection_type))
+    info, _ = parse_check_sheet(str(path))
+    assert info['inspection_type'] == inspection_type
@@ -0,0 +1,34 @@
+from storage import WorkOrderConflict
+
+
+def test_submit_stores_first_revision(store, inspection_info):
+    stored, conflicts = store.submit([('k1', inspection_info, {}, 0)])
+    assert stored == ['k1'] and conflicts == {}
+    assert store.work_order('WO100').version == 1
+
+
+def test_submit_rejects_stale_revision(store, inspection_info):
+    store.submit([('k1', inspection_info, {}, 0)])
+    stored, conflicts = store.submit([('k2', dict(inspection_info, technician_name="Bob"), {}, 0)])
+    assert stored == []
+    conflict = conflicts['k2']
+    assert isinstance(conflict, WorkOrderConflict)
+    assert conflict.current_version == 1
+    assert "Ann" in str(conflict)
+
+
+def test_submit_rejects_expected_version_of_new_work_order(store, inspection_info):
+    # A revision of a work order never stored is a conflict, not an error
+    # aborting the batch
+    stored, conflicts = store.submit([('k1', inspection_info, {}, 2),
+                                      ('k2', dict(inspection_info, wo_number="WO200"), {}, 0)])
+    assert stored == ['k2']
+    conflict = conflicts['k1']
+    assert conflict.current is None and conflict.current_version == 0
+    assert "not been submitted yet" in str(conflict)
+    assert store.work_order('WO100') is None
+
+
+def test_submit_skips_stored_keys(store, inspection_info):
+    store.submit([('k1', inspection_info, {}, 0)])
+    assert store.submit([('k1', inspection_info, {}, 0)]) == ([], {})
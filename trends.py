@@ -0,0 +1,314 @@
+"""Server-side trend series for the dashboard.
+
+Readings of each equipment tag are loaded from the inspection store once
+and then topped up with only the inspections stored since, so a new
+inspection never triggers a reload of the whole history.  Long series are
+reduced before they are sent to the browser, either by min/max bucketing
+(fixed-width time buckets whose aggregates are updated one reading at a
+time) or by Largest-Triangle-Three-Buckets (LTTB).
+
+The readings trended are those of the checklist of each inspection's
+equipment type: the charts below for thickener power packs, and for other
+types every number field, charted together with the fields of the same
+units.
+"""
+import math
+import re
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+from checklist import DEFAULT_CHECKLIST, get_checklist
+from equipment import DEFAULT_EQUIPMENT, equipment_of
+
+# (chart title, y axis title, [(column, trace label)]) of thickener power packs
+TREND_CHARTS = [
+    ("Temperatures", "°C", [
+        ('reservoir_prv1_temp', "PRV 1"),
+        ('reservoir_prv2_temp', "PRV 2"),
+        ('reservoir_prv3_temp', "PRV 3"),
+        ('hydraulic_drive_nde_temp', "Drive motor NDE"),
+        ('hydraulic_drive_motor_body_temp', "Drive motor body"),
+        ('hydraulic_pump_pump_temp', "Hydraulic pump"),
+    ]),
+    ("Pressures", "MPa", [
+        ('operating_drive_oil_pressure', "Drive oil"),
+        ('operating_rake_torque_pressure', "Rake torque"),
+        ('operating_rake_lift_pressure', "Rake lift"),
+        ('operating_rake_lift_pressure_lifting', "Rake lift (lifting)"),
+        ('operating_rake_lift_pressure_lowering', "Rake lift (lowering)"),
+    ]),
+    ("Filter Delta Pressure", "kPa", [
+        ('reservoir_delta_pressure', "Filter ΔP"),
+    ]),
+]
+
+# Checklists with hand-picked charts
+CHECKLIST_TREND_CHARTS = {
+    DEFAULT_CHECKLIST: TREND_CHARTS,
+}
+
+# Chart titles of the readings of other checklists, by the units ending their labels
+UNIT_TITLES = {
+    '°C': "Temperatures",
+    'MPa': "Pressures",
+    'kPa': "Pressures",
+    'mm/sec': "Vibration",
+    'm/s²': "Acceleration",
+}
+
+UNITS_PATTERN = re.compile(r'\s*\(([^)]+)\)\s*$')
+
+# Bucket widths (days) tried for min/max bucketing, finest first
+RESOLUTIONS = (1, 7, 14, 30, 91, 182, 365)
+
+EPOCH_ORDINAL = 719163  # date(1970, 1, 1).toordinal()
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of n_out points of (x, y)
+    that best preserve the visual shape of the series"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # First and last points are kept; the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        # Average of the next bucket is the third vertex of the triangle
+        next_x = x[end:next_end].mean() if next_end > end else x[-1]
+        next_y = y[end:next_end].mean() if next_end > end else y[-1]
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+class BucketAggregates:
+    """Min and max (with their days) per fixed-width time bucket of one series.
+    Adding a reading touches only its own bucket."""
+
+    def __init__(self, width):
+        self.width = width
+        self.buckets = {}
+
+    def add(self, day, value):
+        bucket = self.buckets.get(day // self.width)
+        if bucket is None:
+            self.buckets[day // self.width] = [value, day, value, day]
+            return
+        if value < bucket[0]:
+            bucket[0], bucket[1] = value, day
+        if value > bucket[2]:
+            bucket[2], bucket[3] = value, day
+
+    def points(self, start=None, end=None):
+        """(days, values) of each bucket's min and max in time order"""
+        days, values = [], []
+        for key in sorted(self.buckets):
+            if start is not None and (key + 1) * self.width <= start:
+                continue
+            if end is not None and key * self.width > end:
+                break
+            low, low_day, high, high_day = self.buckets[key]
+            pairs = [(low_day, low), (high_day, high)] if low_day <= high_day else \
+                [(high_day, high), (low_day, low)]
+            if low_day == high_day:
+                pairs = pairs[:1]
+            for day, value in pairs:
+                days.append(day)
+                values.append(value)
+        return np.array(days, dtype=np.int64), np.array(values, dtype=np.float64)
+
+
+class TrendSeries:
+    """All trend readings of one equipment tag.
+
+    Readings live in growable NumPy buffers (one row per trend column), so
+    appending an inspection is amortised O(1) and only the bucket it falls
+    in is updated in each cached aggregate."""
+
+    def __init__(self, equipment_tag, capacity=256):
+        self.equipment_tag = equipment_tag
+        self.last_id = 0
+        # Equipment type of the most recently stored inspection, whose charts are shown
+        self.equipment_type = DEFAULT_EQUIPMENT
+        self._size = 0
+        self._sorted = True
+        self._days = np.empty(capacity, dtype=np.int64)
+        self._columns = {}  # column -> row of _values
+        self._values = np.empty((0, capacity), dtype=np.float64)
+        self._aggregates = {}
+        self._reduced = {}
+
+    def __len__(self):
+        return self._size
+
+    def append(self, row_id, inspection_info, inspection_data):
+        if self._size == len(self._days):
+            self._days = np.resize(self._days, 2 * self._size)
+            self._values = np.concatenate([self._values, np.empty_like(self._values)], axis=1)
+
+        day = inspection_info['inspection_date'].toordinal()
+        if self._size and day < self._days[self._size - 1]:
+            # Back-dated inspection: re-sort lazily on the next read
+            self._sorted = False
+        self._days[self._size] = day
+        self._values[:, self._size] = math.nan
+        equipment = equipment_of(inspection_info)
+        for column, section_key, field_key in _trend_fields(equipment.checklist):
+            row = self._columns.get(column)
+            if row is None:
+                row = self._add_column(column)
+            value = _to_float(inspection_data.get(section_key, {}).get(field_key))
+            self._values[row, self._size] = value
+            if not math.isnan(value):
+                for width in RESOLUTIONS:
+                    aggregates = self._aggregates.get((column, width))
+                    if aggregates is not None:
+                        aggregates.add(day, value)
+        self._size += 1
+        if row_id > self.last_id:
+            self.last_id = row_id
+            self.equipment_type = equipment.key
+        self._reduced.clear()
+
+    def _add_column(self, column):
+        """Row of a column first read from this tag, empty for the inspections before"""
+        self._columns[column] = len(self._columns)
+        self._values = np.concatenate(
+            [self._values, np.full((1, self._values.shape[1]), math.nan)], axis=0)
+        return self._columns[column]
+
+    def arrays(self, column):
+        """(days, values) of the non-empty readings of a column, in date order"""
+        if not self._sorted:
+            order = np.argsort(self._days[:self._size], kind='stable')
+            self._days[:self._size] = self._days[order]
+            self._values[:, :self._size] = self._values[:, order]
+            self._sorted = True
+        days = self._days[:self._size]
+        if column not in self._columns:
+            return days[:0], np.empty(0, dtype=np.float64)
+        values = self._values[self._columns[column], :self._size]
+        valid = ~np.isnan(values)
+        return days[valid], values[valid]
+
+    def _bucket_aggregates(self, column, width):
+        aggregates = self._aggregates.get((column, width))
+        if aggregates is None:
+            aggregates = BucketAggregates(width)
+            for day, value in zip(*self.arrays(column)):
+                aggregates.add(int(day), float(value))
+            self._aggregates[column, width] = aggregates
+        return aggregates
+
+    def downsample(self, column, max_points=2000, method='minmax', start=None, end=None):
+        """At most max_points (dates, values) of a column between two dates,
+        plus the number of readings they stand for"""
+        key = (column, max_points, method, start, end)
+        if key not in self._reduced:
+            days, values = self.arrays(column)
+            first = np.searchsorted(days, start.toordinal()) if start else 0
+            last = np.searchsorted(days, end.toordinal(), side='right') if end else len(days)
+            days, values = days[first:last], values[first:last]
+            n_readings = len(days)
+
+            if n_readings > max_points:
+                if method == 'lttb':
+                    selected = lttb(days, values, max_points)
+                    days, values = days[selected], values[selected]
+                else:
+                    days, values = self._min_max(column, days[0], days[-1], max_points)
+            self._reduced[key] = (_to_datetime64(days), values, n_readings)
+        return self._reduced[key]
+
+    def _min_max(self, column, first_day, last_day, max_points):
+        span = int(last_day - first_day) + 1
+        width = next((width for width in RESOLUTIONS if 2 * math.ceil(span / width) <= max_points),
+                     None)
+        if width is None:
+            # Coarser than a year: aggregate on the fly rather than caching it
+            width = math.ceil(2 * span / max_points)
+            aggregates = BucketAggregates(width)
+            for day, value in zip(*self.arrays(column)):
+                aggregates.add(int(day), float(value))
+        else:
+            aggregates = self._bucket_aggregates(column, width)
+        days, values = aggregates.points(first_day, last_day)
+        inside = (days >= first_day) & (days <= last_day)
+        return days[inside], values[inside]
+
+
+class TrendCache:
+    """Per-tag trend series shared by every dashboard session"""
+
+    def __init__(self, batch_size=5000):
+        self.batch_size = batch_size
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def series(self, store, equipment_tag):
+        """Trend series of a tag, topped up with inspections stored since the last call"""
+        with self._lock:
+            series = self._series.get(equipment_tag)
+            if series is None:
+                series = self._series[equipment_tag] = TrendSeries(equipment_tag)
+            if store.last_id() > series.last_id:
+                while True:
+                    rows = store.rows_after(series.last_id, self.batch_size, equipment_tag)
+                    if not rows:
+                        break
+                    for row in rows:
+                        series.append(*row)
+                    series.last_id = rows[-1][0]
+            return series
+
+
+@lru_cache(maxsize=None)
+def charts_for(checklist_name=DEFAULT_CHECKLIST):
+    """(chart title, y axis title, [(column, trace label)]) of a checklist:
+    its hand-picked charts, or one chart per units of its number fields"""
+    if checklist_name in CHECKLIST_TREND_CHARTS:
+        return CHECKLIST_TREND_CHARTS[checklist_name]
+    charts = {}
+    for column, section, field in get_checklist(checklist_name).columns():
+        if field.type != 'number':
+            continue
+        match = UNITS_PATTERN.search(field.label)
+        units = match.group(1) if match else ''
+        label = f"{section.title} {UNITS_PATTERN.sub('', field.label)}"
+        charts.setdefault(units, []).append((column, label))
+    return [(UNIT_TITLES.get(units, units or "Readings"), units, traces)
+            for units, traces in charts.items()]
+
+
+@lru_cache(maxsize=None)
+def _trend_fields(checklist_name):
+    columns = {name: (section.key, field.key)
+               for name, section, field in get_checklist(checklist_name).columns()}
+    return tuple((column, *columns[column])
+                 for _, _, traces in charts_for(checklist_name) for column, _ in traces)
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _to_datetime64(days):
+    return (np.asarray(days, dtype=np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
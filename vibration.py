@@ -0,0 +1,302 @@
+"""Vibration waveform ingestion and spectrum analysis.
+
+Raw accelerometer captures (WAV, raw binary or CSV) are memory-mapped and
+processed in fixed-size segments, so memory use does not depend on the
+capture length.  Each block of segments is analysed with vectorised NumPy:
+
+- averaged acceleration and velocity spectra (Hann window, Welch averaging)
+- overall velocity RMS in mm/s over the ISO 10816 band (10-1000 Hz)
+- envelope (demodulated) spectrum of a high-frequency band
+- energy in the envelope spectrum around bearing fault frequencies
+
+Run as a script to analyse a capture on disk:
+
+    python vibration.py capture.wav --shaft-speed 1480
+"""
+import argparse
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+G = 9.80665  # m/s² per g
+
+# Measurement points recorded on the check sheet: (key, label, section, field)
+VIBRATION_POINTS = [
+    ('nde', "Drive Motor NDE", 'hydraulic_drive', 'vibration_nde'),
+    ('motor_body', "Drive Motor Body", 'hydraulic_drive', 'vibration_motor_body'),
+    ('pump', "Hydraulic Pump", 'hydraulic_pump', 'vibration'),
+]
+
+# Typical rolling element bearing fault frequencies as orders of shaft speed
+DEFAULT_BEARING_ORDERS = {
+    'ftf': 0.40,
+    'bsf': 2.32,
+    'bpfo': 3.57,
+    'bpfi': 5.43,
+}
+
+VELOCITY_BAND = (10.0, 1000.0)
+ENVELOPE_BAND = (2000.0, 10000.0)
+HANN_ENBW = 1.5  # equivalent noise bandwidth of the Hann window, in bins
+
+
+def _wav_layout(path):
+    """Return (offset, dtype, channels, frames, sample_rate, scale) of a WAV file"""
+    with open(path, 'rb') as stream:
+        riff, _, wave_id = struct.unpack('<4sI4s', stream.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        fmt = None
+        while True:
+            header = stream.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', stream.read(16))
+                stream.seek(size - 16 + (size & 1), os.SEEK_CUR)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError(f"{path} has no fmt chunk before its data")
+                offset = stream.tell()
+                break
+            else:
+                stream.seek(size + (size & 1), os.SEEK_CUR)
+
+    audio_format, channels, sample_rate, _, block_align, bits = fmt
+    if audio_format == 3 and bits == 32:
+        dtype, scale = np.dtype('<f4'), 1.0
+    elif audio_format == 3 and bits == 64:
+        dtype, scale = np.dtype('<f8'), 1.0
+    elif audio_format in (1, 0xFFFE) and bits in (16, 32):
+        dtype = np.dtype(f'<i{bits // 8}')
+        scale = 1.0 / float(2 ** (bits - 1))
+    else:
+        raise ValueError(f"Unsupported WAV sample format ({audio_format}, {bits} bit)")
+    frames = size // block_align
+    return offset, dtype, channels, frames, sample_rate, scale
+
+
+def _csv_to_raw(source, column=0, chunksize=500000):
+    """Convert a CSV capture into a temporary raw float32 file, chunk by chunk"""
+    import pandas as pd
+
+    handle, raw_path = tempfile.mkstemp(suffix='.f32')
+    with os.fdopen(handle, 'wb') as raw:
+        for chunk in pd.read_csv(source, usecols=[column], header=None, chunksize=chunksize,
+                                 comment='#', dtype=np.float32, on_bad_lines='skip',
+                                 skip_blank_lines=True, engine='c'):
+            raw.write(chunk.iloc[:, 0].to_numpy(np.float32).tobytes())
+    return raw_path
+
+
+def open_waveform(path, file_format=None, sample_rate=None, dtype='float32', column=0):
+    """Memory-map a WAV or raw binary waveform file.
+
+    Returns (samples, sample_rate, scale) where samples is a 1-D np.memmap
+    view and scale converts raw samples to the capture units.  file_format
+    is 'wav' or 'bin' (default: from the extension); sample_rate is required
+    for raw binary captures.
+    """
+    file_format = _file_format(path, file_format)
+
+    if file_format == 'wav':
+        offset, wav_dtype, channels, frames, wav_rate, scale = _wav_layout(path)
+        data = np.memmap(path, dtype=wav_dtype, mode='r', offset=offset, shape=(frames, channels))
+        return data[:, column], wav_rate, scale
+
+    if sample_rate is None:
+        raise ValueError("sample_rate is required for raw binary and CSV captures")
+    return np.memmap(path, dtype=np.dtype(dtype), mode='r'), sample_rate, 1.0
+
+
+def _file_format(path, file_format=None):
+    return (file_format or os.path.splitext(path)[1].lstrip('.') or 'bin').lower()
+
+
+def _iter_blocks(samples, segment_size, segments_per_block):
+    """Yield 2-D blocks of consecutive, non-overlapping segments"""
+    n_segments = len(samples) // segment_size
+    for start in range(0, n_segments, segments_per_block):
+        stop = min(start + segments_per_block, n_segments)
+        block = np.asarray(samples[start * segment_size:stop * segment_size], dtype=np.float64)
+        yield block.reshape(stop - start, segment_size)
+
+
+def _band_mask(frequencies, band):
+    low, high = band
+    return (frequencies >= low) & (frequencies <= high)
+
+
+def fault_band_energies(frequencies, envelope_power, shaft_hz, orders=None,
+                        harmonics=3, tolerance=0.03):
+    """Sum envelope spectrum power around the first harmonics of each bearing
+    fault frequency (orders of shaft speed), within ±tolerance of each line"""
+    orders = orders or DEFAULT_BEARING_ORDERS
+    names = list(orders)
+    centres = (np.array([orders[name] for name in names])[:, None]
+               * np.arange(1, harmonics + 1)[None, :] * shaft_hz)
+    half_width = np.maximum(centres * tolerance, frequencies[1] - frequencies[0])
+    distance = np.abs(frequencies[None, None, :] - centres[:, :, None])
+    in_band = (distance <= half_width[:, :, None]).any(axis=1)
+    energies = (in_band * envelope_power[None, :]).sum(axis=1)
+    return dict(zip(names, energies.tolist()))
+
+
+def analyse_waveform(samples, sample_rate, scale=1.0, units='g', segment_size=65536,
+                     segments_per_block=8, shaft_hz=None, bearing_orders=None,
+                     velocity_band=VELOCITY_BAND, envelope_band=ENVELOPE_BAND):
+    """Analyse an acceleration waveform segment by segment.
+
+    Returns a dict with overall values (velocity_rms in mm/s, acceleration_rms
+    and acceleration_peak in m/s²), the averaged spectra and, when shaft_hz is
+    given, the envelope energy around each bearing fault frequency.
+    """
+    if len(samples) < segment_size:
+        segment_size = 1 << int(np.log2(max(len(samples), 2)))
+    to_si = scale * (G if units == 'g' else 1.0)
+
+    window = np.hanning(segment_size)
+    frequencies = np.fft.rfftfreq(segment_size, 1.0 / sample_rate)
+    df = frequencies[1]
+    nyquist = sample_rate / 2.0
+    envelope_band = (envelope_band[0], min(envelope_band[1], 0.9 * nyquist))
+    analytic_gain = np.zeros(segment_size)
+    analytic_gain[0] = 1.0
+    analytic_gain[1:(segment_size + 1) // 2] = 2.0
+    if segment_size % 2 == 0:
+        analytic_gain[segment_size // 2] = 1.0
+    envelope_filter = _band_mask(np.abs(np.fft.fftfreq(segment_size, 1.0 / sample_rate)),
+                                 envelope_band) * analytic_gain
+
+    # One-sided PSD scaling for a windowed segment
+    psd_scale = 2.0 / (sample_rate * (window ** 2).sum())
+
+    acceleration_power = np.zeros(len(frequencies))
+    envelope_power = np.zeros(len(frequencies))
+    n_segments = 0
+    sum_squares = 0.0
+    peak = 0.0
+
+    for block in _iter_blocks(samples, segment_size, segments_per_block):
+        block = block * to_si
+        block -= block.mean(axis=1, keepdims=True)
+        sum_squares += float(np.einsum('ij,ij->', block, block))
+        peak = max(peak, float(np.abs(block).max()))
+
+        spectrum = np.fft.rfft(block * window, axis=1)
+        acceleration_power += (np.abs(spectrum) ** 2).sum(axis=0)
+
+        if envelope_band[0] < envelope_band[1]:
+            analytic = np.fft.ifft(np.fft.fft(block, axis=1) * envelope_filter, axis=1)
+            envelope = np.abs(analytic)
+            envelope -= envelope.mean(axis=1, keepdims=True)
+            envelope_power += (np.abs(np.fft.rfft(envelope * window, axis=1)) ** 2).sum(axis=0)
+
+        n_segments += len(block)
+
+    if n_segments == 0:
+        raise ValueError("waveform is too short to analyse")
+
+    acceleration_psd = acceleration_power * psd_scale / n_segments
+    acceleration_psd[0] /= 2.0
+    envelope_psd = envelope_power * psd_scale / n_segments
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocity_psd = np.where(frequencies > 0,
+                                acceleration_psd / (2 * np.pi * frequencies) ** 2, 0.0)
+    velocity_psd *= 1e6  # (m/s)² -> (mm/s)²
+    band = _band_mask(frequencies, velocity_band)
+    velocity_rms = float(np.sqrt(velocity_psd[band].sum() * df))
+
+    result = {
+        'sample_rate': float(sample_rate),
+        'samples': n_segments * segment_size,
+        'duration_s': n_segments * segment_size / float(sample_rate),
+        'velocity_rms': velocity_rms,
+        'acceleration_rms': float(np.sqrt(sum_squares / (n_segments * segment_size))),
+        'acceleration_peak': peak,
+        'frequencies': frequencies,
+        # RMS amplitude per spectral line, corrected for the window bandwidth
+        'velocity_spectrum': np.sqrt(velocity_psd * df * HANN_ENBW),
+        'acceleration_spectrum': np.sqrt(acceleration_psd * df * HANN_ENBW),
+        'envelope_spectrum': np.sqrt(envelope_psd * df * HANN_ENBW),
+        'fault_bands': {},
+    }
+    if shaft_hz:
+        result['fault_bands'] = fault_band_energies(frequencies, envelope_psd * df,
+                                                    shaft_hz, bearing_orders)
+    return result
+
+
+def analyse_file(path, file_format=None, sample_rate=None, dtype='float32', column=0, **kwargs):
+    """Analyse a waveform file (WAV, raw binary or CSV) without loading it whole"""
+    if _file_format(path, file_format) != 'csv':
+        samples, rate, scale = open_waveform(path, file_format, sample_rate, dtype, column)
+        return analyse_waveform(samples, rate, scale=scale, **kwargs)
+
+    # CSV text cannot be mapped directly; convert it to raw float32 first
+    if sample_rate is None:
+        raise ValueError("sample_rate is required for raw binary and CSV captures")
+    raw_path = _csv_to_raw(path, column=column)
+    try:
+        samples, rate, scale = open_waveform(raw_path, 'bin', sample_rate)
+        result = analyse_waveform(samples, rate, scale=scale, **kwargs)
+        del samples
+        return result
+    finally:
+        os.unlink(raw_path)
+
+
+def analyse_upload(uploaded_file, **kwargs):
+    """Analyse a Streamlit upload by spooling it to a temporary file first"""
+    suffix = os.path.splitext(uploaded_file.name)[1]
+    handle, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            uploaded_file.seek(0)
+            shutil.copyfileobj(uploaded_file, stream, 1 << 20)
+        return analyse_file(path, **kwargs)
+    finally:
+        os.unlink(path)
+
+
+def summarise(point, result):
+    """Flat summary values of one measurement point for inspection_data"""
+    summary = {
+        f"{point}_velocity_rms": round(result['velocity_rms'], 2),
+        f"{point}_acceleration_rms": round(result['acceleration_rms'], 3),
+        f"{point}_acceleration_peak": round(result['acceleration_peak'], 3),
+    }
+    for name, energy in result['fault_bands'].items():
+        summary[f"{point}_{name}_energy"] = float(f"{energy:.4g}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse an accelerometer waveform")
+    parser.add_argument('path', help="WAV, raw binary or CSV capture")
+    parser.add_argument('--format', choices=['wav', 'bin', 'csv'], default=None)
+    parser.add_argument('--sample-rate', type=float, default=None,
+                        help="samples per second (raw binary and CSV only)")
+    parser.add_argument('--dtype', default='float32', help="sample type of raw binary captures")
+    parser.add_argument('--units', choices=['g', 'm/s2'], default='g')
+    parser.add_argument('--shaft-speed', type=float, default=None, help="shaft speed in RPM")
+    args = parser.parse_args(argv)
+
+    result = analyse_file(args.path, file_format=args.format, sample_rate=args.sample_rate,
+                          dtype=args.dtype, units=args.units,
+                          shaft_hz=args.shaft_speed / 60.0 if args.shaft_speed else None)
+    print(f"Duration:          {result['duration_s']:.1f} s at {result['sample_rate']:.0f} Hz")
+    print(f"Velocity RMS:      {result['velocity_rms']:.2f} mm/s")
+    print(f"Acceleration RMS:  {result['acceleration_rms']:.3f} m/s²")
+    print(f"Acceleration peak: {result['acceleration_peak']:.3f} m/s²")
+    for name, energy in result['fault_bands'].items():
+        print(f"{name.upper():>5} band energy: {energy:.4g}")
+
+
+if __name__ == "__main__":
+    main()